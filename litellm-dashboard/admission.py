@@ -0,0 +1,170 @@
+"""
+Per-model admission control for the metrics proxy.
+
+Each model_list entry in litellm_config.yaml can cap its concurrent upstream
+requests with litellm_params.max_parallel_requests. Requests beyond the cap
+wait in a bounded queue (model_info.max_queue, model_info.queue_timeout).
+Requests that find the queue full are rejected with 429, and requests that
+time out waiting are rejected with 503. Both carry a Retry-After estimate, so
+one slow provider can't tie up every worker.
+"""
+import math
+import threading
+import time
+from typing import Dict, Optional
+
+from upstream import deployment_name, find_model_entry
+
+# Used for entries that set max_parallel_requests but no queue settings
+DEFAULT_MAX_QUEUE = 0
+DEFAULT_QUEUE_TIMEOUT = 5.0
+# Weight of the newest hold time in the moving average used for Retry-After
+HOLD_TIME_ALPHA = 0.2
+# Most request models whose limiter lookup is cached (wildcard entries match any name)
+MAX_RESOLVED_MODELS = 1024
+
+
+class Rejected(Exception):
+    """Raised by ModelLimiter.acquire when a request is not admitted."""
+
+    def __init__(self, status: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class Slot:
+    """An admitted request's claim on its limiter; release() is idempotent."""
+
+    __slots__ = ('limiter', 'acquired', 'released')
+
+    def __init__(self, limiter: Optional['ModelLimiter']):
+        self.limiter = limiter
+        self.acquired = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            if self.limiter is not None:
+                self.limiter.release(time.monotonic() - self.acquired)
+
+
+class ModelLimiter:
+    """Concurrency cap with a bounded FIFO-ish wait queue for one deployment."""
+
+    def __init__(self, max_concurrency: int, max_queue: int = DEFAULT_MAX_QUEUE,
+                 queue_timeout: float = DEFAULT_QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "queue_timeout": 0}
+        self.hold_time = None  # Moving average of seconds a slot is held
+        self.condition = threading.Condition()
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free (caller holds the condition)."""
+        hold = self.hold_time or 1.0
+        return max(1, math.ceil(hold * (self.queued + 1) / self.max_concurrency))
+
+    def acquire(self) -> Slot:
+        """Take a slot, waiting in the queue if needed; raises Rejected on overload."""
+        with self.condition:
+            if self.in_flight < self.max_concurrency and not self.queued:
+                self.in_flight += 1
+                self.admitted += 1
+                return Slot(self)
+
+            if self.queued >= self.max_queue:
+                self.rejected["queue_full"] += 1
+                raise Rejected(429, self.retry_after(), "queue_full")
+
+            self.queued += 1
+            try:
+                admitted = self.condition.wait_for(lambda: self.in_flight < self.max_concurrency,
+                                                   self.queue_timeout)
+            finally:
+                self.queued -= 1
+
+            if not admitted:
+                self.rejected["queue_timeout"] += 1
+                raise Rejected(503, self.retry_after(), "queue_timeout")
+
+            self.in_flight += 1
+            self.admitted += 1
+            return Slot(self)
+
+    def release(self, held: float):
+        with self.condition:
+            self.in_flight -= 1
+            if self.hold_time is None:
+                self.hold_time = held
+            else:
+                self.hold_time += HOLD_TIME_ALPHA * (held - self.hold_time)
+            self.condition.notify()
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+                "mean_hold_time": self.hold_time
+            }
+
+
+class AdmissionController:
+    """One ModelLimiter per model_list entry that sets max_parallel_requests."""
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.deployments: Dict[str, ModelLimiter] = {}
+        # Resolved model -> limiter, only for models matching a model_list entry
+        self.models: Dict[str, Optional[ModelLimiter]] = {}
+        self.lock = threading.Lock()
+
+    def limiter(self, model: str) -> Optional[ModelLimiter]:
+        """Return the limiter for the deployment serving a model, or None if it is unlimited."""
+        if model in self.models:
+            return self.models[model]
+
+        limiter = None
+        entry = find_model_entry(self.config, model)
+        params = (entry or {}).get('litellm_params') or {}
+        if params.get('max_parallel_requests'):
+            info = entry.get('model_info') or {}
+            name = deployment_name(entry)
+            with self.lock:
+                # Models matching the same wildcard entry share its limiter
+                limiter = self.deployments.get(name)
+                if limiter is None:
+                    limiter = self.deployments[name] = ModelLimiter(
+                        int(params['max_parallel_requests']),
+                        max_queue=int(info.get('max_queue', DEFAULT_MAX_QUEUE)),
+                        queue_timeout=float(info.get('queue_timeout', DEFAULT_QUEUE_TIMEOUT))
+                    )
+
+        # The model comes from the client; don't let arbitrary names grow the cache
+        if entry is not None and len(self.models) < MAX_RESOLVED_MODELS:
+            self.models[model] = limiter
+        return limiter
+
+    def admit(self, model: str) -> Slot:
+        """Admit a request for a model; raises Rejected on overload."""
+        limiter = self.limiter(model)
+        if limiter is None:
+            return Slot(None)
+        return limiter.acquire()
+
+    def stats(self) -> Dict[str, dict]:
+        """Return limiter state per capped deployment that has seen traffic."""
+        with self.lock:
+            deployments = dict(self.deployments)
+        return {name: limiter.stats() for name, limiter in deployments.items()}
@@ -0,0 +1,289 @@
+"""
+Asyncio streaming proxy serving the same endpoints as the Flask servers.
+
+/chat/completions behaves like metrics_server.py (forwards the stream and
+records metrics) and /proxy-chat like server.py (interleaves metrics events).
+Every in-flight stream is a coroutine rather than a WSGI worker thread, so one
+process can hold thousands of concurrent streams. Metrics go to the same
+METRICS_LOG_PATH log, so metrics_server.py's /metrics endpoints include
+requests served here. Metrics are queued to a MetricsRecorder, so log writes
+(and the syncs and snapshots they can trigger) never run on the event loop.
+/metrics/stream pushes the same live events as
+metrics_server.py's, with one task per viewer instead of a worker thread.
+
+Run with: python async_proxy.py [port]
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+from live import AsyncMetricsBroadcaster
+from metrics_recorder import MetricsRecorder
+from metrics_store import MetricsStore
+from sse import TokenTimer, FIRST_TOKEN, DONE
+from upstream import load_litellm_config, model_timeout, DEFAULT_CONNECT_TIMEOUT, UPSTREAM_URL
+
+logging.basicConfig(level=logging.INFO)
+
+METRICS_CAPACITY = 10000
+METRICS_LOG_PATH = os.environ.get('METRICS_LOG_PATH', 'metrics_log.bin')
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 1000))
+
+metrics_store = MetricsStore(capacity=METRICS_CAPACITY, log_path=METRICS_LOG_PATH or None)
+# Written by a background thread in batches, off the event loop
+metrics_recorder = MetricsRecorder(
+    metrics_store,
+    log_sample_rate=float(os.environ.get('METRICS_LOG_SAMPLE_RATE', 0.01))
+)
+litellm_config = load_litellm_config()
+# Incremental samples and rollup deltas pushed to /metrics/stream viewers
+broadcaster = AsyncMetricsBroadcaster(metrics_store)
+
+SSE_HEADERS = {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'}
+
+
+def upstream_headers(request: web.Request) -> dict:
+    return {
+        "Content-Type": "application/json",
+        "Authorization": request.headers.get('Authorization', '')
+    }
+
+
+def upstream_timeout(model: str, stream: bool) -> aiohttp.ClientTimeout:
+    return aiohttp.ClientTimeout(
+        sock_connect=DEFAULT_CONNECT_TIMEOUT,
+        sock_read=model_timeout(litellm_config, model, stream)
+    )
+
+
+def failure_status(error: Exception) -> int:
+    """Status recorded for an upstream call that raised: 504 for timeouts, 502 otherwise."""
+    return 504 if isinstance(error, asyncio.TimeoutError) else 502
+
+
+async def chat_completions(request: web.Request) -> web.StreamResponse:
+    """Proxy chat completions and collect metrics"""
+    data = await request.json()
+    model = data.get('model', 'unknown')
+    session = request.app['upstream_session']
+    start_time = time.time()
+    start_ms = int(start_time * 1000)
+
+    if not data.get('stream', False):
+        try:
+            async with session.post(UPSTREAM_URL, headers=upstream_headers(request), json=data,
+                                    timeout=upstream_timeout(model, False)) as upstream:
+                body = await upstream.read()
+                total_time_ms = int(time.time() * 1000) - start_ms
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            metrics_recorder.record(model, ttft=None, generation_time=None,
+                                    total_time=int(time.time() * 1000) - start_ms, status=failure_status(e))
+            raise
+
+        logging.info(f"Non-streaming request completed in {total_time_ms} ms")
+        metrics_recorder.record(
+            model,
+            ttft=total_time_ms,  # For non-streaming, TTFT is the full time
+            generation_time=None,
+            total_time=total_time_ms,
+            status=upstream.status
+        )
+        return web.Response(body=body, status=upstream.status,
+                            content_type=upstream.content_type)
+
+    timer = TokenTimer()
+    response = web.StreamResponse(headers=SSE_HEADERS)
+    await response.prepare(request)
+    status = None
+    done = False
+
+    try:
+        async with session.post(UPSTREAM_URL, headers=upstream_headers(request), json=data,
+                                timeout=upstream_timeout(model, True)) as upstream:
+            status = upstream.status
+            async for raw_line in upstream.content:
+                line = raw_line.rstrip(b'\r\n')
+                if not line:
+                    continue
+
+                current_ms = int(time.time() * 1000)
+
+                # Forward the streaming response
+                await response.write(line + b'\n\n')
+
+                event = timer.feed(line, current_ms)
+
+                if event == FIRST_TOKEN:
+                    logging.info(f"TTFT: {timer.first_token_ms - start_ms} ms")
+
+                elif event == DONE:
+                    done = True
+                    total_time_ms = current_ms - start_ms
+                    logging.info(f"Total time: {total_time_ms} ms")
+
+                    # Inter-token stats are computed by the recorder thread
+                    metrics_recorder.record(
+                        model,
+                        ttft=timer.first_token_ms - start_ms if timer.first_token_ms else None,
+                        generation_time=timer.generation_time_ms,
+                        total_time=total_time_ms,
+                        status=status,
+                        token_times=timer.token_times
+                    )
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        status = failure_status(e)
+        raise
+    finally:
+        if not done:
+            # Error bodies, timeouts, resets and client disconnects never send [DONE];
+            # record them so error counts cover streaming traffic
+            status = status or 502
+            logging.warning(f"Stream for {model} ended without [DONE] (status {status})")
+            metrics_recorder.record(model, ttft=None, generation_time=None,
+                                    total_time=int(time.time() * 1000) - start_ms, status=status)
+
+    await response.write_eof()
+    return response
+
+
+async def proxy_chat(request: web.Request) -> web.StreamResponse:
+    """
+    Proxy the chat completion request to LiteLLM and measure latency metrics
+    """
+    data = await request.json()
+    model = data.get('model', 'unknown')
+    session = request.app['upstream_session']
+
+    # If not streaming, make regular request and return with metrics
+    if not data.get('stream', False):
+        start_ms = int(time.time() * 1000)
+
+        async with session.post(UPSTREAM_URL, headers=upstream_headers(request), json=data,
+                                timeout=upstream_timeout(model, False)) as upstream:
+            result = await upstream.json(content_type=None)
+
+        end_ms = int(time.time() * 1000)
+        total_time_ms = end_ms - start_ms
+
+        # Return both the API response and timing metrics
+        result['metrics'] = {
+            'start_time': start_ms,
+            'end_time': end_ms,
+            'total_time': total_time_ms,
+            'ttft': total_time_ms,  # For non-streaming, ttft = total time
+            'generation_time': 0
+        }
+        return web.json_response(result)
+
+    start_ms = int(time.time() * 1000)
+    timer = TokenTimer()
+    response = web.StreamResponse(headers=SSE_HEADERS)
+    await response.prepare(request)
+
+    def metrics_event(payload: dict) -> bytes:
+        return (json.dumps({'event': 'metrics', 'data': payload}) + '\n\n').encode('utf-8')
+
+    # Initialize with start time
+    await response.write(metrics_event({'start_time': start_ms}))
+
+    try:
+        async with session.post(UPSTREAM_URL, headers=upstream_headers(request), json=data,
+                                timeout=upstream_timeout(model, True)) as upstream:
+            async for raw_line in upstream.content:
+                line = raw_line.rstrip(b'\r\n')
+                if not line:
+                    continue
+
+                current_ms = int(time.time() * 1000)
+
+                # Forward the original data
+                await response.write(line + b'\n\n')
+
+                event = timer.feed(line, current_ms)
+
+                if event == FIRST_TOKEN:
+                    # Send first token metric
+                    await response.write(metrics_event({
+                        'first_token_time': timer.first_token_ms,
+                        'ttft': timer.first_token_ms - start_ms
+                    }))
+
+                elif event == DONE:
+                    # Send final metrics
+                    await response.write(metrics_event({
+                        'end_time': current_ms,
+                        'total_time': current_ms - start_ms,
+                        'generation_time': timer.generation_time_ms or 0,
+                        **timer.itl_stats()
+                    }))
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # Tell the client what happened instead of just cutting the stream
+        end_ms = int(time.time() * 1000)
+        await response.write(metrics_event({
+            'end_time': end_ms,
+            'total_time': end_ms - start_ms,
+            'error': str(e) or type(e).__name__,
+            'status': failure_status(e)
+        }))
+
+    await response.write_eof()
+    return response
+
+
+async def metrics_stream(request: web.Request) -> web.StreamResponse:
+    """Push new samples ('samples' events) and changed 10s rollup buckets ('rollup' events) over SSE"""
+    response = web.StreamResponse(headers={**SSE_HEADERS, 'X-Accel-Buffering': 'no'})
+    await response.prepare(request)
+
+    events = broadcaster.subscribe()
+    try:
+        async for event in events:
+            await response.write(event)
+    except ConnectionResetError:
+        # The viewer went away
+        pass
+    finally:
+        await events.aclose()
+    return response
+
+
+@web.middleware
+async def cors_preflight(request: web.Request, handler):
+    """Answer CORS preflight requests, like flask_cors.CORS on the Flask apps"""
+    if request.method == 'OPTIONS':
+        return web.Response()
+    return await handler(request)
+
+
+async def add_cors_headers(request: web.Request, response: web.StreamResponse):
+    # Runs before headers are sent, so it also covers streamed responses
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
+
+
+async def open_upstream_session(app: web.Application):
+    connector = aiohttp.TCPConnector(limit=UPSTREAM_POOL_SIZE, keepalive_timeout=60)
+    # SSE lines can exceed aiohttp's default 64 KiB line buffer
+    app['upstream_session'] = aiohttp.ClientSession(connector=connector, read_bufsize=2 ** 20)
+    yield
+    await app['upstream_session'].close()
+
+
+def create_app() -> web.Application:
+    app = web.Application(middlewares=[cors_preflight])
+    app.on_response_prepare.append(add_cors_headers)
+    app.cleanup_ctx.append(open_upstream_session)
+    app.router.add_post('/chat/completions', chat_completions)
+    app.router.add_post('/proxy-chat', proxy_chat)
+    app.router.add_get('/metrics/stream', metrics_stream)
+    return app
+
+
+if __name__ == '__main__':
+    web.run_app(create_app(), host='0.0.0.0', port=int(sys.argv[1]) if len(sys.argv) > 1 else 5002)
@@ -0,0 +1,179 @@
+"""
+Proxy overhead benchmark against the offline mock upstream.
+
+Starts mock_upstream.py and each proxy as subprocesses, then measures:
+
+- added latency: client TTFT and total time through the proxy minus the same
+  requests sent straight to the mock (p50/p99), with a fixed-latency profile
+- CPU per stream: proxy process CPU time (user + system) divided by streams
+- max concurrent streams: the highest concurrency level at which every stream
+  completed and (nearly) all were in flight at once, with long streams
+
+Run with: python bench_proxy.py [--proxies server metrics_server async_proxy]
+                                [--requests 200] [--concurrency 20]
+                                [--levels 50 100 200 500 1000]
+
+CPU time is read from /proc, so the CPU column is only filled in on Linux.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from bench_streaming import run_level, run_stream
+from latency import percentile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Fixed latency for the overhead runs, long streams for the concurrency runs
+PROFILES = {
+    "bench-short": {"ttft_ms": 100, "itl_ms": 5, "tokens": 50},
+    "bench-long": {"ttft_ms": 200, "itl_ms": 20, "tokens": 200}
+}
+
+# Proxy module -> (launch code, endpoint path)
+PROXIES = {
+    'server': ("import server; server.app.run(host='127.0.0.1', port={port}, threaded=True)", '/proxy-chat'),
+    'metrics_server': ("import metrics_server; metrics_server.app.run(host='127.0.0.1', port={port}, threaded=True)",
+                       '/chat/completions'),
+    'async_proxy': ("import async_proxy; async_proxy.web.run_app(async_proxy.create_app(), "
+                    "host='127.0.0.1', port={port}, access_log=None)", '/chat/completions')
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process exited with status {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+def cpu_seconds(pid: int):
+    """User + system CPU seconds of a process, or None where /proc is unavailable."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+async def run_requests(url: str, model: str, requests: int, concurrency: int) -> list:
+    """Send `requests` streaming requests, `concurrency` at a time; return (ttft, total) pairs."""
+    body = {"model": model, "messages": [{"role": "user", "content": "benchmark"}], "stream": True}
+    state = {'in_flight': 0, 'peak': 0}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(session):
+        async with semaphore:
+            return await run_stream(session, url, body, state)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        results = await asyncio.gather(*(one(session) for _ in range(requests)))
+    return [r for r in results if r is not None]
+
+
+def summarize(results: list) -> dict:
+    ttfts = [r[0] * 1000 for r in results]
+    totals = [r[1] * 1000 for r in results]
+    return {
+        "ttft_p50": percentile(ttfts, 50), "ttft_p99": percentile(ttfts, 99),
+        "total_p50": percentile(totals, 50), "total_p99": percentile(totals, 99)
+    }
+
+
+def start(args: list, env: dict, port: int) -> subprocess.Popen:
+    process = subprocess.Popen([sys.executable] + args, cwd=HERE, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port, process)
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Proxy overhead benchmark against the mock upstream")
+    parser.add_argument('--proxies', nargs='+', choices=list(PROXIES), default=list(PROXIES))
+    parser.add_argument('--requests', type=int, default=200, help="Streams per overhead run")
+    parser.add_argument('--concurrency', type=int, default=20, help="Concurrency of the overhead runs")
+    parser.add_argument('--levels', type=int, nargs='+', default=[50, 100, 200, 500, 1000],
+                        help="Concurrency levels for the max-concurrent-streams search")
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        json.dump(PROFILES, f)
+        profiles_path = f.name
+
+    mock_port = free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}/chat/completions"
+    mock = start(['mock_upstream.py', '--port', str(mock_port), '--profiles', profiles_path], dict(os.environ), mock_port)
+    processes = [mock]
+
+    try:
+        direct = summarize(asyncio.run(run_requests(mock_url, "bench-short", args.requests, args.concurrency)))
+        print(f"Direct to mock: TTFT p50 {direct['ttft_p50']:.1f} ms, p99 {direct['ttft_p99']:.1f} ms; "
+              f"total p50 {direct['total_p50']:.1f} ms, p99 {direct['total_p99']:.1f} ms")
+        print()
+        print(f"{'Proxy':<16} {'+TTFT p50':>10} {'+TTFT p99':>10} {'+Total p50':>11} {'+Total p99':>11} "
+              f"{'CPU/stream':>11} {'Max streams':>12}")
+        print("-" * 88)
+
+        # Proxies keep metrics in memory and talk to the mock
+        env = dict(os.environ, LITELLM_UPSTREAM_URL=mock_url, METRICS_LOG_PATH='')
+        for name in args.proxies:
+            code, path = PROXIES[name]
+            port = free_port()
+            proxy = start(['-c', code.format(port=port)], env, port)
+            processes.append(proxy)
+            url = f"http://127.0.0.1:{port}{path}"
+
+            try:
+                cpu_before = cpu_seconds(proxy.pid)
+                results = asyncio.run(run_requests(url, "bench-short", args.requests, args.concurrency))
+                cpu_after = cpu_seconds(proxy.pid)
+                proxied = summarize(results)
+
+                cpu = "n/a"
+                if cpu_before is not None and results:
+                    cpu = f"{(cpu_after - cpu_before) / len(results) * 1000:.2f} ms"
+
+                max_streams = 0
+                for level in args.levels:
+                    r = asyncio.run(run_level(url, level, "bench-long", "", timeout=120))
+                    if r["failed"] or r["peak_in_flight"] < 0.95 * level:
+                        break
+                    max_streams = level
+
+                added = {key: proxied[key] - direct[key] for key in direct}
+                print(f"{name:<16} {added['ttft_p50']:>8.1f}ms {added['ttft_p99']:>8.1f}ms "
+                      f"{added['total_p50']:>9.1f}ms {added['total_p99']:>9.1f}ms {cpu:>11} {max_streams:>12}")
+            finally:
+                proxy.terminate()
+                proxy.wait()
+                processes.remove(proxy)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        os.unlink(profiles_path)
+
+
+if __name__ == '__main__':
+    main()
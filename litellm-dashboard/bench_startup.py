@@ -0,0 +1,91 @@
+"""
+Startup benchmark: import time and resident memory of each proxy module.
+
+Imports every module in a fresh interpreter (several times, reporting the
+median), and lists any analytics libraries (pandas, matplotlib, numpy) the
+import pulled in. Proxy workers should start without them; they are loaded
+on first use by the chart endpoint.
+
+Run with: python bench_startup.py [--runs N] [--max-ms MS] [--max-rss-mb MB]
+Exits non-zero if a module exceeds a limit or loads an analytics library,
+so it can gate regressions in CI.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = ('server', 'metrics_server', 'async_proxy')
+HEAVY_MODULES = ('pandas', 'matplotlib', 'numpy')
+
+# Runs in the child interpreter; prints a JSON result line
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+try:
+    __import__({module!r})
+    error = None
+except Exception as e:
+    error = f"{{type(e).__name__}}: {{e}}"
+elapsed_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({{
+    "import_ms": elapsed_ms,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy": sorted(name for name in {heavy!r} if name in sys.modules),
+    "error": error
+}}))
+"""
+
+
+def probe(module: str = None) -> dict:
+    """Import a module (None for a bare interpreter) in a fresh process and return its measurements."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    # Keep metrics in memory so the benchmark doesn't create a log file
+    env = dict(os.environ, METRICS_LOG_PATH='')
+    code = PROBE.format(module=module or 'sys', heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, '-c', code], cwd=here, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure proxy module import time and RSS')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per module')
+    parser.add_argument('--max-ms', type=float, help='Fail if a median import takes longer')
+    parser.add_argument('--max-rss-mb', type=float, help='Fail if a median RSS is larger')
+    args = parser.parse_args()
+
+    baseline = [probe() for _ in range(args.runs)]
+    baseline_rss = statistics.median(run["rss_mb"] for run in baseline)
+    print(f"Bare interpreter: {baseline_rss:.1f} MB RSS, median of {args.runs} runs")
+
+    failed = False
+    for module in MODULES:
+        runs = [probe(module) for _ in range(args.runs)]
+        if runs[0]["error"]:
+            print(f"  {module:<16} import failed: {runs[0]['error']}")
+            failed = True
+            continue
+
+        import_ms = statistics.median(run["import_ms"] for run in runs)
+        rss_mb = statistics.median(run["rss_mb"] for run in runs)
+        heavy = runs[0]["heavy"]
+        print(f"  {module:<16} {import_ms:8.1f} ms  {rss_mb:6.1f} MB RSS (+{rss_mb - baseline_rss:5.1f} MB)"
+              f"  analytics libraries: {', '.join(heavy) or 'none'}")
+
+        if heavy:
+            failed = True
+        if args.max_ms is not None and import_ms > args.max_ms:
+            print(f"    import time over the {args.max_ms:.0f} ms limit")
+            failed = True
+        if args.max_rss_mb is not None and rss_mb > args.max_rss_mb:
+            print(f"    RSS over the {args.max_rss_mb:.0f} MB limit")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Concurrent streaming load test for the proxies.
+
+Opens N simultaneous streaming completions against each proxy URL and reports
+client-side TTFT percentiles, total time, failures and how many streams were
+actually in flight at once. Point the proxies at a slow streaming upstream
+(LITELLM_UPSTREAM_URL) so each stream stays open for a while, then compare e.g.
+
+    python metrics_server.py                 # Flask, port 5001
+    python async_proxy.py                    # asyncio, port 5002
+    python bench_streaming.py --concurrency 50 200 1000 \\
+        --url http://localhost:5001/chat/completions \\
+        --url http://localhost:5002/chat/completions
+"""
+import argparse
+import asyncio
+import time
+
+import aiohttp
+
+from latency import percentile
+from sse import has_content
+
+
+async def run_stream(session, url, body, state):
+    """Run one streaming request; return (ttft, total_time) in seconds or None on failure."""
+    start = time.perf_counter()
+    ttft = None
+
+    try:
+        async with session.post(url, json=body) as response:
+            if response.status != 200:
+                return None
+
+            state['in_flight'] += 1
+            state['peak'] = max(state['peak'], state['in_flight'])
+            try:
+                async for line in response.content:
+                    # The first chunk usually only carries the role (content ""), so parse it
+                    if ttft is None and has_content(line.rstrip()):
+                        ttft = time.perf_counter() - start
+            finally:
+                state['in_flight'] -= 1
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return None
+
+    return ttft or 0, time.perf_counter() - start
+
+
+async def run_level(url, concurrency, model, authorization, timeout):
+    body = {
+        "model": model,
+        "messages": [{"role": "user", "content": "Count from 1 to 50."}],
+        "stream": True
+    }
+    headers = {"Authorization": authorization} if authorization else {}
+    connector = aiohttp.TCPConnector(limit=0)
+    state = {'in_flight': 0, 'peak': 0}
+
+    async with aiohttp.ClientSession(connector=connector, headers=headers,
+                                     timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(run_stream(session, url, body, state) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r is not None]
+    ttfts = [r[0] for r in ok]
+    totals = [r[1] for r in ok]
+
+    return {
+        "url": url,
+        "concurrency": concurrency,
+        "completed": len(ok),
+        "failed": len(results) - len(ok),
+        "peak_in_flight": state['peak'],
+        "ttft_p50": percentile(ttfts, 50),
+        "ttft_p99": percentile(ttfts, 99),
+        "total_p50": percentile(totals, 50),
+        "total_p99": percentile(totals, 99),
+        "elapsed": elapsed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent streaming load test for the proxies")
+    parser.add_argument('--url', action='append', required=True, help="Proxy endpoint (repeatable)")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--model', default="gpt-4o")
+    parser.add_argument('--authorization', default="", help="Authorization header to forward")
+    parser.add_argument('--timeout', type=float, default=120, help="Per-level timeout (seconds)")
+    args = parser.parse_args()
+
+    print(f"{'URL':<40} {'Conc':>6} {'OK':>6} {'Fail':>6} {'Peak':>6} "
+          f"{'TTFT p50':>9} {'TTFT p99':>9} {'Total p50':>10} {'Total p99':>10} {'Wall':>7}")
+    print("-" * 120)
+
+    for url in args.url:
+        for concurrency in args.concurrency:
+            r = asyncio.run(run_level(url, concurrency, args.model, args.authorization, args.timeout))
+            print(f"{r['url']:<40} {r['concurrency']:>6} {r['completed']:>6} {r['failed']:>6} "
+                  f"{r['peak_in_flight']:>6} {r['ttft_p50']:>8.3f}s {r['ttft_p99']:>8.3f}s "
+                  f"{r['total_p50']:>9.3f}s {r['total_p99']:>9.3f}s {r['elapsed']:>6.1f}s")
+
+
+if __name__ == '__main__':
+    main()
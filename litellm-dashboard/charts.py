@@ -0,0 +1,155 @@
+"""
+Chart data and PNG rendering for /metrics/chart.
+
+Charts are cached per (data version, window, format, points) and only
+re-rendered when new samples have been recorded. PNGs are drawn with
+matplotlib's object-oriented API on the non-interactive Agg canvas, so no
+pyplot global state or open figures are involved. Series are downsampled
+with LTTB before plotting or returning them.
+
+matplotlib is imported on the first PNG render, so proxy workers that never
+draw a chart don't pay for it.
+"""
+import base64
+import io
+import math
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Tuple
+
+from metrics_store import MetricsStore
+
+CHART_FIELDS = ('ttft', 'total_time')
+# Points kept per model and metric (PNG and series)
+DEFAULT_POINTS = 500
+# Rendered charts kept; each entry is one (version, window, format, points)
+CACHE_SIZE = 16
+
+
+def lttb(xs: List[float], ys: List[float], threshold: int) -> List[Tuple[float, float]]:
+    """
+    Downsample a series with Largest-Triangle-Three-Buckets.
+
+    Keeps the first and last points and, from each of threshold - 2 buckets
+    in between, the point forming the largest triangle with the previously
+    kept point and the next bucket's average. NaN values are dropped first.
+
+    Returns:
+        List of (x, y) pairs
+    """
+    points = [(x, y) for x, y in zip(xs, ys) if not math.isnan(y)]
+    if threshold >= len(points) or threshold < 3:
+        return points
+
+    sampled = [points[0]]
+    bucket_size = (len(points) - 2) / (threshold - 2)
+    previous = points[0]
+
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+
+        # Average of the next bucket (the last point for the final bucket)
+        next_start, next_end = end, min(int((bucket + 2) * bucket_size) + 1, len(points))
+        if next_start >= next_end:
+            next_start, next_end = len(points) - 1, len(points)
+        count = next_end - next_start
+        avg_x = sum(point[0] for point in points[next_start:next_end]) / count
+        avg_y = sum(point[1] for point in points[next_start:next_end]) / count
+
+        best, best_area = None, -1.0
+        for point in points[start:end]:
+            area = abs((previous[0] - avg_x) * (point[1] - previous[1])
+                       - (previous[0] - point[0]) * (avg_y - previous[1]))
+            if area > best_area:
+                best, best_area = point, area
+
+        sampled.append(best)
+        previous = best
+
+    sampled.append(points[-1])
+    return sampled
+
+
+class ChartRenderer:
+    """Thread-safe, cached chart output for a MetricsStore."""
+
+    def __init__(self, store: MetricsStore, cache_size: int = CACHE_SIZE):
+        self.store = store
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[tuple, dict]" = OrderedDict()
+        self.renders = 0
+        self.lock = threading.Lock()
+
+    def _series(self, since: float, points: int) -> dict:
+        """Downsampled (timestamp, value) pairs per model and field."""
+        columns = self.store.series(CHART_FIELDS, since=since)
+        return {
+            model: {name: lttb(values['timestamp'], values[name], points) for name in CHART_FIELDS}
+            for model, values in columns.items()
+        }
+
+    def _png(self, series: dict) -> str:
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        fig = Figure(figsize=(10, 8))
+        FigureCanvasAgg(fig)
+        ax1, ax2 = fig.subplots(2, 1)
+
+        for ax, name, ylabel, title in (
+            (ax1, 'ttft', 'TTFT (ms)', 'Time to First Token by Model'),
+            (ax2, 'total_time', 'Total Time (ms)', 'Total Response Time by Model')
+        ):
+            for model, fields in series.items():
+                pairs = fields[name]
+                ax.plot([datetime.fromtimestamp(x) for x, _ in pairs], [y for _, y in pairs], 'o-', label=model)
+            ax.set_ylabel(ylabel)
+            ax.set_title(title)
+            ax.legend()
+            ax.grid(True)
+
+        fig.tight_layout()
+
+        img = io.BytesIO()
+        fig.savefig(img, format='png')
+        return base64.b64encode(img.getvalue()).decode('utf-8')
+
+    def chart(self, window: float = None, fmt: str = 'png', points: int = DEFAULT_POINTS, now: float = None) -> dict:
+        """
+        Return {"chart": base64 PNG} or {"series": {model: {field: [[ts, value], ...]}}}.
+
+        Args:
+            window: Only include the last `window` seconds (default: whole ring buffer)
+            fmt: 'png' or 'series'
+            points: Maximum points per model and field after downsampling
+        """
+        self.store.sync()
+        key = (self.store.version, window, fmt, points)
+
+        # Renders are serialized so concurrent requests for the same key render once
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache.move_to_end(key)
+                return cached
+
+            since = None
+            if window is not None:
+                since = (datetime.now().timestamp() if now is None else now) - window
+            series = self._series(since, points)
+
+            if fmt == 'series':
+                result = {"series": {
+                    model: {name: [list(pair) for pair in pairs] for name, pairs in fields.items()}
+                    for model, fields in series.items()
+                }}
+            else:
+                result = {"chart": self._png(series)}
+            self.renders += 1
+
+            self.cache[key] = result
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return result
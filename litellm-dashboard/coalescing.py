@@ -0,0 +1,115 @@
+import logging
+import threading
+from typing import Callable, Iterator, Optional
+
+
+class Flight:
+    """
+    One upstream call shared by every client that asked for the same thing.
+
+    A background thread publishes upstream lines (or a whole response) into
+    the flight; any number of clients read them back independently, each at
+    its own pace, including clients that join after lines were published.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.status: Optional[int] = None
+        self.model: Optional[str] = None  # Model that answered, if it differs from the requested one
+        self.response = None  # (content, status, headers) for non-streaming calls
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.condition = threading.Condition()
+
+    def set_status(self, status: int):
+        with self.condition:
+            self.status = status
+            self.condition.notify_all()
+
+    def publish(self, line: bytes):
+        with self.condition:
+            self.lines.append(line)
+            self.condition.notify_all()
+
+    def finish(self, response=None, error: BaseException = None):
+        with self.condition:
+            if response is not None:
+                self.response = response
+            if error is not None:
+                self.error = error
+            self.done = True
+            self.condition.notify_all()
+
+    def iter_lines(self, timeout: float = None) -> Iterator[bytes]:
+        """Yield every published line, waiting for new ones until the flight finishes."""
+        index = 0
+        while True:
+            with self.condition:
+                while index >= len(self.lines) and not self.done:
+                    if not self.condition.wait(timeout):
+                        return
+                batch = self.lines[index:]
+                finished = self.done
+            index += len(batch)
+            yield from batch
+            if finished and index >= len(self.lines):
+                return
+
+    def wait(self, timeout: float = None):
+        """Wait for a non-streaming flight; returns (content, status, headers) or None."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.done, timeout)
+            return self.response
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical upstream calls into one.
+
+    The first caller for a key starts `fetch(flight)` on a background thread;
+    callers arriving while it runs attach to the same Flight. The key is
+    released when the fetch finishes, so later callers start a fresh call.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.started = 0
+        self.coalesced = 0
+
+    def join(self, key: str, fetch: Callable[[Flight], None]) -> tuple:
+        """
+        Attach to the in-flight call for key, starting one if needed.
+
+        Returns:
+            (flight, started) where started is True if this call started the fetch
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = self.flights[key] = Flight()
+            self.started += 1
+
+        def run():
+            try:
+                fetch(flight)
+                flight.finish()
+            except Exception as e:
+                logging.warning(f"Coalesced upstream call failed: {e}")
+                flight.finish(error=e)
+            finally:
+                with self.lock:
+                    self.flights.pop(key, None)
+
+        threading.Thread(target=run, daemon=True).start()
+        return flight, True
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "upstream_calls": self.started,
+                "coalesced_requests": self.coalesced,
+                "in_flight": len(self.flights)
+            }
@@ -0,0 +1,324 @@
+"""
+Hedged streaming requests against slow first tokens.
+
+If the primary stream has produced no content once the model's hedge delay
+has passed, the same request is sent to the first fallback from
+litellm_settings.fallbacks. The delay is a percentile of that model's
+observed TTFT. The first stream to produce content is forwarded and the other
+one is closed. A primary that fails with a client error (4xx) is returned
+as-is, since the fallback would reject the same request.
+"""
+import logging
+import queue
+import threading
+import time
+from fnmatch import fnmatch
+from typing import Dict, List
+
+from metrics_store import DDSketch
+from sse import has_content
+from upstream import find_model_entry
+
+# TTFT percentile that triggers a hedge; model_info.hedge_percentile overrides it per model
+DEFAULT_PERCENTILE = 0.95
+# Until a model has this many TTFT samples, hedge after DEFAULT_DELAY_MS
+MIN_SAMPLES = 20
+DEFAULT_DELAY_MS = 2000
+# Never hedge sooner than this, however fast the model usually is
+MIN_DELAY_MS = 250
+# Client errors that a fallback may still answer (timeouts, rate limits)
+RETRYABLE_CLIENT_ERRORS = (408, 429)
+
+# Attempt events
+LINE = 1
+END = 2
+
+
+def is_client_error(status: int) -> bool:
+    """Whether a status means the request itself was rejected, so hedging can't help."""
+    return status is not None and 400 <= status < 500 and status not in RETRYABLE_CLIENT_ERRORS
+
+
+def fallback_models(config: dict, model: str) -> List[str]:
+    """
+    Return the concrete fallback models for a model from litellm_settings.fallbacks.
+
+    Chains keyed by the exact model come before wildcard chains ("openai/*").
+    Wildcard targets are skipped because they don't name a model to call.
+    A target that is a model_info.id is mapped to its model_name.
+    """
+    chains = (config.get('litellm_settings') or {}).get('fallbacks') or []
+    exact, wildcard = [], []
+    for chain in chains:
+        for key, targets in chain.items():
+            if key == model:
+                exact.extend(targets)
+            elif '*' in key and fnmatch(model, key):
+                wildcard.extend(targets)
+
+    models = []
+    for target in exact + wildcard:
+        if '*' in target:
+            continue
+        entry = find_model_entry(config, target)
+        name = entry['model_name'] if entry and '*' not in entry.get('model_name', '*') else target
+        if name != model and name not in models:
+            models.append(name)
+    return models
+
+
+class _Attempt:
+    """One upstream stream in a hedged request."""
+
+    def __init__(self, model: str, index: int):
+        self.model = model
+        self.index = index  # 0 for the primary, 1 for the hedge
+        self.started = time.perf_counter()
+        self.response = None
+        self.status = None
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        response = self.response
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+
+class HedgedStream:
+    """
+    A streaming upstream call that may be hedged with a fallback model.
+
+    Provides the parts of requests.Response the proxies use: status_code,
+    iter_lines() and close(), plus answered_model, the model whose stream is
+    forwarded.
+    """
+
+    def __init__(self, hedger: 'Hedger', url: str, model: str, headers: dict, data: dict):
+        self.hedger = hedger
+        self.url = url
+        self.model = model
+        self.headers = headers
+        self.data = data
+        self.events = queue.Queue()
+        self.attempts: List[_Attempt] = []
+        self.winner = None
+        self.fallbacks = hedger.fallbacks(model)
+        self._start(model)
+
+    @property
+    def status_code(self):
+        attempt = self.winner or self.attempts[0]
+        return attempt.status
+
+    @property
+    def answered_model(self) -> str:
+        attempt = self.winner or self.attempts[0]
+        return attempt.model
+
+    def _start(self, model: str):
+        attempt = _Attempt(model, len(self.attempts))
+        self.attempts.append(attempt)
+        body = self.data if model == self.model else {**self.data, 'model': model}
+        threading.Thread(target=self._run, args=(attempt, body), daemon=True).start()
+
+    def _run(self, attempt: _Attempt, body: dict):
+        try:
+            response = self.hedger.pool.post(self.url, attempt.model, headers=self.headers, json=body, stream=True)
+            attempt.response = response
+            attempt.status = response.status_code
+            if attempt.cancelled:
+                response.close()
+                return
+
+            for line in response.iter_lines():
+                if attempt.cancelled:
+                    return
+                if line:
+                    self.events.put((attempt, LINE, line))
+            self.events.put((attempt, END, None))
+        except Exception as e:
+            if not attempt.cancelled:
+                self.events.put((attempt, END, e))
+
+    def _hedge(self):
+        fallback = self.fallbacks[0]
+        logging.info(f"No first token from {self.model} after {self.hedger.delay_ms(self.model):.0f} ms, hedging with {fallback}")
+        self._start(fallback)
+
+    def _pick(self, attempt: _Attempt, content: bool):
+        self.winner = attempt
+        for other in self.attempts:
+            if other is not attempt:
+                other.cancel()
+
+        if content:
+            now = time.perf_counter()
+            self.hedger.observe(attempt.model, (now - attempt.started) * 1000)
+            # The losers had no first token yet, so their TTFT is at least their
+            # elapsed time. Leaving them out would keep only the fast samples and
+            # shrink the hedge delay with every hedge that wins.
+            for other in self.attempts:
+                if other is not attempt and other.status in (None, 200):
+                    self.hedger.observe(other.model, (now - other.started) * 1000)
+        if attempt.index > 0:
+            logging.info(f"Hedge to {attempt.model} won over {self.model}")
+        self.hedger.record(self.model, fired=len(self.attempts) > 1, won=attempt.index > 0)
+
+    def iter_lines(self):
+        """Yield the SSE lines of whichever stream produced content first."""
+        buffered: Dict[_Attempt, list] = {}
+        ended: Dict[_Attempt, Exception] = {}
+        deadline = None
+        if self.fallbacks:
+            deadline = time.perf_counter() + self.hedger.delay_ms(self.model) / 1000
+
+        try:
+            # Race until one stream produces content (or completes cleanly)
+            while self.winner is None:
+                timeout = None if deadline is None else max(deadline - time.perf_counter(), 0)
+                try:
+                    attempt, event, payload = self.events.get(timeout=timeout)
+                except queue.Empty:
+                    deadline = None
+                    self._hedge()
+                    continue
+
+                if event == LINE:
+                    buffered.setdefault(attempt, []).append(payload)
+                    if has_content(payload):
+                        self._pick(attempt, content=True)
+                    continue
+
+                ended[attempt] = payload
+                if payload is None and attempt.status == 200:
+                    self._pick(attempt, content=False)
+                elif attempt.index == 0 and payload is None and is_client_error(attempt.status):
+                    # A bad request fails the same way on the fallback; return it as-is
+                    self._pick(attempt, content=False)
+                elif deadline is not None:
+                    # The primary failed before the hedge delay; try the fallback now
+                    deadline = None
+                    self._hedge()
+                elif len(ended) == len(self.attempts):
+                    # Everything failed: surface the primary's response or error
+                    primary = self.attempts[0]
+                    if ended[primary] is not None and ended[attempt] is None:
+                        primary = attempt
+                    self._pick(primary, content=False)
+
+            winner = self.winner
+            yield from buffered.get(winner, ())
+            if winner in ended:
+                if ended[winner] is not None:
+                    raise ended[winner]
+                return
+
+            # Forward the rest of the winning stream
+            while True:
+                attempt, event, payload = self.events.get()
+                if attempt is not winner:
+                    continue
+                if event == LINE:
+                    yield payload
+                elif payload is not None:
+                    raise payload
+                else:
+                    return
+        finally:
+            self.close()
+
+    def close(self):
+        for attempt in self.attempts:
+            if attempt is not self.winner:
+                attempt.cancel()
+        if self.winner is not None and self.winner.response is not None:
+            self.winner.response.close()
+
+
+class Hedger:
+    """
+    Issues hedged streaming requests through an UpstreamPool.
+
+    Keeps a TTFT sketch per model (fed by the streams it serves) to derive
+    each model's hedge delay, and counts how often hedges fired and won.
+    """
+
+    def __init__(self,
+                 pool,
+                 config: dict = None,
+                 percentile: float = DEFAULT_PERCENTILE,
+                 min_samples: int = MIN_SAMPLES,
+                 default_delay_ms: float = DEFAULT_DELAY_MS,
+                 min_delay_ms: float = MIN_DELAY_MS):
+        """
+        Args:
+            pool: UpstreamPool used for both the primary and the hedge
+            config: Parsed litellm config (default: the pool's)
+            percentile: TTFT percentile (0-1) after which to hedge
+            min_samples: TTFT samples needed before the percentile is trusted
+            default_delay_ms: Hedge delay for models with too few samples
+            min_delay_ms: Lower bound on the hedge delay
+        """
+        self.pool = pool
+        self.config = pool.config if config is None else config
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default_delay_ms = default_delay_ms
+        self.min_delay_ms = min_delay_ms
+        self.sketches: Dict[str, DDSketch] = {}
+        self.counts: Dict[str, dict] = {}
+        self._fallbacks = {}
+        self.lock = threading.Lock()
+
+    def fallbacks(self, model: str) -> List[str]:
+        if model not in self._fallbacks:
+            self._fallbacks[model] = fallback_models(self.config, model)
+        return self._fallbacks[model]
+
+    def model_percentile(self, model: str) -> float:
+        entry = find_model_entry(self.config, model) or {}
+        return float((entry.get('model_info') or {}).get('hedge_percentile', self.percentile))
+
+    def delay_ms(self, model: str) -> float:
+        """Time to wait for a first token before hedging a request to this model."""
+        with self.lock:
+            sketch = self.sketches.get(model)
+            if sketch is None or sketch.count < self.min_samples:
+                return self.default_delay_ms
+            return max(sketch.quantile(self.model_percentile(model)), self.min_delay_ms)
+
+    def observe(self, model: str, ttft_ms: float):
+        with self.lock:
+            self.sketches.setdefault(model, DDSketch()).add(ttft_ms)
+
+    def record(self, model: str, fired: bool, won: bool):
+        with self.lock:
+            counts = self.counts.setdefault(model, {"requests": 0, "hedges_fired": 0, "hedges_won": 0})
+            counts["requests"] += 1
+            counts["hedges_fired"] += fired
+            counts["hedges_won"] += won
+
+    def stream(self, url: str, model: str, headers: dict, data: dict) -> HedgedStream:
+        """Start a streaming request that is hedged if its first token is late."""
+        return HedgedStream(self, url, model, headers, data)
+
+    def stats(self) -> dict:
+        """Return hedge counters and current hedge delay per model."""
+        with self.lock:
+            models = {model: dict(counts) for model, counts in self.counts.items()}
+        for model, counts in models.items():
+            counts["hedge_rate"] = counts["hedges_fired"] / counts["requests"]
+            counts["win_rate"] = counts["hedges_won"] / counts["hedges_fired"] if counts["hedges_fired"] else None
+            counts["delay_ms"] = self.delay_ms(model)
+            counts["fallbacks"] = self.fallbacks(model)
+
+        return {
+            "requests": sum(counts["requests"] for counts in models.values()),
+            "hedges_fired": sum(counts["hedges_fired"] for counts in models.values()),
+            "hedges_won": sum(counts["hedges_won"] for counts in models.values()),
+            "models": models
+        }
@@ -1,9 +1,38 @@
 import time
+import asyncio
+import json
+import math
+import statistics
 import openai
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import os
-from dataclasses import dataclass
-from typing import Optional
+import sys
+import csv
+import argparse
+import importlib.util
+from array import array
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import List, Optional, Union
+from sse import inter_token_stats
+from tokens import completion_tokens
+from metrics_store import DDSketch
+
+# Gaps between streamed chunks longer than this (seconds) count as stalls
+STALL_THRESHOLD = 1.0
+
+# Columns written per batch result (response_text is added on request)
+BATCH_FIELDS = (
+    'case_id', 'prompt_id', 'model', 'max_tokens', 'temperature', 'repetition', 'success', 'attempts',
+    'ttft', 'total_time', 'tokens_generated', 'tokens_per_second', 'mean_itl', 'p99_itl', 'max_itl',
+    'stalls', 'token_source'
+)
+# First retry waits this long (seconds), doubling for each further retry
+RETRY_BACKOFF = 0.5
+# Rows per Parquet row group when exporting
+PARQUET_BATCH_ROWS = 10000
+# Recorded request fields replay sets itself instead of forwarding
+REPLAY_MANAGED_FIELDS = ('model', 'messages', 'stream', 'stream_options', 'max_tokens', 'temperature', 'timestamp')
 
 @dataclass
 class LatencyResult:
@@ -12,21 +41,430 @@ class LatencyResult:
     model: str
     ttft: float  # Time to first token (seconds)
     total_time: float  # Total response time (seconds)
-    tokens_generated: int  # Approximate number of tokens
+    tokens_generated: int  # Completion tokens (see token_source)
     tokens_per_second: float  # Generation speed
     response_text: str  # The actual response
     success: bool
+    mean_itl: float = 0  # Mean inter-token latency (seconds)
+    p99_itl: float = 0  # 99th percentile inter-token latency (seconds)
+    max_itl: float = 0  # Longest gap between chunks (seconds)
+    stalls: int = 0  # Gaps longer than STALL_THRESHOLD
+    token_source: str = ""  # "usage" (reported by upstream), "tokenizer" or "estimate"
+    queue_wait: float = 0  # Time from scheduled arrival to send, included in ttft/total_time (seconds)
+
+
+@dataclass
+class ModelComparison:
+    """Repeated-sample latency comparison for one model."""
+    model: str
+    results: List[LatencyResult]
+    ttft_mean: float
+    ttft_ci: float  # Half-width of the 95% confidence interval (seconds)
+    tokens_per_second_mean: float
+    tokens_per_second_ci: float
+    errors: int
+    ttft_p_value: Optional[float] = None  # Mann-Whitney U vs. the lowest-TTFT model
+    tokens_per_second_p_value: Optional[float] = None
+
+
+@dataclass
+class LoadStage:
+    """One stage of a load test (use several for a ramp-up)."""
+    duration: float  # Stage length (seconds)
+    rps: float  # Target arrival rate (requests/second)
+    concurrency: int = 50  # Maximum requests in flight
+
+
+@dataclass
+class StageResult:
+    """Per-request results and aggregate metrics for one load stage."""
+    stage: LoadStage
+    results: List[LatencyResult]
+    ttft_p50: float
+    ttft_p90: float
+    ttft_p99: float
+    total_time_p50: float
+    total_time_p90: float
+    total_time_p99: float
+    queue_wait_p50: float
+    queue_wait_p99: float
+    throughput: float  # Completed requests per second
+    tokens_per_second: float  # Aggregate generation speed across all requests
+    errors: int
+    elapsed: float  # Wall-clock stage duration including drain (seconds)
+
+
+@dataclass
+class SuiteCase:
+    """One prompt x model x parameter set x repetition of a batch suite."""
+    case_id: str  # Stable id used to resume interrupted runs
+    prompt_id: str
+    prompt: str
+    messages: list
+    model: str
+    max_tokens: int
+    temperature: float
+    repetition: int
+
+
+def percentile(values: list, pct: float) -> float:
+    """
+    Linear-interpolated percentile of a list of numbers.
+    
+    Args:
+        values: Sample values (need not be sorted)
+        pct: Percentile in the range 0-100
+        
+    Returns:
+        The percentile, or 0 for an empty list
+    """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+# Two-sided 95% Student t critical values by degrees of freedom (1-30)
+T_CRITICAL_95 = [
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042
+]
+
+
+def mean_confidence_interval(values: list) -> tuple:
+    """
+    Mean and half-width of its 95% confidence interval (Student t).
+    
+    Args:
+        values: Sample values
+        
+    Returns:
+        (mean, half_width); half_width is 0 for fewer than two values
+    """
+    if not values:
+        return 0, 0
+    mean = statistics.fmean(values)
+    if len(values) < 2:
+        return mean, 0
+    df = len(values) - 1
+    t = T_CRITICAL_95[df - 1] if df <= len(T_CRITICAL_95) else 1.96
+    return mean, t * statistics.stdev(values) / math.sqrt(len(values))
+
+
+def mann_whitney_u(a: list, b: list) -> Optional[float]:
+    """
+    Two-sided p-value of the Mann-Whitney U test (normal approximation, tie-corrected).
+    
+    Rank-based, so it suits skewed latency distributions better than a t-test.
+    
+    Args:
+        a: First sample
+        b: Second sample
+        
+    Returns:
+        The p-value, or None if either sample is empty
+    """
+    if not a or not b:
+        return None
+    
+    combined = sorted([(value, 0) for value in a] + [(value, 1) for value in b])
+    n1, n2 = len(a), len(b)
+    n = n1 + n2
+    rank_sum_a = 0.0
+    tie_term = 0.0
+    i = 0
+    while i < n:
+        j = i
+        while j + 1 < n and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        average_rank = (i + j) / 2 + 1
+        ties = j - i + 1
+        tie_term += ties ** 3 - ties
+        rank_sum_a += average_rank * sum(1 for k in range(i, j + 1) if combined[k][1] == 0)
+        i = j + 1
+    
+    u = rank_sum_a - n1 * (n1 + 1) / 2
+    variance = n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (u - n1 * n2 / 2) / math.sqrt(variance)
+    return math.erfc(abs(z) / math.sqrt(2))
+
+
+def _parse_timestamp(value) -> Optional[float]:
+    """Convert an epoch number or ISO-8601 string to epoch seconds."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        # Captures written by the proxies use milliseconds
+        return value / 1000 if value > 1e11 else float(value)
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return None
+
+
+def iter_recorded_requests(path: str):
+    """
+    Lazily read a JSONL capture of chat requests, one line at a time.
+    
+    Each line is either a chat request body or a record wrapping one under
+    "body"/"request", with an optional "timestamp" (epoch or ISO-8601).
+    Lines that are not chat requests are skipped.
+    
+    Args:
+        path: Path to the JSONL file
+        
+    Yields:
+        (line_number, timestamp or None, request body) tuples
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            
+            if not isinstance(record, dict):
+                continue
+            
+            body = record.get('body', record.get('request', record))
+            if not isinstance(body, dict) or not body.get('messages'):
+                continue
+            
+            timestamp = _parse_timestamp(record.get('timestamp', body.get('timestamp')))
+            yield line_number, timestamp, body
+
+
+def _iter_suite_prompts(path: str):
+    """Lazily yield (prompt_id, record) from a JSONL prompt file; ids default to line numbers."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"prompt": record}
+            yield str(record.get('id', line_number)), record
+
+
+def iter_suite_cases(path: str,
+                     models: Optional[List[str]] = None,
+                     parameters: Optional[List[dict]] = None,
+                     repetitions: Optional[int] = None):
+    """
+    Lazily expand a prompt suite into SuiteCases (prompts x models x parameters x repetitions).
+    
+    A YAML suite has "prompts" (strings or {id, prompt or messages}) or a
+    "prompts_file" JSONL path relative to the suite, plus optional "models",
+    "parameters" (list of {max_tokens, temperature}) and "repetitions". A JSONL
+    suite is one prompt per line. Per-prompt "model"/"models", "max_tokens"
+    and "temperature" override the suite's.
+    
+    Args:
+        path: .yaml/.yml or .jsonl suite file
+        models: Override the suite's models
+        parameters: Override the suite's parameter sets
+        repetitions: Override the suite's repetitions
+        
+    Yields:
+        SuiteCase for every combination, one prompt at a time
+    """
+    if path.endswith(('.yaml', '.yml')):
+        import yaml
+        with open(path, 'r', encoding='utf-8') as f:
+            suite = yaml.safe_load(f) or {}
+        if suite.get('prompts_file'):
+            prompts = _iter_suite_prompts(os.path.join(os.path.dirname(path), suite['prompts_file']))
+        else:
+            prompts = (
+                (str(item.get('id', index)), item) if isinstance(item, dict) else (str(index), {"prompt": item})
+                for index, item in enumerate(suite.get('prompts') or [], 1)
+            )
+    else:
+        suite = {}
+        prompts = _iter_suite_prompts(path)
+    
+    models = models or suite.get('models') or ["gpt-3.5-turbo"]
+    parameters = parameters or suite.get('parameters') or [{}]
+    repetitions = repetitions or suite.get('repetitions', 1)
+    
+    for prompt_id, record in prompts:
+        messages = record.get('messages') or [{"role": "user", "content": record.get('prompt', '')}]
+        prompt = record.get('prompt') or str(messages[-1].get('content', ''))
+        prompt_models = record.get('models') or ([record['model']] if record.get('model') else models)
+        
+        for model in prompt_models:
+            for params in parameters:
+                max_tokens = record.get('max_tokens', params.get('max_tokens', 500))
+                temperature = record.get('temperature', params.get('temperature', 0.7))
+                for repetition in range(repetitions):
+                    yield SuiteCase(
+                        case_id=f"{prompt_id}|{model}|{max_tokens}|{temperature}|{repetition}",
+                        prompt_id=prompt_id,
+                        prompt=prompt,
+                        messages=messages,
+                        model=model,
+                        max_tokens=max_tokens,
+                        temperature=temperature,
+                        repetition=repetition
+                    )
+
+
+def iter_batch_results(path: str):
+    """
+    Stream result records back from a batch results file (.jsonl or .csv).
+    
+    A truncated last JSONL line (e.g. after an interrupt) is skipped. CSV
+    values are converted back to numbers and booleans.
+    """
+    if not os.path.exists(path):
+        return
+    
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(f):
+                for name, value in row.items():
+                    if value in ('True', 'False'):
+                        row[name] = value == 'True'
+                    elif name not in ('case_id', 'prompt_id', 'model', 'token_source', 'response_text'):
+                        try:
+                            row[name] = float(value)
+                        except (TypeError, ValueError):
+                            pass
+                yield row
+        else:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def truncate_partial_line(path: str, chunk_size: int = 65536):
+    """
+    Cut a JSONL file back to its last newline, dropping the partial record a killed run leaves behind.
+    
+    Only safe for JSONL, where every record is one line (CSV fields may contain newlines).
+    """
+    if not os.path.exists(path):
+        return
+    
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(position - chunk_size, 0)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b'\n')
+            if newline >= 0:
+                position = start + newline + 1
+                break
+            position = start
+        if position < end:
+            f.truncate(position)
+
+
+def summarize_batch_results(path: str) -> dict:
+    """
+    Per-model summary of a batch results file, streamed with quantile sketches.
+    
+    Returns:
+        Dictionary of model -> counts, TTFT/total-time percentiles (seconds),
+        mean tokens/sec and stalls
+    """
+    models = {}
+    for record in iter_batch_results(path):
+        summary = models.setdefault(record['model'], {
+            "cases": 0, "errors": 0, "retried": 0, "stalls": 0,
+            "ttft": DDSketch(), "total_time": DDSketch(), "tokens_per_second": DDSketch()
+        })
+        summary["cases"] += 1
+        if (record.get('attempts') or 1) > 1:
+            summary["retried"] += 1
+        if not record['success']:
+            summary["errors"] += 1
+            continue
+        for name in ('ttft', 'total_time', 'tokens_per_second'):
+            summary[name].add(record[name])
+        summary["stalls"] += int(record.get('stalls') or 0)
+    
+    report = {}
+    for model, summary in models.items():
+        ttft, total_time, speed = summary["ttft"], summary["total_time"], summary["tokens_per_second"]
+        report[model] = {
+            "cases": summary["cases"],
+            "errors": summary["errors"],
+            "retried": summary["retried"],
+            "ttft_p50": ttft.quantile(0.5),
+            "ttft_p95": ttft.quantile(0.95),
+            "ttft_p99": ttft.quantile(0.99),
+            "total_time_p50": total_time.quantile(0.5),
+            "total_time_p99": total_time.quantile(0.99),
+            "tokens_per_second_mean": speed.sum / speed.count if speed.count else None,
+            "stalls": summary["stalls"]
+        }
+    return report
+
+
+def export_csv(source_path: str, output_path: str, fields: tuple):
+    """Convert a JSONL results file to CSV, streaming one record at a time."""
+    with open(output_path, 'w', encoding='utf-8', newline='') as out:
+        writer = csv.DictWriter(out, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        for record in iter_batch_results(source_path):
+            writer.writerow(record)
+
+
+def export_parquet(source_path: str, output_path: str, fields: tuple):
+    """Convert a JSONL results file to Parquet in fixed-size row groups (requires pyarrow)."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    writer = None
+    rows = []
+    
+    def flush():
+        nonlocal writer
+        table = pa.Table.from_pylist(rows)
+        if writer is None:
+            writer = pq.ParquetWriter(output_path, table.schema)
+        writer.write_table(table.cast(writer.schema))
+        rows.clear()
+    
+    for record in iter_batch_results(source_path):
+        rows.append({name: record.get(name) for name in fields})
+        if len(rows) >= PARQUET_BATCH_ROWS:
+            flush()
+    if rows:
+        flush()
+    if writer is not None:
+        writer.close()
+
 
 class PromptLatencyTester:
     """Test latency for any OpenAI prompt."""
     
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, include_usage: bool = True):
         """
         Initialize the tester.
         
         Args:
             api_key: OpenAI API key. If None, uses OPENAI_API_KEY env var
+            include_usage: Ask for token usage in the final stream chunk
+                (disable for upstreams that reject stream_options)
         """
+        self.api_key = api_key
+        self.include_usage = include_usage
         if api_key:
             self.client = OpenAI(api_key=api_key)
         else:
@@ -61,7 +499,8 @@ class PromptLatencyTester:
         start_time = time.perf_counter()
         ttft = None
         response_parts = []
-        word_count = 0
+        chunk_times = array('d')  # Arrival time of each content chunk
+        usage = None
         
         try:
             # Use streaming to capture precise timing
@@ -70,7 +509,8 @@ class PromptLatencyTester:
                 messages=messages,
                 max_tokens=max_tokens,
                 temperature=temperature,
-                stream=True
+                stream=True,
+                **self._stream_options()
             )
             
             if verbose:
@@ -79,8 +519,12 @@ class PromptLatencyTester:
             for chunk in stream:
                 current_time = time.perf_counter()
                 
+                # The usage chunk (if requested) arrives last, with no choices
+                if getattr(chunk, 'usage', None):
+                    usage = chunk.usage
+                
                 # Check if chunk has content
-                if chunk.choices[0].delta.content:
+                if chunk.choices and chunk.choices[0].delta.content:
                     content = chunk.choices[0].delta.content
                     
                     # Capture time to first token
@@ -90,9 +534,9 @@ class PromptLatencyTester:
                             print(f"\n[First token at {ttft:.3f}s]", flush=True)
                             print("Response: ", end="", flush=True)
                     
-                    # Collect response and count words
+                    # Collect response
+                    chunk_times.append(current_time)
                     response_parts.append(content)
-                    word_count += len(content.split())
                     
                     if verbose:
                         print(content, end="", flush=True)
@@ -100,18 +544,21 @@ class PromptLatencyTester:
             total_time = time.perf_counter() - start_time
             full_response = "".join(response_parts)
             
-            # Calculate tokens per second (approximate)
-            tokens_per_second = word_count / total_time if total_time > 0 else 0
+            # Calculate tokens per second
+            tokens_generated, token_source = completion_tokens(usage, full_response, model)
+            tokens_per_second = tokens_generated / total_time if total_time > 0 else 0
             
             result = LatencyResult(
                 prompt=prompt,
                 model=model,
                 ttft=ttft or 0,
                 total_time=total_time,
-                tokens_generated=word_count,
+                tokens_generated=tokens_generated,
                 tokens_per_second=tokens_per_second,
                 response_text=full_response,
-                success=True
+                success=True,
+                token_source=token_source,
+                **inter_token_stats(chunk_times, STALL_THRESHOLD)
             )
             
             if verbose:
@@ -135,16 +582,602 @@ class PromptLatencyTester:
                 success=False
             )
     
+    async def _test_prompt_async(self,
+                                 client: AsyncOpenAI,
+                                 prompt: str,
+                                 model: str,
+                                 max_tokens: int,
+                                 temperature: float,
+                                 messages: Optional[list] = None,
+                                 scheduled: Optional[float] = None,
+                                 extra_body: Optional[dict] = None) -> LatencyResult:
+        """
+        Async counterpart of test_prompt used by the load generator (never prints).
+        
+        scheduled is the perf_counter() time the request was due to be sent; TTFT
+        and total time are measured from it, so time spent waiting for a
+        concurrency slot is not omitted. max_tokens or temperature of None are
+        left out of the request, and extra_body fields are sent as they are.
+        """
+        if messages is None:
+            messages = [{"role": "user", "content": prompt}]
+        
+        send_time = time.perf_counter()
+        start_time = send_time if scheduled is None else min(scheduled, send_time)
+        queue_wait = send_time - start_time
+        ttft = None
+        response_parts = []
+        chunk_times = array('d')
+        usage = None
+        
+        try:
+            params = {name: value for name, value in (('max_tokens', max_tokens), ('temperature', temperature))
+                      if value is not None}
+            if extra_body:
+                params['extra_body'] = extra_body
+            stream = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                **params,
+                **self._stream_options()
+            )
+            
+            async for chunk in stream:
+                current_time = time.perf_counter()
+                
+                if getattr(chunk, 'usage', None):
+                    usage = chunk.usage
+                
+                if chunk.choices and chunk.choices[0].delta.content:
+                    content = chunk.choices[0].delta.content
+                    
+                    if ttft is None:
+                        ttft = current_time - start_time
+                    
+                    chunk_times.append(current_time)
+                    response_parts.append(content)
+            
+            total_time = time.perf_counter() - start_time
+            full_response = "".join(response_parts)
+            tokens_generated, token_source = completion_tokens(usage, full_response, model)
+            
+            return LatencyResult(
+                prompt=prompt,
+                model=model,
+                ttft=ttft or 0,
+                total_time=total_time,
+                tokens_generated=tokens_generated,
+                tokens_per_second=tokens_generated / total_time if total_time > 0 else 0,
+                response_text=full_response,
+                success=True,
+                token_source=token_source,
+                queue_wait=queue_wait,
+                **inter_token_stats(chunk_times, STALL_THRESHOLD)
+            )
+            
+        except Exception:
+            return LatencyResult(
+                prompt=prompt,
+                model=model,
+                ttft=0,
+                total_time=0,
+                tokens_generated=0,
+                tokens_per_second=0,
+                response_text="",
+                success=False,
+                queue_wait=queue_wait
+            )
+    
+    async def _run_stage(self,
+                         client: AsyncOpenAI,
+                         stage: LoadStage,
+                         prompts: List[str],
+                         model: str,
+                         max_tokens: int,
+                         temperature: float) -> StageResult:
+        """Drive one stage with open-loop arrivals and aggregate its results."""
+        semaphore = asyncio.Semaphore(stage.concurrency)
+        interval = 1.0 / stage.rps
+        total_requests = max(1, int(stage.duration * stage.rps))
+        
+        async def fire(index: int, scheduled: float) -> LatencyResult:
+            async with semaphore:
+                return await self._test_prompt_async(
+                    client, prompts[index % len(prompts)], model, max_tokens, temperature,
+                    scheduled=scheduled
+                )
+        
+        stage_start = time.perf_counter()
+        tasks = []
+        
+        for i in range(total_requests):
+            # Arrivals follow the stage clock, not completions (open loop), and
+            # latency is measured from the scheduled arrival, so time queued
+            # behind the concurrency cap counts instead of being omitted
+            scheduled = stage_start + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(fire(i, scheduled)))
+        
+        results = list(await asyncio.gather(*tasks))
+        elapsed = time.perf_counter() - stage_start
+        
+        ok = [r for r in results if r.success]
+        ttfts = [r.ttft for r in ok]
+        totals = [r.total_time for r in ok]
+        queue_waits = [r.queue_wait for r in results]
+        tokens = sum(r.tokens_generated for r in ok)
+        
+        return StageResult(
+            stage=stage,
+            results=results,
+            ttft_p50=percentile(ttfts, 50),
+            ttft_p90=percentile(ttfts, 90),
+            ttft_p99=percentile(ttfts, 99),
+            total_time_p50=percentile(totals, 50),
+            total_time_p90=percentile(totals, 90),
+            total_time_p99=percentile(totals, 99),
+            queue_wait_p50=percentile(queue_waits, 50),
+            queue_wait_p99=percentile(queue_waits, 99),
+            throughput=len(ok) / elapsed if elapsed > 0 else 0,
+            tokens_per_second=tokens / elapsed if elapsed > 0 else 0,
+            errors=len(results) - len(ok),
+            elapsed=elapsed
+        )
+    
+    async def _run_load_test(self, prompts, stages, model, max_tokens, temperature, verbose):
+        client = AsyncOpenAI(api_key=self.api_key) if self.api_key else AsyncOpenAI()
+        stage_results = []
+        
+        try:
+            for number, stage in enumerate(stages, 1):
+                if verbose:
+                    print(f"\nStage {number}/{len(stages)}: {stage.rps} req/s for {stage.duration}s "
+                          f"(concurrency {stage.concurrency})")
+                
+                result = await self._run_stage(client, stage, prompts, model, max_tokens, temperature)
+                stage_results.append(result)
+                
+                if verbose:
+                    self._print_stage(result)
+        finally:
+            await client.close()
+        
+        return stage_results
+    
+    def run_load_test(self,
+                      prompts: Union[str, List[str]],
+                      stages: List[LoadStage],
+                      model: str = "gpt-3.5-turbo",
+                      max_tokens: int = 500,
+                      temperature: float = 0.7,
+                      verbose: bool = True) -> List[StageResult]:
+        """
+        Generate concurrent streaming load and measure latency under it.
+        
+        Args:
+            prompts: A prompt or list of prompts, used round-robin
+            stages: Load stages to run in order (e.g. increasing rps for a ramp-up)
+            model: OpenAI model to use
+            max_tokens: Maximum tokens to generate per request
+            temperature: Sampling temperature
+            verbose: Whether to print a summary per stage
+            
+        Returns:
+            List of StageResult, one per stage
+        """
+        if isinstance(prompts, str):
+            prompts = [prompts]
+        for stage in stages:
+            if stage.rps <= 0 or stage.duration <= 0 or stage.concurrency < 1:
+                raise ValueError(f"Invalid load stage {stage}: rps, duration and concurrency must be positive")
+        
+        return asyncio.run(
+            self._run_load_test(prompts, stages, model, max_tokens, temperature, verbose)
+        )
+    
+    async def _replay(self, path, output_path, speedup, concurrency, model, include_response, verbose):
+        client = AsyncOpenAI(api_key=self.api_key) if self.api_key else AsyncOpenAI()
+        loop = asyncio.get_running_loop()
+        # Acquired before each task is created, so at most `concurrency` requests
+        # (and their results) are held in memory however large the capture is
+        semaphore = asyncio.Semaphore(concurrency)
+        pending = set()
+        summary = {"requests": 0, "errors": 0, "late": 0}
+        
+        with open(output_path, 'a', encoding='utf-8') as out:
+            async def fire(line_number, offset, body):
+                try:
+                    messages = body['messages']
+                    last_content = messages[-1].get('content', '') if isinstance(messages[-1], dict) else ''
+                    result = await self._test_prompt_async(
+                        client,
+                        last_content if isinstance(last_content, str) else json.dumps(last_content),
+                        model or body.get('model', 'gpt-3.5-turbo'),
+                        body.get('max_tokens'),
+                        body.get('temperature'),
+                        messages=messages,
+                        # Everything else recorded (tools, stop, response_format, n, ...) is sent unchanged
+                        extra_body={name: value for name, value in body.items()
+                                    if name not in REPLAY_MANAGED_FIELDS}
+                    )
+                    
+                    record = asdict(result)
+                    if not include_response:
+                        del record['response_text']
+                    record['line'] = line_number
+                    record['offset'] = offset
+                    out.write(json.dumps(record) + '\n')
+                    out.flush()
+                    
+                    summary["requests"] += 1
+                    if not result.success:
+                        summary["errors"] += 1
+                    if verbose and summary["requests"] % 100 == 0:
+                        print(f"  {summary['requests']} requests replayed ({summary['errors']} failed)")
+                finally:
+                    semaphore.release()
+            
+            replay_start = loop.time()
+            first_timestamp = None
+            offset = 0.0
+            
+            try:
+                for line_number, timestamp, body in iter_recorded_requests(path):
+                    if timestamp is not None:
+                        if first_timestamp is None:
+                            first_timestamp = timestamp
+                        if speedup:
+                            offset = max(offset, (timestamp - first_timestamp) / speedup)
+                    
+                    delay = replay_start + offset - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    
+                    await semaphore.acquire()
+                    if loop.time() - (replay_start + offset) > 1.0:
+                        # The concurrency cap held this request back by more than a second
+                        summary["late"] += 1
+                    
+                    task = asyncio.create_task(fire(line_number, offset, body))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                
+                if pending:
+                    await asyncio.gather(*pending)
+            finally:
+                await client.close()
+        
+        summary["elapsed"] = loop.time() - replay_start
+        return summary
+    
+    def replay_requests(self,
+                        path: str,
+                        output_path: str,
+                        speedup: float = 1.0,
+                        concurrency: int = 100,
+                        model: Optional[str] = None,
+                        include_response: bool = False,
+                        verbose: bool = True) -> dict:
+        """
+        Replay a JSONL capture of chat requests with their recorded pacing.
+        
+        The capture is streamed line by line and every result is appended to
+        output_path as one JSON line as soon as the request finishes. Each
+        request is sent with its recorded body; only stream options (and the
+        model, when overridden) are replaced.
+        
+        Args:
+            path: JSONL capture to replay (see iter_recorded_requests)
+            output_path: JSONL file results are appended to
+            speedup: Divide recorded inter-arrival gaps by this factor; 0 sends as fast as possible
+            concurrency: Maximum requests in flight
+            model: Override the recorded model (e.g. to test a candidate config)
+            include_response: Whether to keep response_text in the output
+            verbose: Whether to print progress
+            
+        Returns:
+            Summary dict with request/error counts, late sends and elapsed seconds
+        """
+        if verbose:
+            print(f"Replaying {path} at {speedup or 'max'}x -> {output_path}")
+        
+        summary = asyncio.run(
+            self._replay(path, output_path, speedup, concurrency, model, include_response, verbose)
+        )
+        
+        if verbose:
+            print(f"Replayed {summary['requests']} requests ({summary['errors']} failed, "
+                  f"{summary['late']} sent late) in {summary['elapsed']:.1f}s")
+        
+        return summary
+    
+    async def _run_suite(self, cases, output_path, fields, concurrency, retries, verbose):
+        # Appending after a partial line would merge it with the next record
+        truncate_partial_line(output_path)
+        completed = {record.get('case_id') for record in iter_batch_results(output_path)}
+        client = AsyncOpenAI(api_key=self.api_key) if self.api_key else AsyncOpenAI()
+        # Acquired before each task is created, so memory stays bounded however large the suite is
+        semaphore = asyncio.Semaphore(concurrency)
+        pending = set()
+        progress = {"run": 0, "skipped": 0, "errors": 0}
+        
+        with open(output_path, 'a', encoding='utf-8') as out:
+            async def run_case(case: SuiteCase):
+                try:
+                    for attempt in range(1, retries + 2):
+                        result = await self._test_prompt_async(
+                            client, case.prompt, case.model, case.max_tokens, case.temperature,
+                            messages=case.messages
+                        )
+                        if result.success or attempt > retries:
+                            break
+                        await asyncio.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+                    
+                    record = asdict(result)
+                    record.update(asdict(case))
+                    record['attempts'] = attempt
+                    record = {name: record[name] for name in fields}
+                    out.write(json.dumps(record) + '\n')
+                    out.flush()
+                    
+                    progress["run"] += 1
+                    if not result.success:
+                        progress["errors"] += 1
+                    if verbose and progress["run"] % 100 == 0:
+                        print(f"  {progress['run']} cases run ({progress['errors']} failed)")
+                finally:
+                    semaphore.release()
+            
+            try:
+                for case in cases:
+                    if case.case_id in completed:
+                        progress["skipped"] += 1
+                        continue
+                    
+                    await semaphore.acquire()
+                    task = asyncio.create_task(run_case(case))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                
+                if pending:
+                    await asyncio.gather(*pending)
+            finally:
+                await client.close()
+        
+        return progress
+    
+    def run_suite(self,
+                  suite_path: str,
+                  output_path: str,
+                  models: Optional[List[str]] = None,
+                  parameters: Optional[List[dict]] = None,
+                  repetitions: Optional[int] = None,
+                  concurrency: int = 20,
+                  retries: int = 2,
+                  include_response: bool = False,
+                  verbose: bool = True) -> dict:
+        """
+        Run a prompt suite through a worker pool and stream results to a file.
+        
+        Every finished case is appended to the results file (or its JSONL
+        checkpoint) at once, so memory stays bounded and an interrupted run
+        resumes where it stopped when started again with the same output
+        (cases already in the file are skipped).
+        Failed cases are retried with exponential backoff.
+        
+        Args:
+            suite_path: YAML or JSONL suite (see iter_suite_cases)
+            output_path: .csv, .jsonl or .parquet results file; CSV and Parquet
+                are written at the end from a "<output>.partial.jsonl" checkpoint
+                (Parquet needs pyarrow)
+            models: Override the suite's models
+            parameters: Override the suite's parameter sets
+            repetitions: Override the suite's repetitions
+            concurrency: Maximum requests in flight
+            retries: Extra attempts for a failed case
+            include_response: Whether to keep response_text in the results
+            verbose: Whether to print progress and the summary report
+            
+        Returns:
+            Per-model summary (see summarize_batch_results); also written to
+            "<output>.summary.json"
+        """
+        fields = BATCH_FIELDS + (('response_text',) if include_response else ())
+        results_path = output_path
+        if output_path.endswith(('.csv', '.parquet')):
+            # CSV rows can span lines (response_text), so neither format is appended
+            # to directly; both are exported from a JSONL checkpoint at the end
+            results_path = output_path + '.partial.jsonl'
+        if output_path.endswith('.parquet') and importlib.util.find_spec('pyarrow') is None:
+            # Fail before running anything if the export can't happen
+            raise ImportError("Parquet output requires pyarrow (pip install pyarrow)")
+        
+        cases = iter_suite_cases(suite_path, models=models, parameters=parameters, repetitions=repetitions)
+        if verbose:
+            print(f"Running suite {suite_path} -> {output_path} (concurrency {concurrency}, {retries} retries)")
+        
+        try:
+            progress = asyncio.run(
+                self._run_suite(cases, results_path, fields, concurrency, retries, verbose)
+            )
+        except KeyboardInterrupt:
+            print(f"\nInterrupted; completed cases are in {results_path}, rerun the same command to resume")
+            raise
+        
+        if output_path.endswith('.csv'):
+            export_csv(results_path, output_path, fields)
+        elif output_path.endswith('.parquet'):
+            export_parquet(results_path, output_path, fields)
+        
+        report = summarize_batch_results(results_path)
+        with open(output_path + '.summary.json', 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        
+        if verbose:
+            print(f"Ran {progress['run']} cases ({progress['errors']} failed), "
+                  f"skipped {progress['skipped']} already completed")
+            self._print_suite_report(report)
+        
+        return report
+    
+    def _print_suite_report(self, report: dict):
+        """Print the per-model summary of a suite run."""
+        print(f"\n{'Model':<24} {'Cases':>6} {'Errors':>6} {'TTFT p50':>9} {'TTFT p95':>9} {'TTFT p99':>9} "
+              f"{'Total p50':>10} {'Total p99':>10} {'Tok/s':>7}")
+        print("-" * 100)
+        for model, r in sorted(report.items()):
+            if r["ttft_p50"] is None:
+                print(f"{model:<24} {r['cases']:>6} {r['errors']:>6}   (no successful cases)")
+                continue
+            print(f"{model:<24} {r['cases']:>6} {r['errors']:>6} {r['ttft_p50']:>8.3f}s {r['ttft_p95']:>8.3f}s "
+                  f"{r['ttft_p99']:>8.3f}s {r['total_time_p50']:>9.3f}s {r['total_time_p99']:>9.3f}s "
+                  f"{r['tokens_per_second_mean']:>7.1f}")
+    
+    def _print_stage(self, result: StageResult):
+        """Print formatted aggregates for one load stage."""
+        print(f"  Requests:      {len(result.results)} ({result.errors} failed) in {result.elapsed:.1f}s")
+        print(f"  TTFT p50/p90/p99:  {result.ttft_p50:.3f} / {result.ttft_p90:.3f} / {result.ttft_p99:.3f} s")
+        print(f"  Total p50/p90/p99: {result.total_time_p50:.3f} / {result.total_time_p90:.3f} / {result.total_time_p99:.3f} s")
+        print(f"  Queue wait p50/p99: {result.queue_wait_p50:.3f} / {result.queue_wait_p99:.3f} s")
+        print(f"  Throughput:    {result.throughput:.2f} req/s, {result.tokens_per_second:.1f} tokens/sec")
+    
+    def _stream_options(self) -> dict:
+        """Extra create() arguments asking for usage in the final stream chunk."""
+        if self.include_usage:
+            return {"stream_options": {"include_usage": True}}
+        return {}
+    
     def _print_metrics(self, result: LatencyResult):
         """Print formatted metrics."""
         print("LATENCY METRICS:")
         print(f"  Time to First Token: {result.ttft:.3f} seconds")
         print(f"  Total Response Time: {result.total_time:.3f} seconds")
-        print(f"  Tokens Generated:    {result.tokens_generated}")
+        print(f"  Tokens Generated:    {result.tokens_generated} ({result.token_source})")
         print(f"  Generation Speed:    {result.tokens_per_second:.1f} tokens/sec")
+        print(f"  Inter-token Latency: {result.mean_itl * 1000:.1f} ms mean, {result.p99_itl * 1000:.1f} ms p99")
+        print(f"  Longest Gap:         {result.max_itl:.3f} seconds ({result.stalls} stalls > {STALL_THRESHOLD}s)")
         print(f"  Model Used:          {result.model}")
         print("="*60)
     
+    async def _compare_async(self, prompt, models, repetitions, concurrency, max_tokens, temperature):
+        client = AsyncOpenAI(api_key=self.api_key) if self.api_key else AsyncOpenAI()
+        semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+        
+        # Interleave models (rotating the order each round) so every model
+        # samples the same network conditions
+        schedule = []
+        for round_number in range(repetitions):
+            offset = round_number % len(models)
+            schedule.extend(models[offset:] + models[:offset])
+        
+        async def fire(model):
+            if semaphore is None:
+                return await self._test_prompt_async(client, prompt, model, max_tokens, temperature)
+            async with semaphore:
+                return await self._test_prompt_async(client, prompt, model, max_tokens, temperature)
+        
+        try:
+            results = await asyncio.gather(*(fire(model) for model in schedule))
+        finally:
+            await client.close()
+        
+        by_model = {model: [] for model in models}
+        for result in results:
+            by_model[result.model].append(result)
+        return by_model
+    
+    def compare_models(self, 
+                       prompt: str, 
+                       models: list = None,
+                       repetitions: int = 10,
+                       concurrency: int = None,
+                       max_tokens: int = 500,
+                       temperature: float = 0.7) -> dict:
+        """
+        Compare models on the same prompt with repeated samples run concurrently.
+        
+        All models x repetitions requests run at once (interleaved by model),
+        so the comparison takes about as long as the slowest model and every
+        model sees the same network conditions.
+        
+        Args:
+            prompt: The prompt to test
+            models: List of models to test
+            repetitions: Samples per model
+            concurrency: Maximum requests in flight (default: all at once)
+            max_tokens: Maximum tokens to generate
+            temperature: Sampling temperature
+            
+        Returns:
+            Dictionary of model -> ModelComparison, with confidence intervals
+            and p-values against the model with the lowest mean TTFT
+        """
+        if models is None:
+            models = ["gpt-3.5-turbo", "gpt-4"]
+        
+        print("Comparing models for prompt:")
+        print(f"'{prompt[:100]}{'...' if len(prompt) > 100 else ''}'")
+        print(f"{repetitions} samples per model, {concurrency or 'all'} in flight")
+        print("="*80)
+        
+        start_time = time.perf_counter()
+        samples = asyncio.run(
+            self._compare_async(prompt, models, repetitions, concurrency, max_tokens, temperature)
+        )
+        elapsed = time.perf_counter() - start_time
+        
+        comparisons = {}
+        for model, results in samples.items():
+            ok = [r for r in results if r.success]
+            ttft_mean, ttft_ci = mean_confidence_interval([r.ttft for r in ok])
+            speed_mean, speed_ci = mean_confidence_interval([r.tokens_per_second for r in ok])
+            comparisons[model] = ModelComparison(
+                model=model,
+                results=results,
+                ttft_mean=ttft_mean,
+                ttft_ci=ttft_ci,
+                tokens_per_second_mean=speed_mean,
+                tokens_per_second_ci=speed_ci,
+                errors=len(results) - len(ok)
+            )
+        
+        # Test every other model against the one with the lowest mean TTFT
+        succeeded = [c for c in comparisons.values() if c.errors < len(c.results)]
+        if succeeded:
+            best = min(succeeded, key=lambda c: c.ttft_mean)
+            best_ok = [r for r in best.results if r.success]
+            for comparison in succeeded:
+                if comparison is best:
+                    continue
+                ok = [r for r in comparison.results if r.success]
+                comparison.ttft_p_value = mann_whitney_u([r.ttft for r in ok], [r.ttft for r in best_ok])
+                comparison.tokens_per_second_p_value = mann_whitney_u(
+                    [r.tokens_per_second for r in ok], [r.tokens_per_second for r in best_ok]
+                )
+        
+        # Print comparison summary
+        print("\n" + "="*80)
+        print(f"COMPARISON SUMMARY ({elapsed:.1f}s, 95% CI, p-values vs. lowest TTFT)")
+        print("="*80)
+        print(f"{'Model':<20} {'TTFT (s)':<18} {'p':<7} {'Speed (tok/s)':<18} {'p':<7} {'Failed'}")
+        print("-" * 80)
+        
+        for model, c in sorted(comparisons.items(), key=lambda item: item[1].ttft_mean):
+            if c.errors == len(c.results):
+                print(f"{model:<20} {'N/A':<18} {'':<7} {'N/A':<18} {'':<7} {c.errors}/{len(c.results)}")
+                continue
+            
+            ttft = f"{c.ttft_mean:.3f} ± {c.ttft_ci:.3f}"
+            speed = f"{c.tokens_per_second_mean:.1f} ± {c.tokens_per_second_ci:.1f}"
+            ttft_p = "-" if c.ttft_p_value is None else f"{c.ttft_p_value:.3f}"
+            speed_p = "-" if c.tokens_per_second_p_value is None else f"{c.tokens_per_second_p_value:.3f}"
+            print(f"{model:<20} {ttft:<18} {ttft_p:<7} {speed:<18} {speed_p:<7} {c.errors}/{len(c.results)}")
+        
+        return comparisons
+    
     def compare_models_for_prompt(self, 
                                  prompt: str, 
                                  models: list = None,
@@ -152,6 +1185,9 @@ class PromptLatencyTester:
         """
         Test the same prompt across multiple models.
         
+        Runs one request per model, one after another. Use compare_models for
+        repeated concurrent samples with confidence intervals.
+        
         Args:
             prompt: The prompt to test
             models: List of models to test
@@ -200,7 +1236,6 @@ class PromptLatencyTester:
         
         return results
 
-
 def quick_test(prompt: str, model: str = "gpt-3.5-turbo", **kwargs):
     """
     Quick function to test a prompt without creating a class instance.
@@ -214,13 +1249,34 @@ def quick_test(prompt: str, model: str = "gpt-3.5-turbo", **kwargs):
     return tester.test_prompt(prompt, model=model, **kwargs)
 
 
+def parse_stages(value: str) -> List[LoadStage]:
+    """
+    Parse comma-separated rps:seconds:concurrency load stages (an argparse type).
+    
+    Raises:
+        argparse.ArgumentTypeError: For malformed or non-positive stages
+    """
+    stages = []
+    for spec in value.split(','):
+        try:
+            rps, duration, concurrency = spec.strip().split(':')
+            stage = LoadStage(duration=float(duration), rps=float(rps), concurrency=int(concurrency))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid stage '{spec.strip()}', expected rps:seconds:concurrency")
+        if stage.rps <= 0 or stage.duration <= 0 or stage.concurrency < 1:
+            raise argparse.ArgumentTypeError(f"Invalid stage '{spec.strip()}': values must be positive")
+        stages.append(stage)
+    return stages
+
+
 def main():
     """Interactive prompt testing."""
     tester = PromptLatencyTester()
     
     print("OpenAI Prompt Latency Tester")
     print("="*40)
-    print("Enter 'quit' to exit, 'compare' to test multiple models")
+    print("Enter 'quit' to exit, 'compare' to test multiple models, 'load' to run a load test,")
+    print("'replay' to replay a JSONL capture")
     
     while True:
         print("\nEnter your prompt:")
@@ -242,7 +1298,36 @@ def main():
                 else:
                     models = ["gpt-3.5-turbo", "gpt-4"]
                 
-                tester.compare_models_for_prompt(compare_prompt, models)
+                repetitions = int(input("Samples per model [10]: ").strip() or 10)
+                tester.compare_models(compare_prompt, models, repetitions=repetitions)
+            continue
+        
+        if user_prompt.lower() == 'load':
+            print("\nEnter prompt for load test:")
+            load_prompt = input("> ").strip()
+            if load_prompt:
+                print("\nEnter model [gpt-3.5-turbo]: ", end="")
+                model_choice = input().strip() or "gpt-3.5-turbo"
+                print("\nEnter stages as rps:seconds:concurrency, comma-separated:")
+                stages_input = input("Stages [1:30:10,5:30:50]: ").strip() or "1:30:10,5:30:50"
+                
+                try:
+                    stages = parse_stages(stages_input)
+                except argparse.ArgumentTypeError as e:
+                    print(f"Error: {e}")
+                    continue
+                
+                tester.run_load_test(load_prompt, stages, model=model_choice)
+            continue
+        
+        if user_prompt.lower() == 'replay':
+            capture_path = input("Capture file: ").strip()
+            if capture_path:
+                output_path = input("Results file [replay_results.jsonl]: ").strip() or "replay_results.jsonl"
+                speedup = float(input("Speed-up factor (0 = no pacing) [1]: ").strip() or 1)
+                model_override = input("Model override [recorded]: ").strip() or None
+                
+                tester.replay_requests(capture_path, output_path, speedup=speedup, model=model_override)
             continue
         
         if not user_prompt:
@@ -257,8 +1342,64 @@ def main():
         result = tester.test_prompt(user_prompt, model=model_choice)
 
 
+def batch_main(argv: List[str]):
+    """Command-line batch mode: python latency.py batch SUITE -o OUTPUT [options]."""
+    parser = argparse.ArgumentParser(prog="latency.py batch", description="Run a prompt suite and export results")
+    parser.add_argument('suite', help="YAML or JSONL prompt suite")
+    parser.add_argument('-o', '--output', default="batch_results.csv", help="Results file (.csv, .jsonl or .parquet)")
+    parser.add_argument('--models', help="Comma-separated models (overrides the suite)")
+    parser.add_argument('--max-tokens', type=int, help="Overrides the suite's parameter sets")
+    parser.add_argument('--temperature', type=float, help="Overrides the suite's parameter sets")
+    parser.add_argument('--repetitions', type=int, help="Overrides the suite's repetitions")
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--retries', type=int, default=2)
+    parser.add_argument('--include-response', action='store_true', help="Keep response_text in the results")
+    args = parser.parse_args(argv)
+    
+    parameters = None
+    if args.max_tokens is not None or args.temperature is not None:
+        parameters = [{name: value for name, value in
+                       (('max_tokens', args.max_tokens), ('temperature', args.temperature)) if value is not None}]
+    
+    PromptLatencyTester().run_suite(
+        args.suite,
+        args.output,
+        models=[m.strip() for m in args.models.split(',')] if args.models else None,
+        parameters=parameters,
+        repetitions=args.repetitions,
+        concurrency=args.concurrency,
+        retries=args.retries,
+        include_response=args.include_response
+    )
+
+
+def load_main(argv: List[str]):
+    """Command-line load test: python latency.py load PROMPT --stages 1:30:10,5:30:50 [options]."""
+    parser = argparse.ArgumentParser(prog="latency.py load", description="Run an open-loop streaming load test")
+    parser.add_argument('prompt')
+    parser.add_argument('--stages', type=parse_stages, default=parse_stages("1:30:10,5:30:50"),
+                        help="Comma-separated rps:seconds:concurrency stages")
+    parser.add_argument('--model', default="gpt-3.5-turbo")
+    parser.add_argument('--max-tokens', type=int, default=500)
+    parser.add_argument('--temperature', type=float, default=0.7)
+    args = parser.parse_args(argv)
+    
+    PromptLatencyTester().run_load_test(
+        args.prompt,
+        args.stages,
+        model=args.model,
+        max_tokens=args.max_tokens,
+        temperature=args.temperature
+    )
+
+
 if __name__ == "__main__":
     # For quick testing, you can also use:
     # result = quick_test("Explain quantum computing in simple terms")
     
-    main()
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        batch_main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'load':
+        load_main(sys.argv[2:])
+    else:
+        main()
\ No newline at end of file
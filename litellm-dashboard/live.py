@@ -0,0 +1,197 @@
+"""
+Live metrics fan-out for /metrics/stream.
+
+One publisher thread polls the MetricsStore and encodes each update exactly
+once as an SSE event. New samples go out every interval, and the changed 10s
+rollup buckets every rollup interval. Events are appended to a shared ring
+buffer. Every subscriber reads the same encoded bytes at its own pace, so an
+extra viewer costs no extra serialization or store queries. Subscribers that
+fall further behind than the ring are told to resynchronise.
+
+MetricsBroadcaster.subscribe() blocks a thread per viewer, so under a WSGI
+server it needs threaded or gevent workers and a cap on subscribers.
+AsyncMetricsBroadcaster serves viewers from an asyncio app (async_proxy.py)
+with one task each.
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Iterator
+
+from metrics_store import MetricsStore
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_ROLLUP_INTERVAL = 10.0
+ROLLUP_WINDOW = '10s'
+# Encoded events kept for subscribers that are catching up
+RING_SIZE = 256
+# Comment line sent to idle subscribers so proxies keep the connection open
+HEARTBEAT_SECONDS = 15
+
+
+def sse_event(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+class MetricsBroadcaster:
+    """Publishes incremental metrics events once and fans them out to every subscriber."""
+
+    def __init__(self,
+                 store: MetricsStore,
+                 interval: float = DEFAULT_INTERVAL,
+                 rollup_interval: float = DEFAULT_ROLLUP_INTERVAL,
+                 ring_size: int = RING_SIZE):
+        self.store = store
+        self.interval = interval
+        self.rollup_interval = rollup_interval
+        self.events = deque(maxlen=ring_size)  # (sequence, encoded event)
+        self.sequence = 0
+        self.subscribers = 0
+        self.condition = threading.Condition()
+        self.version = None
+        self.rollup_since = None
+        self.thread = None
+
+    def _publish(self, event: bytes):
+        with self.condition:
+            self.sequence += 1
+            self.events.append((self.sequence, event))
+            self.condition.notify_all()
+
+    def poll(self, now: float = None):
+        """Publish samples recorded since the last poll and, when due, changed rollup buckets."""
+        now = time.time() if now is None else now
+        if self.version is None:
+            # Start from the present; subscribers only get new samples
+            self.version, _ = self.store.rows_since(self.store.version)
+            self.rollup_since = now
+            return
+
+        self.version, rows = self.store.rows_since(self.version)
+        if rows:
+            self._publish(sse_event('samples', rows))
+
+        if now - self.rollup_since >= self.rollup_interval:
+            # Buckets still open at the last push may have changed since, so they are sent again
+            buckets = self.store.rollup(ROLLUP_WINDOW, since=self.rollup_since)
+            buckets = {model: rows for model, rows in buckets.items() if rows}
+            if buckets:
+                self._publish(sse_event('rollup', {"window": ROLLUP_WINDOW, "models": buckets}))
+            self.rollup_since = now
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            # Idle publishers do no store work
+            if self.subscribers:
+                self.poll()
+            else:
+                self.version = None
+
+    def _ensure_started(self):
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='metrics-broadcaster', daemon=True)
+                self.thread.start()
+
+    def subscribe(self) -> Iterator[bytes]:
+        """Yield SSE events from now on, with heartbeats while idle."""
+        self._ensure_started()
+        with self.condition:
+            self.subscribers += 1
+            position = self.sequence
+
+        try:
+            yield b": connected\n\n"
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.sequence > position, HEARTBEAT_SECONDS)
+                    pending, missed = self._pending(position)
+
+                if missed:
+                    # Events were overwritten before we read them
+                    yield sse_event('resync', {"missed": missed})
+                if not pending:
+                    yield b": heartbeat\n\n"
+                    continue
+
+                for sequence, event in pending:
+                    yield event
+                position = pending[-1][0]
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
+    def _pending(self, position: int) -> tuple:
+        """Return (events after position, events already overwritten); caller holds the condition."""
+        pending = [(sequence, event) for sequence, event in self.events if sequence > position]
+        missed = pending[0][0] - position - 1 if pending else 0
+        return pending, missed
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {"subscribers": self.subscribers, "events_published": self.sequence}
+
+
+class AsyncMetricsBroadcaster(MetricsBroadcaster):
+    """MetricsBroadcaster for asyncio servers: a publisher task and one task per viewer instead of threads."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.changed = None  # asyncio.Event replaced after every publish
+        self.task = None
+
+    def _wake(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    async def _run_async(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self.subscribers:
+                self.version = None
+                continue
+
+            sequence = self.sequence
+            # Store reads can fold a batch of log records; keep them off the event loop
+            await loop.run_in_executor(None, self.poll)
+            if self.sequence != sequence:
+                self._wake()
+
+    def _ensure_started(self):
+        if self.task is None:
+            self.changed = asyncio.Event()
+            self.task = asyncio.ensure_future(self._run_async())
+
+    async def subscribe(self) -> AsyncIterator[bytes]:
+        """Yield SSE events from now on, with heartbeats while idle."""
+        self._ensure_started()
+        self.subscribers += 1
+        position = self.sequence
+
+        try:
+            yield b": connected\n\n"
+            while True:
+                if self.sequence <= position:
+                    try:
+                        await asyncio.wait_for(self.changed.wait(), HEARTBEAT_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+
+                with self.condition:
+                    pending, missed = self._pending(position)
+
+                if missed:
+                    yield sse_event('resync', {"missed": missed})
+                if not pending:
+                    yield b": heartbeat\n\n"
+                    continue
+
+                for sequence, event in pending:
+                    yield event
+                position = pending[-1][0]
+        finally:
+            self.subscribers -= 1
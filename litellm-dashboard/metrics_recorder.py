@@ -0,0 +1,192 @@
+"""
+Background metrics ingestion for the proxies.
+
+Request handlers hand a finished request's raw measurements to
+MetricsRecorder.record(), which is a non-blocking put on a bounded queue. A
+daemon thread drains the queue in batches. For each batch it computes
+inter-token stats, writes everything to the MetricsStore in one call, feeds
+the span stats, and emits sampled structured log lines. When the queue is
+full, events are dropped and counted rather than slowing down the stream.
+Values are checked and converted in record(), on the caller's thread, and a
+batch the store rejects is retried one event at a time, so one bad event
+can't lose the rest of its batch.
+The thread also syncs the store every sync_interval seconds, so readers
+that skip sync() (the Prometheus scrape) see current folded state.
+"""
+import json
+import logging
+import queue
+import random
+import threading
+import time
+
+from metrics_store import METRIC_FIELDS, TIMING_FIELDS, MetricsStore
+from sse import inter_token_stats, STALL_THRESHOLD_MS
+
+logger = logging.getLogger('metrics')
+
+DEFAULT_MAX_QUEUE = 10000
+DEFAULT_BATCH_SIZE = 256
+# Fraction of successful requests logged; errors are always logged
+DEFAULT_LOG_SAMPLE_RATE = 0.01
+# Seconds between store syncs done by the recorder thread
+DEFAULT_SYNC_INTERVAL = 1.0
+
+
+def coerce_values(values: dict) -> dict:
+    """
+    Check metric fields and convert them to the types the store packs.
+
+    Timings become floats and counts ints; None stays None (not measured).
+
+    Raises:
+        TypeError: On unknown fields or values that aren't numbers
+    """
+    unknown = set(values) - set(METRIC_FIELDS)
+    if unknown:
+        raise TypeError(f"Unknown metric fields: {sorted(unknown)}")
+
+    coerced = {}
+    for name, value in values.items():
+        if value is None:
+            coerced[name] = None
+            continue
+        try:
+            coerced[name] = float(value) if name in TIMING_FIELDS else int(value)
+        except (TypeError, ValueError):
+            raise TypeError(f"Metric {name} must be a number, got {value!r}") from None
+    return coerced
+
+
+class MetricsRecorder:
+    """Bounded queue of request metrics drained by a background aggregator thread."""
+
+    def __init__(self,
+                 store: MetricsStore,
+                 span_stats=None,
+                 max_queue: int = DEFAULT_MAX_QUEUE,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 log_sample_rate: float = DEFAULT_LOG_SAMPLE_RATE,
+                 sync_interval: float = DEFAULT_SYNC_INTERVAL):
+        """
+        Args:
+            store: Store the batches are written to
+            span_stats: Optional SpanStats fed with each event's spans
+            max_queue: Events held before new ones are dropped
+            batch_size: Most events written per batch
+            log_sample_rate: Fraction of successful requests logged (0-1)
+            sync_interval: Seconds between store syncs (folding every worker's records)
+        """
+        self.store = store
+        self.span_stats = span_stats
+        self.batch_size = batch_size
+        self.log_sample_rate = log_sample_rate
+        self.sync_interval = sync_interval
+        self.synced = time.monotonic()
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.failed = 0
+        self.recorded = 0
+        self.batches = 0
+        self.random = random.Random()
+        threading.Thread(target=self._run, name='metrics-recorder', daemon=True).start()
+
+    def record(self, model: str, timestamp: float = None, token_times=None, spans=None, **values):
+        """
+        Queue one request's metrics without blocking.
+
+        Args:
+            model: Model name
+            timestamp: Epoch seconds (default now)
+            token_times: Content token arrival times in ms (TokenTimer.token_times);
+                inter-token stats are computed from them in the background
+            spans: Optional stage durations of the request (StageTimer.ms())
+            **values: METRIC_FIELDS, as for MetricsStore.record
+
+        Raises:
+            TypeError: On unknown metric fields or values that aren't numbers
+        """
+        event = (time.time() if timestamp is None else float(timestamp), model, coerce_values(values),
+                 token_times, spans)
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """Block until every queued event has been written."""
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self.queue.get(timeout=self.sync_interval)]
+            except queue.Empty:
+                self._sync()
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.warning(f"Dropped a batch of {len(batch)} metrics events: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+            if time.monotonic() - self.synced >= self.sync_interval:
+                self._sync()
+
+    def _sync(self):
+        self.synced = time.monotonic()
+        try:
+            self.store.sync()
+        except Exception as e:
+            logger.warning(f"Metrics store sync failed: {e}")
+
+    def _write(self, batch: list):
+        records = []
+        for timestamp, model, values, token_times, spans in batch:
+            try:
+                if token_times is not None:
+                    values.update(inter_token_stats(token_times, STALL_THRESHOLD_MS))
+
+                if self.span_stats is not None and spans is not None:
+                    self.span_stats.record(model, spans)
+            except Exception as e:
+                logger.warning(f"Dropped a metrics event for {model}: {e}")
+                self.failed += 1
+                continue
+            records.append((timestamp, model, values))
+
+            status = values.get('status')
+            if (status is not None and status >= 400) or self.random.random() < self.log_sample_rate:
+                logger.info(json.dumps({"event": "request", "timestamp": timestamp, "model": model,
+                                        **values}, default=str))
+
+        try:
+            self.store.record_many(records)
+            self.recorded += len(records)
+        except Exception as e:
+            logger.warning(f"Writing a batch of {len(records)} metrics events failed ({e}), writing them one by one")
+            for record in records:
+                try:
+                    self.store.record_many([record])
+                    self.recorded += 1
+                except Exception as e:
+                    logger.warning(f"Dropped a metrics event for {record[1]}: {e}")
+                    self.failed += 1
+        self.batches += 1
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "recorded": self.recorded,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "failed": self.failed
+        }
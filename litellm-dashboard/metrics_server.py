@@ -1,230 +1,392 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import time
-import json
-import requests
 import logging
 from datetime import datetime
-import pandas as pd
-import matplotlib.pyplot as plt
-import io
-import base64
+import os
+import requests
+from metrics_store import MetricsStore, ROLLUP_WINDOWS
+from upstream import UpstreamPool, UPSTREAM_URL
+from sse import TokenTimer, DONE
+from routing_advisor import RoutingAdvisor
+from response_cache import ResponseCache, cache_key, is_cacheable
+from coalescing import SingleFlight
+from hedging import Hedger
+import prometheus
+from charts import ChartRenderer, DEFAULT_POINTS
+from spans import StageTimer, SpanStats
+from admission import AdmissionController, Rejected
+from metrics_recorder import MetricsRecorder
+from live import MetricsBroadcaster
+import yaml
 
 app = Flask(__name__)
 CORS(app)
 logging.basicConfig(level=logging.INFO)
 
-# Store metrics history
-metrics_history = []
+# Recent requests are kept in a ring buffer; per-model quantile sketches
+# cover every request in the log. The binary log is shared by all worker
+# processes and survives restarts (set METRICS_LOG_PATH="" to keep metrics
+# in memory only).
+METRICS_CAPACITY = 10000
+METRICS_LOG_PATH = os.environ.get('METRICS_LOG_PATH', 'metrics_log.bin')
+metrics_store = MetricsStore(capacity=METRICS_CAPACITY, log_path=METRICS_LOG_PATH or None)
+
+# Keep-alive connections to the upstream, shared by all request threads
+upstream_pool = UpstreamPool(pool_size=int(os.environ.get('UPSTREAM_POOL_SIZE', 100)))
+
+# Optional exact-match cache for deterministic (temperature 0) requests;
+# disabled unless RESPONSE_CACHE_MB is set
+RESPONSE_CACHE_MB = float(os.environ.get('RESPONSE_CACHE_MB', 0))
+response_cache = ResponseCache(
+    max_bytes=int(RESPONSE_CACHE_MB * 1024 * 1024),
+    ttl=float(os.environ.get('RESPONSE_CACHE_TTL', 300))
+) if RESPONSE_CACHE_MB > 0 else None
+
+# Optional single-flight coalescing: concurrent identical deterministic
+# requests share one upstream call (COALESCE_REQUESTS=1 to enable)
+single_flight = SingleFlight() if os.environ.get('COALESCE_REQUESTS') == '1' else None
+
+# Optional hedging of streams whose first token is late (HEDGE_REQUESTS=1 to enable)
+hedger = Hedger(
+    upstream_pool,
+    percentile=float(os.environ.get('HEDGE_PERCENTILE', 0.95))
+) if os.environ.get('HEDGE_REQUESTS') == '1' else None
+
+# Per-model concurrency caps and wait queues (max_parallel_requests in litellm_config.yaml)
+admission = AdmissionController(upstream_pool.config)
+
+# Per-stage perf_counter_ns spans of proxy_chat, aggregated per model; with
+# PROXY_TIMING_HEADERS=1 each response also carries its own spans
+span_stats = SpanStats()
+PROXY_TIMING_HEADERS = os.environ.get('PROXY_TIMING_HEADERS') == '1'
+
+# Request metrics are queued and written by a background thread in batches;
+# METRICS_LOG_SAMPLE_RATE of successful requests are logged as JSON lines
+metrics_recorder = MetricsRecorder(
+    metrics_store,
+    span_stats=span_stats,
+    log_sample_rate=float(os.environ.get('METRICS_LOG_SAMPLE_RATE', 0.01))
+)
+
+# Incremental samples and rollup deltas pushed to /metrics/stream subscribers.
+# Each subscriber holds a worker thread for as long as it is connected, so this
+# endpoint needs threaded or gevent workers; at most MAX_STREAM_SUBSCRIBERS
+# viewers are served at once (async_proxy.py serves the same stream without
+# a thread per viewer)
+broadcaster = MetricsBroadcaster(metrics_store)
+MAX_STREAM_SUBSCRIBERS = int(os.environ.get('MAX_STREAM_SUBSCRIBERS', 8))
+
+# Chart output is cached until new samples arrive
+chart_renderer = ChartRenderer(metrics_store)
+
+# Scores deployments from live metrics for /routing/advice
+routing_advisor = RoutingAdvisor(metrics_store, config=upstream_pool.config)
+
+def parse_since(value):
+    """Parse a ?since= value given as epoch seconds or ISO-8601; raises ValueError"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
 
 @app.route('/metrics', methods=['GET'])
 def get_metrics():
-    """Return stored metrics history"""
-    return jsonify(metrics_history)
+    """Return stored metrics history (?since= returns everything logged from that time)"""
+    since = request.args.get('since')
+    if since:
+        try:
+            since = parse_since(since)
+        except ValueError:
+            return jsonify({"error": f"Invalid since '{since}', expected epoch seconds or ISO-8601"}), 400
+    
+    return jsonify(metrics_store.history(since=since or None))
 
 @app.route('/metrics/stats', methods=['GET'])
 def get_metrics_stats():
     """Return statistical analysis of metrics"""
-    if not metrics_history:
-        return jsonify({"error": "No metrics data available"})
-    
-    df = pd.DataFrame(metrics_history)
-    
-    stats = {
-        "models": df['model'].value_counts().to_dict(),
-        "ttft": {
-            "mean": df['ttft'].mean(),
-            "median": df['ttft'].median(),
-            "min": df['ttft'].min(),
-            "max": df['ttft'].max()
-        },
-        "total_time": {
-            "mean": df['total_time'].mean(),
-            "median": df['total_time'].median(),
-            "min": df['total_time'].min(),
-            "max": df['total_time'].max()
-        },
-        "by_model": {}
-    }
-    
-    # Group by model
-    for model in df['model'].unique():
-        model_df = df[df['model'] == model]
-        stats["by_model"][model] = {
-            "ttft": {
-                "mean": model_df['ttft'].mean(),
-                "median": model_df['ttft'].median(),
-                "min": model_df['ttft'].min(),
-                "max": model_df['ttft'].max()
-            },
-            "total_time": {
-                "mean": model_df['total_time'].mean(),
-                "median": model_df['total_time'].median(),
-                "min": model_df['total_time'].min(),
-                "max": model_df['total_time'].max()
-            }
-        }
+    stats = metrics_store.stats()
+    if stats is None:
+        stats = {"error": "No metrics data available"}
     
+    stats["upstream_pool"] = upstream_pool.stats()
+    if response_cache is not None:
+        stats["response_cache"] = response_cache.stats()
+    if single_flight is not None:
+        stats["coalescing"] = single_flight.stats()
+    if hedger is not None:
+        stats["hedging"] = hedger.stats()
+    stats["spans"] = span_stats.stats()
+    stats["admission"] = admission.stats()
+    stats["recorder"] = metrics_recorder.stats()
+    stats["live_stream"] = broadcaster.stats()
     return jsonify(stats)
 
-@app.route('/metrics/chart', methods=['GET'])
-def get_metrics_chart():
-    """Generate chart of metrics data"""
-    if not metrics_history or len(metrics_history) < 2:
-        return jsonify({"error": "Not enough metrics data for chart"})
-    
-    df = pd.DataFrame(metrics_history)
-    
-    # Sort by timestamp
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    df = df.sort_values('timestamp')
-    
-    # Create figure with multiple subplots
-    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10, 8))
-    
-    # Plot TTFT by model
-    for model in df['model'].unique():
-        model_df = df[df['model'] == model]
-        ax1.plot(model_df['timestamp'], model_df['ttft'], 'o-', label=model)
+@app.route('/metrics/stream', methods=['GET'])
+def get_metrics_stream():
+    """Push new samples ('samples' events) and changed 10s rollup buckets ('rollup' events) over SSE"""
+    if broadcaster.subscribers >= MAX_STREAM_SUBSCRIBERS:
+        error = {"message": "Too many /metrics/stream viewers; use async_proxy.py's /metrics/stream", "type": "stream_full"}
+        return jsonify({"error": error}), 503, {'Retry-After': '30'}
+    return app.response_class(broadcaster.subscribe(), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics/prometheus', methods=['GET'])
+def get_metrics_prometheus():
+    """Return TTFT/ITL/total-time histograms and status counts in Prometheus text format"""
+    return prometheus.render(metrics_store, admission=admission.stats()), 200, {'Content-Type': prometheus.CONTENT_TYPE}
+
+@app.route('/metrics/rollup', methods=['GET'])
+def get_metrics_rollup():
+    """Return pre-aggregated metrics buckets (?window=1s|10s|1m|1h&model=&since=)"""
+    window = request.args.get('window', '1m')
+    if window not in ROLLUP_WINDOWS:
+        return jsonify({"error": f"Unknown window '{window}', expected one of {list(ROLLUP_WINDOWS)}"}), 400
     
-    ax1.set_ylabel('TTFT (ms)')
-    ax1.set_title('Time to First Token by Model')
-    ax1.legend()
-    ax1.grid(True)
+    since = request.args.get('since')
+    if since:
+        try:
+            since = parse_since(since)
+        except ValueError:
+            return jsonify({"error": f"Invalid since '{since}', expected epoch seconds or ISO-8601"}), 400
     
-    # Plot total time by model
-    for model in df['model'].unique():
-        model_df = df[df['model'] == model]
-        ax2.plot(model_df['timestamp'], model_df['total_time'], 'o-', label=model)
+    return jsonify({
+        "window": window,
+        "models": metrics_store.rollup(window, model=request.args.get('model'), since=since or None)
+    })
+
+@app.route('/routing/advice', methods=['GET'])
+def get_routing_advice():
+    """Return recommended routing weights and fallback orders (?format=yaml for a config patch)"""
+    if request.args.get('format') == 'yaml':
+        # Only the routing settings: the full config holds keys and credentials
+        generated = yaml.safe_dump(routing_advisor.generate_patch(), sort_keys=False)
+        return generated, 200, {'Content-Type': 'text/yaml'}
     
-    ax2.set_ylabel('Total Time (ms)')
-    ax2.set_title('Total Response Time by Model')
-    ax2.legend()
-    ax2.grid(True)
+    return jsonify(routing_advisor.advice())
+
+@app.route('/metrics/chart', methods=['GET'])
+def get_metrics_chart():
+    """Return a cached chart of recent metrics (?window=seconds&format=png|series&points=)"""
+    if len(metrics_store) < 2:
+        return jsonify({"error": "Not enough metrics data for chart"})
     
-    plt.tight_layout()
+    fmt = request.args.get('format', 'png')
+    if fmt not in ('png', 'series'):
+        return jsonify({"error": f"Unknown format '{fmt}', expected 'png' or 'series'"}), 400
     
-    # Convert plot to base64 encoded string
-    img = io.BytesIO()
-    plt.savefig(img, format='png')
-    img.seek(0)
+    try:
+        window = float(request.args['window']) if request.args.get('window') else None
+        points = int(request.args.get('points', DEFAULT_POINTS))
+    except ValueError:
+        return jsonify({"error": "window must be seconds and points an integer"}), 400
     
-    return jsonify({
-        "chart": base64.b64encode(img.getvalue()).decode('utf-8')
-    })
+    return jsonify(chart_renderer.chart(window=window, fmt=fmt, points=points))
 
 @app.route('/chat/completions', methods=['POST'])
 def proxy_chat():
     """Proxy chat completions and collect metrics"""
+    spans = StageTimer()
     data = request.json
-    start_time = time.time()
-    start_ms = int(start_time * 1000)
-    
-    # Record request start
-    logging.info(f"Request started at: {datetime.fromtimestamp(start_time).strftime('%H:%M:%S.%f')} ({start_ms} ms)")
+    start_ms = int(time.time() * 1000)
     
-    url = "http://3.110.176.254:4000/chat/completions"
+    url = UPSTREAM_URL
+    model = data.get('model', 'unknown')
     headers = {
         "Content-Type": "application/json",
         "Authorization": request.headers.get('Authorization', '')
     }
+    spans.mark('parse')
+    
+    # Serve repeated deterministic requests from the cache (per caller key)
+    key = None
+    if response_cache is not None and is_cacheable(data):
+        key = cache_key(data, headers["Authorization"])
+        cached = response_cache.get(key)
+        if cached is not None:
+            logging.info(f"Cache hit for {model} (saved ~{cached.latency_ms} ms)")
+            if cached.lines is not None:
+                return app.response_class((line + b"\n\n" for line in cached.lines),
+                                          mimetype='text/event-stream', headers={'X-Cache': 'HIT'})
+            return cached.content, cached.status, {'Content-Type': cached.content_type, 'X-Cache': 'HIT'}
+    
+    # Identical deterministic requests from the same caller share one upstream call
+    flight_key = None
+    if single_flight is not None and is_cacheable(data):
+        flight_key = cache_key(data, headers["Authorization"])
+    spans.mark('cache')
+    
+    # Shed load early when the model's deployment is at its concurrency cap
+    try:
+        slot = admission.admit(model)
+    except Rejected as e:
+        logging.warning(f"Rejected request for {model} ({e.reason}), Retry-After {e.retry_after}s")
+        error = {"message": f"Too many concurrent requests for {model} ({e.reason})", "type": e.reason}
+        return jsonify({"error": error}), e.status, {'Retry-After': str(e.retry_after)}
+    spans.mark('admission')
     
     # If streaming, process stream and collect metrics
     if data.get('stream', False):
         def generate():
-            first_token_received = False
-            first_token_time = None
-            last_token_time = None
+            timer = TokenTimer()
+            # Lines kept for the response cache, if this request is cacheable
+            captured = [] if key is not None else None
+            get_status, get_model, close = (lambda: None), (lambda: model), (lambda: None)
+            done = False
+            failure_status = None
+            spans.mark('response_start')
             
-            response = requests.post(url, headers=headers, json=data, stream=True)
-            
-            for line in response.iter_lines():
-                if line:
-                    current_time = time.time()
-                    current_ms = int(current_time * 1000)
-                    decoded_line = line.decode('utf-8')
-                    
-                    # Forward the streaming response
-                    yield f"{decoded_line}\n\n"
-                    
-                    if decoded_line.startswith("data: ") and decoded_line != "data: [DONE]":
-                        try:
-                            json_str = decoded_line[6:]  # Remove "data: " prefix
-                            token_data = json.loads(json_str)
-                            
-                            # Check for content
-                            if "choices" in token_data and token_data["choices"] and "delta" in token_data["choices"][0]:
-                                delta = token_data["choices"][0]["delta"]
-                                
-                                if "content" in delta and delta["content"]:
-                                    if not first_token_received:
-                                        first_token_received = True
-                                        first_token_time = current_time
-                                        first_token_ms = current_ms
-                                        ttft_ms = first_token_ms - start_ms
-                                        logging.info(f"First token at: {datetime.fromtimestamp(first_token_time).strftime('%H:%M:%S.%f')} ({first_token_ms} ms)")
-                                        logging.info(f"TTFT: {ttft_ms} ms")
-                                    
-                                    last_token_time = current_time
-                                    last_token_ms = current_ms
-                        except json.JSONDecodeError:
-                            pass
-                    
-                    elif decoded_line == "data: [DONE]":
-                        end_time = current_time
-                        end_ms = current_ms
-                        total_time_ms = end_ms - start_ms
+            try:
+                if flight_key is not None:
+                    lines, get_status, get_model, close = open_coalesced_stream(flight_key, url, model, headers, data)
+                else:
+                    lines, get_status, get_model, close = open_upstream_stream(url, model, headers, data)
+                spans.mark('upstream_headers')
+                
+                for line in lines:
+                    spans.mark('upstream_first_token' if timer.first_token_ms is None else 'upstream_stream')
+                    if line:
+                        current_ms = int(time.time() * 1000)
                         
-                        logging.info(f"Request completed at: {datetime.fromtimestamp(end_time).strftime('%H:%M:%S.%f')} ({end_ms} ms)")
-                        logging.info(f"Total time: {total_time_ms} ms")
+                        # Forward the raw bytes unchanged
+                        yield line + b"\n\n"
+                        spans.mark('client_write')
                         
-                        generation_time_ms = None
-                        if first_token_received and last_token_time:
-                            generation_time_ms = last_token_ms - first_token_ms
-                            logging.info(f"Token generation time: {generation_time_ms} ms")
+                        if captured is not None:
+                            captured.append(line)
                         
-                        # Store metrics
-                        metrics_entry = {
-                            "timestamp": datetime.now().isoformat(),
-                            "model": data.get('model', 'unknown'),
-                            "ttft": first_token_ms - start_ms if first_token_ms else None,
-                            "generation_time": generation_time_ms,
-                            "total_time": total_time_ms
-                        }
-                        metrics_history.append(metrics_entry)
+                        if timer.feed(line, current_ms) == DONE:
+                            done = True
+                            total_time_ms = current_ms - start_ms
+                            spans.mark('sse_processing')
+                            
+                            # Queue metrics (per client, also when the upstream call was shared)
+                            # under the model that answered, which differs when a hedge won;
+                            # inter-token stats are computed by the recorder thread
+                            metrics_recorder.record(
+                                get_model(),
+                                ttft=timer.first_token_ms - start_ms if timer.first_token_ms else None,
+                                generation_time=timer.generation_time_ms,
+                                total_time=total_time_ms,
+                                status=get_status(),
+                                token_times=timer.token_times,
+                                spans=spans.ms()
+                            )
+                            
+                            if captured is not None and get_status() == 200:
+                                response_cache.put_stream(key, captured, total_time_ms)
+                            
+                            if PROXY_TIMING_HEADERS:
+                                # Headers went out before these stages; send them as an SSE comment
+                                yield f": server-timing {spans.server_timing()}\n\n".encode()
                         
-                        # Keep only last 100 entries
-                        if len(metrics_history) > 100:
-                            metrics_history.pop(0)
-            
-            response.close()
+                        spans.mark('sse_processing')
+            except requests.exceptions.Timeout:
+                failure_status = 504
+                raise
+            except Exception:
+                failure_status = 502
+                raise
+            finally:
+                close()
+                slot.release()
+                if not done:
+                    # Error bodies, timeouts and dropped streams never send [DONE];
+                    # record them so error counts cover streaming traffic
+                    status = failure_status or get_status() or 502
+                    logging.warning(f"Stream for {model} ended without [DONE] (status {status})")
+                    metrics_recorder.record(
+                        get_model(),
+                        ttft=None,
+                        generation_time=None,
+                        total_time=int(time.time() * 1000) - start_ms,
+                        status=status,
+                        spans=spans.ms()
+                    )
         
-        return app.response_class(generate(), mimetype='text/event-stream')
+        response_headers = {'Server-Timing': spans.server_timing()} if PROXY_TIMING_HEADERS else None
+        response = app.response_class(generate(), mimetype='text/event-stream', headers=response_headers)
+        # Also frees the slot if the client goes away before the stream starts
+        response.call_on_close(slot.release)
+        return response
     
     # For non-streaming requests
     else:
-        response = requests.post(url, headers=headers, json=data)
-        end_time = time.time()
-        end_ms = int(end_time * 1000)
-        total_time_ms = end_ms - start_ms
+        try:
+            if flight_key is not None:
+                result = fetch_coalesced_response(flight_key, url, model, headers, data)
+                if result is None:
+                    return jsonify({"error": "Upstream request failed"}), 502
+                content, status, response_headers = result
+            else:
+                response = upstream_pool.post(url, model, headers=headers, json=data)
+                content, status, response_headers = response.content, response.status_code, response.headers.items()
+        finally:
+            slot.release()
+        spans.mark('upstream_response')
         
-        logging.info(f"Non-streaming request completed in {total_time_ms} ms")
+        total_time_ms = int(time.time() * 1000) - start_ms
         
-        # Store metrics for non-streaming request
-        metrics_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "model": data.get('model', 'unknown'),
-            "ttft": total_time_ms,  # For non-streaming, TTFT is the full time
-            "generation_time": None,
-            "total_time": total_time_ms
-        }
-        metrics_history.append(metrics_entry)
+        if key is not None and status == 200:
+            content_type = dict(response_headers).get('Content-Type', 'application/json')
+            response_cache.put_response(key, content, status, content_type, total_time_ms)
         
-        # Keep only last 100 entries
-        if len(metrics_history) > 100:
-            metrics_history.pop(0)
-        
-        return response.content, response.status_code, response.headers.items()
+        spans.mark('respond')
+        # Queue metrics for the non-streaming request
+        metrics_recorder.record(
+            model,
+            ttft=total_time_ms,  # For non-streaming, TTFT is the full time
+            generation_time=None,
+            total_time=total_time_ms,
+            status=status,
+            spans=spans.ms()
+        )
+        if PROXY_TIMING_HEADERS:
+            response_headers = list(response_headers) + [('Server-Timing', spans.server_timing())]
+        return content, status, response_headers
+
+def post_stream(url, model, headers, data):
+    """Start a streaming upstream call, hedged if hedging is enabled"""
+    if hedger is not None:
+        return hedger.stream(url, model, headers, data)
+    return upstream_pool.post(url, model, headers=headers, json=data, stream=True)
+
+def open_upstream_stream(url, model, headers, data):
+    """Start a streaming upstream call; returns (lines, status getter, answering model getter, close)"""
+    response = post_stream(url, model, headers, data)
+    return (response.iter_lines(), lambda: response.status_code,
+            lambda: getattr(response, 'answered_model', model), response.close)
+
+def open_coalesced_stream(flight_key, url, model, headers, data):
+    """Attach to (or start) a shared streaming upstream call; returns (lines, status getter, answering model getter, close)"""
+    def fetch(flight):
+        response = post_stream(url, model, headers, data)
+        try:
+            for line in response.iter_lines():
+                if line:
+                    # A hedged stream only knows its status and model once a winner is picked
+                    if flight.status is None:
+                        flight.model = getattr(response, 'answered_model', model)
+                        flight.set_status(response.status_code)
+                    flight.publish(line)
+        finally:
+            response.close()
+    
+    flight, started = single_flight.join(flight_key, fetch)
+    if not started:
+        logging.info(f"Coalesced streaming request for {model} onto an in-flight upstream call")
+    return flight.iter_lines(), lambda: flight.status, lambda: flight.model or model, lambda: None
+
+def fetch_coalesced_response(flight_key, url, model, headers, data):
+    """Attach to (or start) a shared non-streaming upstream call; returns (content, status, headers) or None"""
+    def fetch(flight):
+        response = upstream_pool.post(url, model, headers=headers, json=data)
+        flight.finish(response=(response.content, response.status_code, list(response.headers.items())))
+    
+    flight, started = single_flight.join(flight_key, fetch)
+    if not started:
+        logging.info(f"Coalesced request for {model} onto an in-flight upstream call")
+    return flight.wait()
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5001, debug=True)
\ No newline at end of file
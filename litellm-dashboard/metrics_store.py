@@ -0,0 +1,1022 @@
+import base64
+import fcntl
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from typing import Dict, List, Optional
+
+NAN = float('nan')
+
+# Per-request timings in ms, None when not measured
+TIMING_FIELDS = ('ttft', 'generation_time', 'total_time', 'mean_itl', 'p99_itl', 'max_itl')
+# Per-request integers (upstream HTTP status, inter-token stalls), None when not measured
+COUNT_FIELDS = ('status', 'stalls')
+METRIC_FIELDS = TIMING_FIELDS + COUNT_FIELDS
+
+# Fixed histogram bucket upper bounds in ms, for Prometheus exposition
+HISTOGRAM_BUCKETS = {
+    'ttft': (50, 100, 250, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000, 20000),
+    'mean_itl': (5, 10, 20, 35, 50, 75, 100, 150, 250, 500, 1000),
+    'total_time': (250, 500, 1000, 2000, 3000, 5000, 10000, 20000, 30000, 60000, 120000)
+}
+
+# The shared log is rotated once it holds this many records (~40 bytes each)
+DEFAULT_MAX_LOG_RECORDS = 1000000
+# Seconds between snapshots of the in-memory state, which bound the log
+# replay a restarted worker has to do
+DEFAULT_SNAPSHOT_INTERVAL = 300
+SNAPSHOT_FORMAT = 2
+# Log records are in append order, not strictly time order: batches from
+# several processes interleave. Time lookups assume no record is logged more
+# than this many seconds after a later-timestamped one
+LOG_ORDER_SLACK = 300
+
+
+class DDSketch:
+    """
+    Streaming quantile sketch with bounded relative error (DDSketch style).
+
+    Values are counted in logarithmic buckets, so memory depends on the range
+    of values rather than how many were added. Quantiles are accurate to within
+    relative_accuracy of the true value.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0  # Values <= 0 (e.g. sub-millisecond TTFTs)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        """Add a single value to the sketch."""
+        if value <= 0:
+            self.zero_count += 1
+        else:
+            index = math.ceil(math.log(value) / self.log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + 1
+
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def to_dict(self) -> dict:
+        """Return the sketch's state as JSON-safe values (for snapshots)."""
+        return {
+            "bins": list(self.bins.items()),
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max
+        }
+
+    @classmethod
+    def from_dict(cls, state: dict, relative_accuracy: float = 0.01) -> 'DDSketch':
+        sketch = cls(relative_accuracy)
+        sketch.bins = {int(index): int(count) for index, count in state["bins"]}
+        sketch.zero_count = int(state["zero_count"])
+        sketch.count = int(state["count"])
+        sketch.sum = float(state["sum"])
+        sketch.min = float(state["min"])
+        sketch.max = float(state["max"])
+        return sketch
+
+    def merge(self, other: 'DDSketch'):
+        """Add every value counted by another sketch (same relative accuracy)."""
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Return the approximate q-quantile (0 <= q <= 1), or None if empty."""
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return max(self.min, 0.0)
+
+        cumulative = self.zero_count
+        for index in sorted(self.bins):
+            cumulative += self.bins[index]
+            if cumulative > rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+
+        return self.max
+
+    def summary(self) -> Optional[dict]:
+        """Return mean/median/min/max and tail percentiles, or None if empty."""
+        if self.count == 0:
+            return None
+
+        return {
+            "mean": self.sum / self.count,
+            "median": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "min": self.min,
+            "max": self.max,
+            "count": self.count
+        }
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram: one counter per bucket plus an overflow bucket.
+
+    Adding a value is a bisect and an increment; cumulative counts are only
+    built when the histogram is read.
+    """
+
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = array('Q', [0]) * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def add(self, value: float):
+        # bisect_left puts a value equal to a bound in that bound's bucket (le semantics)
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def to_dict(self) -> dict:
+        return {"counts": self.counts.tolist(), "sum": self.sum}
+
+    @classmethod
+    def from_dict(cls, bounds, state: dict) -> 'Histogram':
+        histogram = cls(bounds)
+        if len(state["counts"]) != len(histogram.counts):
+            raise ValueError("Histogram buckets changed")
+        histogram.counts = array('Q', state["counts"])
+        histogram.sum = float(state["sum"])
+        return histogram
+
+    def snapshot(self) -> dict:
+        """Return bounds, per-bucket counts (last is +Inf), sum and count."""
+        counts = self.counts.tolist()
+        return {"bounds": self.bounds, "counts": counts, "sum": self.sum, "count": sum(counts)}
+
+
+class MetricsRingBuffer:
+    """
+    Fixed-capacity, array-backed ring buffer of request metrics.
+
+    Each metric is stored in its own typed array (columnar layout); models are
+    interned to small integer ids. Missing values are stored as NaN. Appends
+    overwrite the oldest row once the buffer is full, in O(1).
+    """
+
+    COLUMNS = ('timestamp',) + METRIC_FIELDS
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.columns = {name: array('d', [NAN]) * capacity for name in self.COLUMNS}
+        self.model_ids = array('i', [0]) * capacity
+        self.models: List[str] = []
+        self._model_index: Dict[str, int] = {}
+        self.head = 0  # Next slot to write
+        self.size = 0
+
+    def model_id(self, model: str) -> int:
+        """Return the interned id for a model name."""
+        if model not in self._model_index:
+            self._model_index[model] = len(self.models)
+            self.models.append(model)
+        return self._model_index[model]
+
+    def append(self, timestamp: float, model: str, **values):
+        """Append one row; values missing or None are stored as NaN."""
+        slot = self.head
+        self.columns['timestamp'][slot] = timestamp
+        for name in METRIC_FIELDS:
+            value = values.get(name)
+            self.columns[name][slot] = NAN if value is None else value
+        self.model_ids[slot] = self.model_id(model)
+
+        self.head = (slot + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def to_dict(self) -> dict:
+        """Return the buffer's state as JSON-safe values; columns are base64 array bytes."""
+        return {
+            "capacity": self.capacity,
+            "columns": {name: base64.b64encode(column.tobytes()).decode() for name, column in self.columns.items()},
+            "model_ids": base64.b64encode(self.model_ids.tobytes()).decode(),
+            "models": self.models,
+            "head": self.head,
+            "size": self.size
+        }
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'MetricsRingBuffer':
+        buffer = cls(int(state["capacity"]))
+        for name in cls.COLUMNS:
+            column = array('d')
+            column.frombytes(base64.b64decode(state["columns"][name]))
+            if len(column) != buffer.capacity:
+                raise ValueError(f"Column {name} has {len(column)} rows, expected {buffer.capacity}")
+            buffer.columns[name] = column
+        model_ids = array('i')
+        model_ids.frombytes(base64.b64decode(state["model_ids"]))
+        if len(model_ids) != buffer.capacity:
+            raise ValueError("Model id column has the wrong length")
+        buffer.model_ids = model_ids
+        buffer.models = [str(model) for model in state["models"]]
+        buffer._model_index = {model: index for index, model in enumerate(buffer.models)}
+        buffer.head = int(state["head"])
+        buffer.size = int(state["size"])
+        return buffer
+
+    def slots(self):
+        """Yield row slots from oldest to newest."""
+        start = (self.head - self.size) % self.capacity
+        for offset in range(self.size):
+            yield (start + offset) % self.capacity
+
+    def row(self, slot: int) -> dict:
+        """Return the row at a slot in the proxy's metrics entry format."""
+        entry = {
+            "timestamp": datetime.fromtimestamp(self.columns['timestamp'][slot]).isoformat(),
+            "model": self.models[self.model_ids[slot]]
+        }
+        for name in METRIC_FIELDS:
+            value = self.columns[name][slot]
+            if math.isnan(value):
+                entry[name] = None
+            else:
+                entry[name] = int(value) if name in COUNT_FIELDS else value
+        return entry
+
+
+class RollupBucket:
+    """Aggregates for one model over one time bucket."""
+
+    __slots__ = ('count', 'errors', 'ttft', 'total_time')
+
+    def __init__(self, relative_accuracy: float):
+        self.count = 0
+        self.errors = 0
+        self.ttft = DDSketch(relative_accuracy)
+        self.total_time = DDSketch(relative_accuracy)
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "errors": self.errors,
+                "ttft": self.ttft.to_dict(), "total_time": self.total_time.to_dict()}
+
+    @classmethod
+    def from_dict(cls, state: dict, relative_accuracy: float) -> 'RollupBucket':
+        bucket = cls(relative_accuracy)
+        bucket.count = int(state["count"])
+        bucket.errors = int(state["errors"])
+        bucket.ttft = DDSketch.from_dict(state["ttft"], relative_accuracy)
+        bucket.total_time = DDSketch.from_dict(state["total_time"], relative_accuracy)
+        return bucket
+
+    def summary(self, start: float) -> dict:
+        return {
+            "start": start,
+            "count": self.count,
+            "errors": self.errors,
+            "ttft": self.ttft.summary(),
+            "total_time": self.total_time.summary()
+        }
+
+
+class Rollup:
+    """
+    Per-model buckets of a fixed width, keeping only the most recent
+    `retention` buckets' worth of time.
+    """
+
+    def __init__(self, width: int, retention: int, relative_accuracy: float = 0.01):
+        self.width = width
+        self.retention = retention
+        self.relative_accuracy = relative_accuracy
+        # model -> {bucket start: bucket}; dicts keep insertion (time) order
+        self.buckets: Dict[str, Dict[int, RollupBucket]] = {}
+
+    def add(self, timestamp: float, model: str, ttft=None, total_time=None, error: bool = False):
+        start = int(timestamp // self.width) * self.width
+        buckets = self.buckets.setdefault(model, {})
+
+        bucket = buckets.get(start)
+        if bucket is None:
+            # Records can arrive out of time order, so the newest bucket is not
+            # necessarily the last one inserted
+            newest = max(buckets) if buckets else start
+            if start < newest - self.width * self.retention:
+                return  # Already outside the retention period
+
+            bucket = buckets[start] = RollupBucket(self.relative_accuracy)
+
+            # Expire buckets that fell out of the retention period
+            cutoff = max(start, newest) - self.width * self.retention
+            for expired in [old for old in buckets if old < cutoff]:
+                del buckets[expired]
+
+        bucket.count += 1
+        if error:
+            bucket.errors += 1
+        if ttft is not None:
+            bucket.ttft.add(ttft)
+        if total_time is not None:
+            bucket.total_time.add(total_time)
+
+    def to_dict(self) -> dict:
+        return {model: [[start, bucket.to_dict()] for start, bucket in buckets.items()]
+                for model, buckets in self.buckets.items()}
+
+    def load_dict(self, state: dict):
+        """Replace the buckets with ones saved by to_dict()."""
+        self.buckets = {
+            model: {int(start): RollupBucket.from_dict(bucket, self.relative_accuracy) for start, bucket in buckets}
+            for model, buckets in state.items()
+        }
+
+    def query(self, model: str = None, since: float = None) -> Dict[str, List[dict]]:
+        """Return bucket summaries per model, oldest first."""
+        models = [model] if model is not None else list(self.buckets)
+        result = {}
+
+        for name in models:
+            buckets = self.buckets.get(name, {})
+            result[name] = [
+                bucket.summary(start) for start, bucket in sorted(buckets.items())
+                if since is None or start + self.width > since
+            ]
+
+        return result
+
+
+# Rollup name -> (bucket width in seconds, buckets retained)
+ROLLUP_WINDOWS = {
+    '1s': (1, 900),       # 15 minutes
+    '10s': (10, 2160),    # 6 hours
+    '1m': (60, 1440),     # 1 day
+    '1h': (3600, 720)     # 30 days
+}
+
+
+class MetricsLog:
+    """
+    Append-only binary log of fixed-size metric records, shared by processes.
+
+    Each record is (timestamp, model id, *METRIC_FIELDS). Writers append whole
+    records with O_APPEND, so several worker processes can share one file;
+    readers map it with mmap and never copy it. A superseded map is never
+    closed while views of it are still being read; it is released with its
+    last view. Model names are interned in a
+    sidecar "<path>.models" file, one per line, guarded by an exclusive flock
+    when a new model is added.
+
+    rotate() swaps in a new empty file and keeps the old one as "<path>.1".
+    Appenders hold a shared flock and the rotator an exclusive one, so no
+    record is written to a file after it has been rotated out.
+    """
+
+    # Identifies the file and its record layout
+    HEADER = b'LLMMET' + struct.pack('<H', 1)
+    # float64 epoch seconds, uint32 model id, float32 ms per TIMING_FIELDS
+    # (NaN = missing), uint16 per COUNT_FIELDS (MISSING_COUNT = missing)
+    RECORD = struct.Struct('<dI' + 'f' * len(TIMING_FIELDS) + 'H' * len(COUNT_FIELDS))
+    MISSING_COUNT = 0xFFFF
+
+    def __init__(self, path: str):
+        self.path = path
+        self.models_path = path + '.models'
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self.models: List[str] = []
+        self._model_index: Dict[str, int] = {}
+        self._map = None
+        self._map_size = 0
+        # Guards remapping; views handed out stay valid after a remap
+        self.lock = threading.RLock()
+        self._write_header()
+        self._load_models()
+
+    def _write_header(self):
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size == 0:
+                os.write(self.fd, self.HEADER)
+            elif os.pread(self.fd, len(self.HEADER), 0) != self.HEADER:
+                raise ValueError(f"{self.path} is not a metrics log in the current format")
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _load_models(self):
+        if not os.path.exists(self.models_path):
+            return
+        with open(self.models_path, 'r', encoding='utf-8') as f:
+            self.models = f.read().splitlines()
+        self._model_index = {name: index for index, name in enumerate(self.models)}
+
+    def model_id(self, model: str) -> int:
+        """Return the shared id for a model name, registering it if new."""
+        if model in self._model_index:
+            return self._model_index[model]
+
+        with open(self.models_path, 'a+', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # Another process may have registered it since we last looked
+                f.seek(0)
+                self.models = f.read().splitlines()
+                self._model_index = {name: index for index, name in enumerate(self.models)}
+                if model not in self._model_index:
+                    f.write(model.replace('\n', ' ') + '\n')
+                    f.flush()
+                    self._model_index[model] = len(self.models)
+                    self.models.append(model)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+        return self._model_index[model]
+
+    def model_name(self, model_id: int) -> str:
+        if model_id >= len(self.models):
+            self._load_models()
+        return self.models[model_id] if model_id < len(self.models) else 'unknown'
+
+    def _pack(self, timestamp: float, model: str, values: dict) -> bytes:
+        timings = [NAN if values.get(name) is None else values[name] for name in TIMING_FIELDS]
+        counts = [
+            self.MISSING_COUNT if values.get(name) is None else min(int(values[name]), self.MISSING_COUNT - 1)
+            for name in COUNT_FIELDS
+        ]
+        return self.RECORD.pack(timestamp, self.model_id(model), *timings, *counts)
+
+    def append(self, timestamp: float, model: str, **values) -> bool:
+        """Append one record (a single write, atomic with respect to other appenders)."""
+        return self.append_many([(timestamp, model, values)])
+
+    def append_many(self, records) -> bool:
+        """
+        Append (timestamp, model, values) records with a single write.
+
+        Returns False without writing if the log has been rotated; the caller
+        should finish reading the old file, reopen() and append again.
+        """
+        data = b''.join(self._pack(timestamp, model, values) for timestamp, model, values in records)
+        if not data:
+            return True
+
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_SH)
+            try:
+                if self.rotated():
+                    return False
+                os.write(self.fd, data)
+                return True
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def identity(self) -> tuple:
+        """(device, inode) of the open log file, which changes when it is rotated."""
+        stat = os.fstat(self.fd)
+        return stat.st_dev, stat.st_ino
+
+    def rotated(self) -> bool:
+        """Whether the path now names a different file than the one open."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+        return (stat.st_dev, stat.st_ino) != self.identity()
+
+    def reopen(self):
+        """Switch to the file now at the path (read the old one to its end first)."""
+        with self.lock:
+            os.close(self.fd)
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+            self._map = None
+            self._map_size = 0
+            self._write_header()
+
+    def rotate(self, before_swap) -> bool:
+        """
+        Replace the log with a new empty file and keep the old one as "<path>.1".
+
+        Args:
+            before_swap: Called with the new file's identity() once no process
+                can append to the old file, before the new one is visible
+
+        Returns:
+            False if another process rotated the log first
+        """
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                if self.rotated():
+                    return False
+
+                new_path = self.path + '.new'
+                fd = os.open(new_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o644)
+                os.write(fd, self.HEADER)
+                stat = os.fstat(fd)
+                before_swap((stat.st_dev, stat.st_ino))
+
+                old_path = self.path + '.1'
+                if os.path.exists(old_path):
+                    os.remove(old_path)
+                os.link(self.path, old_path)
+                # Atomic, so other processes always find a log at the path
+                os.replace(new_path, self.path)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+            os.close(self.fd)
+            self.fd = fd
+            self._map = None
+            self._map_size = 0
+            return True
+
+    def __len__(self):
+        return (os.fstat(self.fd).st_size - len(self.HEADER)) // self.RECORD.size
+
+    def _view(self) -> memoryview:
+        """Return a view over all complete records, remapping if the file grew."""
+        with self.lock:
+            size = len(self.HEADER) + len(self) * self.RECORD.size
+            if size != self._map_size:
+                # The old map is not closed: views other threads still hold keep
+                # it alive, and it is unmapped when the last of them is released
+                self._map = mmap.mmap(self.fd, size, access=mmap.ACCESS_READ)
+                self._map_size = size
+            return memoryview(self._map)[len(self.HEADER):]
+
+    def _timestamp_at(self, view: memoryview, index: int) -> float:
+        return struct.unpack_from('<d', view, index * self.RECORD.size)[0]
+
+    def find(self, since: float) -> int:
+        """
+        Binary-search the index of the first record at or after `since`.
+
+        Only exact for a time-ordered log; call with since - LOG_ORDER_SLACK
+        and filter to find every record from `since` on.
+        """
+        view = self._view()
+        low, high = 0, len(view) // self.RECORD.size
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamp_at(view, middle) < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def read(self, start: int = 0, stop: int = None):
+        """
+        Yield decoded records from index `start` up to `stop` (default: end).
+
+        Yields:
+            (timestamp, model, values) tuples, where values maps each of
+            METRIC_FIELDS to its value or None
+        """
+        view = self._view()
+        count = len(view) // self.RECORD.size
+        stop = count if stop is None else min(stop, count)
+        if start >= stop:
+            return
+
+        timing_count = len(TIMING_FIELDS)
+        chunk = view[start * self.RECORD.size:stop * self.RECORD.size]
+        for timestamp, model_id, *fields in self.RECORD.iter_unpack(chunk):
+            values = {}
+            for name, value in zip(TIMING_FIELDS, fields):
+                values[name] = None if math.isnan(value) else value
+            for name, value in zip(COUNT_FIELDS, fields[timing_count:]):
+                values[name] = None if value == self.MISSING_COUNT else value
+            yield timestamp, self.model_name(model_id), values
+
+
+class MetricsStore:
+    """
+    Thread-safe metrics store: a ring buffer of recent rows, per-model
+    quantile sketches covering every recorded request, and per-model
+    time-bucketed rollups.
+
+    With a log_path, records are written to a shared MetricsLog and the
+    in-memory structures follow the log, so history survives restarts and
+    every worker process sees the requests served by the others. The state
+    is snapshotted to "<log_path>.snapshot" every snapshot_interval seconds
+    and whenever the log is rotated (at max_log_records), so a restarted
+    worker only replays the records logged since the last snapshot.
+    """
+
+    TRACKED = ('ttft', 'total_time', 'mean_itl', 'p99_itl', 'max_itl')
+
+    def __init__(self, capacity: int = 10000, relative_accuracy: float = 0.01, log_path: str = None,
+                 max_log_records: int = DEFAULT_MAX_LOG_RECORDS,
+                 snapshot_interval: float = DEFAULT_SNAPSHOT_INTERVAL):
+        self.log = MetricsLog(log_path) if log_path else None
+        self.snapshot_path = log_path + '.snapshot' if log_path else None
+        self.max_log_records = max_log_records
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_checked = 0.0  # When sync() last considered writing a snapshot
+        self.log_position = 0  # Log records already folded into memory
+        self.version = 0  # Records folded into memory; changes whenever new data arrives
+        self.buffer = MetricsRingBuffer(capacity)
+        self.relative_accuracy = relative_accuracy
+        self.overall = {name: DDSketch(relative_accuracy) for name in self.TRACKED}
+        self.by_model: Dict[str, Dict[str, DDSketch]] = {}
+        self.stalls: Dict[str, int] = {}
+        # metric -> model -> Histogram, and model -> upstream status -> count
+        self.histograms: Dict[str, Dict[str, Histogram]] = {name: {} for name in HISTOGRAM_BUCKETS}
+        self.statuses: Dict[str, Dict[int, int]] = {}
+        self.rollups = {
+            name: Rollup(width, retention, relative_accuracy)
+            for name, (width, retention) in ROLLUP_WINDOWS.items()
+        }
+        self.lock = threading.Lock()
+        if self.log is not None:
+            self._load_snapshot()
+
+    def record(self, model: str, timestamp: float = None, **values):
+        """
+        Record one request's metrics.
+
+        Args:
+            model: Model name
+            timestamp: Epoch seconds (default now)
+            **values: Any of METRIC_FIELDS; timings in ms. An upstream status
+                of 400 or above counts as an error in the rollups.
+        """
+        if timestamp is None:
+            timestamp = datetime.now().timestamp()
+        self.record_many([(timestamp, model, values)])
+
+    def record_many(self, records):
+        """
+        Record a batch of (timestamp, model, values) with one log write or one lock.
+
+        Raises TypeError on unknown metric fields, like record().
+        """
+        for _, _, values in records:
+            unknown = set(values) - set(METRIC_FIELDS)
+            if unknown:
+                raise TypeError(f"Unknown metric fields: {sorted(unknown)}")
+
+        if self.log is not None:
+            # Picked up by sync() in this and every other process
+            while not self.log.append_many(records):
+                # Another process rotated the log; follow it and append to the new file
+                self.sync()
+            if time.time() - self.snapshot_checked >= self.snapshot_interval:
+                # Keeps snapshots and rotation going in workers whose metrics nobody reads
+                self.sync()
+            return
+
+        with self.lock:
+            for timestamp, model, values in records:
+                self._ingest(timestamp, model, values)
+
+    def _ingest(self, timestamp: float, model: str, values: dict):
+        """Fold one record into the in-memory structures (caller holds the lock)."""
+        status = values.get('status')
+        error = status is not None and status >= 400
+        self.version += 1
+
+        self.buffer.append(timestamp, model, **values)
+
+        for rollup in self.rollups.values():
+            rollup.add(timestamp, model, ttft=values.get('ttft'),
+                       total_time=values.get('total_time'), error=error)
+
+        sketches = self.by_model.get(model)
+        if sketches is None:
+            sketches = {name: DDSketch(self.relative_accuracy) for name in self.TRACKED}
+            self.by_model[model] = sketches
+            self.stalls[model] = 0
+
+        for name in self.TRACKED:
+            value = values.get(name)
+            if value is not None:
+                sketches[name].add(value)
+                self.overall[name].add(value)
+
+        if values.get('stalls'):
+            self.stalls[model] += values['stalls']
+
+        for name, histograms in self.histograms.items():
+            value = values.get(name)
+            if value is not None:
+                histogram = histograms.get(model)
+                if histogram is None:
+                    histogram = histograms[model] = Histogram(HISTOGRAM_BUCKETS[name])
+                histogram.add(value)
+
+        if status is not None:
+            statuses = self.statuses.setdefault(model, {})
+            statuses[int(status)] = statuses.get(int(status), 0) + 1
+
+    def sync(self):
+        """
+        Fold log records appended since the last sync (by any process) into memory.
+
+        Also follows or performs log rotation and writes periodic snapshots.
+        """
+        if self.log is None:
+            return
+
+        with self.lock:
+            if self.log.rotated():
+                # Finish the old file, then follow the new one
+                self._fold()
+                self.log.reopen()
+                self.log_position = 0
+            self._fold()
+
+            if self.log_position >= self.max_log_records:
+                def before_swap(identity):
+                    # Records appended since the fold above, then a snapshot the new file starts from
+                    self._fold()
+                    self._write_snapshot(identity, 0)
+
+                if self.log.rotate(before_swap):
+                    self.log_position = 0
+            elif time.time() - self.snapshot_checked >= self.snapshot_interval:
+                self._maybe_snapshot()
+
+    def _fold(self):
+        """Ingest log records past log_position (caller holds the lock)."""
+        end = len(self.log)
+        for timestamp, model, values in self.log.read(self.log_position, end):
+            self._ingest(timestamp, model, values)
+        self.log_position = end
+
+    def _maybe_snapshot(self):
+        """Write a snapshot unless some process wrote one recently (caller holds the lock)."""
+        now = time.time()
+        self.snapshot_checked = now
+        try:
+            if now - os.path.getmtime(self.snapshot_path) < self.snapshot_interval:
+                return
+        except OSError:
+            pass
+        self._write_snapshot(self.log.identity(), self.log_position)
+
+    def _write_snapshot(self, identity: tuple, position: int):
+        """Atomically save the in-memory state as of a log position (caller holds the lock)."""
+        snapshot = {
+            "format": SNAPSHOT_FORMAT,
+            "log": list(identity),
+            "position": position,
+            "relative_accuracy": self.relative_accuracy,
+            "version": self.version,
+            "buffer": self.buffer.to_dict(),
+            "overall": {name: sketch.to_dict() for name, sketch in self.overall.items()},
+            "by_model": {
+                model: {name: sketch.to_dict() for name, sketch in sketches.items()}
+                for model, sketches in self.by_model.items()
+            },
+            "stalls": self.stalls,
+            "histograms": {
+                name: {model: histogram.to_dict() for model, histogram in histograms.items()}
+                for name, histograms in self.histograms.items()
+            },
+            "statuses": {model: list(statuses.items()) for model, statuses in self.statuses.items()},
+            "rollups": {name: rollup.to_dict() for name, rollup in self.rollups.items()}
+        }
+        temporary_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(temporary_path, self.snapshot_path)
+
+    def _load_snapshot(self):
+        """Start from the snapshot if it belongs to the current log file; otherwise replay it all."""
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            if (snapshot["format"] != SNAPSHOT_FORMAT
+                    or tuple(snapshot["log"]) != self.log.identity()
+                    or snapshot["position"] > len(self.log)
+                    or snapshot["buffer"]["capacity"] != self.buffer.capacity
+                    or snapshot["relative_accuracy"] != self.relative_accuracy):
+                return
+
+            accuracy = self.relative_accuracy
+            buffer = MetricsRingBuffer.from_dict(snapshot["buffer"])
+            overall = {name: DDSketch.from_dict(snapshot["overall"][name], accuracy) for name in self.TRACKED}
+            by_model = {
+                model: {name: DDSketch.from_dict(sketches[name], accuracy) for name in self.TRACKED}
+                for model, sketches in snapshot["by_model"].items()
+            }
+            stalls = {model: int(count) for model, count in snapshot["stalls"].items()}
+            histograms = {
+                name: {model: Histogram.from_dict(HISTOGRAM_BUCKETS[name], histogram)
+                       for model, histogram in snapshot["histograms"].get(name, {}).items()}
+                for name in HISTOGRAM_BUCKETS
+            }
+            statuses = {
+                model: {int(status): int(count) for status, count in counts}
+                for model, counts in snapshot["statuses"].items()
+            }
+            for name, rollup in self.rollups.items():
+                rollup.load_dict(snapshot["rollups"][name])
+        except (OSError, ValueError, KeyError, TypeError):
+            # Missing, partial or from an incompatible version: replay the whole log
+            for rollup in self.rollups.values():
+                rollup.buckets = {}
+            return
+
+        self.version = int(snapshot["version"])
+        self.buffer = buffer
+        self.overall = overall
+        self.by_model = by_model
+        self.stalls = stalls
+        self.histograms = histograms
+        self.statuses = statuses
+        self.log_position = snapshot["position"]
+
+    def history(self, since: float = None) -> List[dict]:
+        """
+        Return recorded rows, oldest first.
+
+        Without `since`, returns the ring buffer of recent rows. With `since`
+        (epoch seconds) and a log, returns every row from that time on that is
+        still in the current log file (rows before the last rotation are not).
+        """
+        if since is not None and self.log is not None:
+            # Interleaved batches leave the log only roughly time-ordered: start
+            # early enough to see every late-logged record, then filter and sort
+            records = [
+                (timestamp, model, values)
+                for timestamp, model, values in self.log.read(self.log.find(since - LOG_ORDER_SLACK))
+                if timestamp >= since
+            ]
+            records.sort(key=lambda record: record[0])
+            rows = []
+            for timestamp, model, values in records:
+                entry = {"timestamp": datetime.fromtimestamp(timestamp).isoformat(), "model": model}
+                entry.update(values)
+                rows.append(entry)
+            return rows
+
+        self.sync()
+        with self.lock:
+            return [self.buffer.row(slot) for slot in self.buffer.slots()
+                    if since is None or self.buffer.columns['timestamp'][slot] >= since]
+
+    def rows_since(self, version: int) -> tuple:
+        """
+        Return rows folded in after a given version, oldest first.
+
+        Rows that have already left the ring buffer are skipped.
+
+        Returns:
+            (current version, list of rows in the /metrics entry format)
+        """
+        self.sync()
+        with self.lock:
+            buffer = self.buffer
+            count = min(max(self.version - version, 0), buffer.size)
+            start = buffer.head - count
+            return self.version, [buffer.row((start + offset) % buffer.capacity) for offset in range(count)]
+
+    def series(self, fields, since: float = None) -> Dict[str, Dict[str, list]]:
+        """
+        Return ring buffer columns per model, oldest first, without building row dicts.
+
+        Args:
+            fields: METRIC_FIELDS to return
+            since: Only rows at or after this epoch time
+
+        Returns:
+            Dictionary of model -> {"timestamp": [...], field: [...]}; missing
+            values are NaN
+        """
+        self.sync()
+        with self.lock:
+            buffer = self.buffer
+            timestamps = buffer.columns['timestamp']
+            result = {}
+            for slot in buffer.slots():
+                timestamp = timestamps[slot]
+                if since is not None and timestamp < since:
+                    continue
+                model = buffer.models[buffer.model_ids[slot]]
+                columns = result.get(model)
+                if columns is None:
+                    columns = result[model] = {name: [] for name in ('timestamp',) + tuple(fields)}
+                columns['timestamp'].append(timestamp)
+                for name in fields:
+                    columns[name].append(buffer.columns[name][slot])
+            return result
+
+    def rollup(self, window: str, model: str = None, since: float = None) -> Dict[str, List[dict]]:
+        """
+        Return bucketed aggregates for one of ROLLUP_WINDOWS.
+
+        Args:
+            window: Bucket width name ('1s', '10s', '1m' or '1h')
+            model: Only return this model (default: all models)
+            since: Only return buckets ending after this epoch time
+
+        Returns:
+            Dictionary of model -> list of bucket summaries, oldest first
+        """
+        self.sync()
+        with self.lock:
+            return self.rollups[window].query(model=model, since=since)
+
+    def recent_buckets(self, window: str, since: float) -> Dict[str, List[tuple]]:
+        """
+        Return copies of raw rollup buckets ending after `since`, for callers
+        that need to merge sketches (e.g. the routing advisor).
+
+        Returns:
+            Dictionary of model -> list of (start, count, errors, ttft sketch,
+            total_time sketch), oldest first
+        """
+        self.sync()
+        result = {}
+        with self.lock:
+            rollup = self.rollups[window]
+            for model, buckets in rollup.buckets.items():
+                rows = []
+                for start, bucket in sorted(buckets.items()):
+                    if start + rollup.width <= since:
+                        continue
+                    ttft = DDSketch(self.relative_accuracy)
+                    ttft.merge(bucket.ttft)
+                    total_time = DDSketch(self.relative_accuracy)
+                    total_time.merge(bucket.total_time)
+                    rows.append((start, bucket.count, bucket.errors, ttft, total_time))
+                if rows:
+                    result[model] = rows
+        return result
+
+    def histogram_snapshot(self, sync: bool = True) -> dict:
+        """
+        Return copies of the fixed-bucket histograms and status counts.
+
+        Costs O(models x buckets) regardless of how many requests were seen.
+        With a shared log the counts cover every worker process.
+
+        Args:
+            sync: Fold new log records first. With False the state as of the
+                last sync is returned, without any log reads, snapshot writes
+                or rotation.
+
+        Returns:
+            {"histograms": {metric: {model: Histogram.snapshot()}},
+             "statuses": {model: {status: count}}}
+        """
+        if sync:
+            self.sync()
+        with self.lock:
+            return {
+                "histograms": {
+                    name: {model: histogram.snapshot() for model, histogram in histograms.items()}
+                    for name, histograms in self.histograms.items()
+                },
+                "statuses": {model: dict(statuses) for model, statuses in self.statuses.items()}
+            }
+
+    def __len__(self):
+        self.sync()
+        return self.buffer.size
+
+    def stats(self) -> Optional[dict]:
+        """Return overall and per-model statistics, or None if nothing was recorded."""
+        self.sync()
+        with self.lock:
+            if not self.by_model:
+                return None
+
+            stats = {
+                "models": {model: sketches['total_time'].count for model, sketches in self.by_model.items()},
+                "by_model": {}
+            }
+            for name, sketch in self.overall.items():
+                stats[name] = sketch.summary()
+            stats["stalls"] = sum(self.stalls.values())
+
+            for model, sketches in self.by_model.items():
+                model_stats = {name: sketch.summary() for name, sketch in sketches.items()}
+                model_stats["stalls"] = self.stalls[model]
+                stats["by_model"][model] = model_stats
+
+            return stats
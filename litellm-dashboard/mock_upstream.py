@@ -0,0 +1,160 @@
+"""
+Offline OpenAI-compatible upstream for reproducible benchmarks.
+
+Serves /chat/completions and /v1/chat/completions, streaming or not, with
+synthetic latency per model: a TTFT drawn from a lognormal distribution,
+inter-token delays with jitter, an error rate and a chunk size. No tokens are
+generated by a model, so results only reflect the proxies and the network.
+
+Run with: python mock_upstream.py [--port 5005] [--profiles profiles.yaml] [--seed 0]
+
+then point the proxies at it with
+LITELLM_UPSTREAM_URL=http://localhost:5005/chat/completions, or
+PromptLatencyTester with OPENAI_BASE_URL=http://localhost:5005/v1.
+
+A profiles file maps model names (wildcards allowed) to overrides of
+DEFAULT_PROFILE; the "default" entry applies to every model:
+
+    default: {ttft_ms: 300}
+    "gpt-4o": {ttft_ms: 500, ttft_sigma: 0.4, itl_ms: 25}
+    "anthropic/*": {error_rate: 0.02}
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from fnmatch import fnmatch
+
+import yaml
+from aiohttp import web
+
+DEFAULT_PROFILE = {
+    "ttft_ms": 300,        # Median time to first token
+    "ttft_sigma": 0.0,     # Lognormal sigma of TTFT (0 = always the median)
+    "itl_ms": 20,          # Mean delay between tokens
+    "itl_jitter_ms": 0,    # Uniform +/- jitter on each inter-token delay
+    "tokens": 100,         # Completion tokens (capped by max_tokens)
+    "chunk_tokens": 1,     # Tokens per SSE chunk
+    "error_rate": 0.0,     # Fraction of requests answered with error_status
+    "error_status": 500
+}
+
+
+def load_profiles(path: str = None) -> dict:
+    if not path:
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f) or {}
+
+
+def profile_for(profiles: dict, model: str) -> dict:
+    """Merge DEFAULT_PROFILE, the "default" entry and the first entry matching the model."""
+    profile = dict(DEFAULT_PROFILE, **(profiles.get('default') or {}))
+    if model in profiles:
+        profile.update(profiles[model])
+    else:
+        for pattern, overrides in profiles.items():
+            if pattern != 'default' and '*' in pattern and fnmatch(model, pattern):
+                profile.update(overrides)
+                break
+    return profile
+
+
+class MockUpstream:
+    """Request handlers with a seeded random source, so runs are repeatable."""
+
+    def __init__(self, profiles: dict = None, seed: int = None):
+        self.profiles = profiles or {}
+        self.random = random.Random(seed)
+        self.requests = 0
+
+    def ttft(self, profile: dict) -> float:
+        """TTFT in seconds."""
+        median = profile["ttft_ms"] / 1000
+        if profile["ttft_sigma"] <= 0:
+            return median
+        return median * math.exp(self.random.gauss(0, profile["ttft_sigma"]))
+
+    def itl(self, profile: dict) -> float:
+        """One inter-token delay in seconds."""
+        jitter = profile["itl_jitter_ms"]
+        return max(profile["itl_ms"] + self.random.uniform(-jitter, jitter), 0) / 1000
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        data = await request.json()
+        model = data.get('model', 'mock')
+        profile = profile_for(self.profiles, model)
+        self.requests += 1
+
+        if self.random.random() < profile["error_rate"]:
+            return web.json_response(
+                {"error": {"message": "Mock upstream error", "type": "server_error"}},
+                status=profile["error_status"]
+            )
+
+        tokens = profile["tokens"]
+        if data.get('max_tokens'):
+            tokens = min(tokens, data['max_tokens'])
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        usage = {"prompt_tokens": 10, "completion_tokens": tokens, "total_tokens": 10 + tokens}
+
+        if not data.get('stream', False):
+            await asyncio.sleep(self.ttft(profile) + sum(self.itl(profile) for _ in range(tokens - 1)))
+            return web.json_response({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": " tok" * tokens}}],
+                "usage": usage
+            })
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+
+        def event(delta: dict, finish_reason=None, **extra) -> bytes:
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}], **extra}
+            return b"data: " + json.dumps(chunk, separators=(',', ':')).encode() + b"\n\n"
+
+        await response.write(event({"role": "assistant", "content": ""}))
+        await asyncio.sleep(self.ttft(profile))
+
+        sent = 0
+        while sent < tokens:
+            count = min(profile["chunk_tokens"], tokens - sent)
+            if sent:
+                await asyncio.sleep(sum(self.itl(profile) for _ in range(count)))
+            await response.write(event({"content": " tok" * count}))
+            sent += count
+
+        await response.write(event({}, finish_reason="stop"))
+        if (data.get('stream_options') or {}).get('include_usage'):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                     "model": model, "choices": [], "usage": usage}
+            await response.write(b"data: " + json.dumps(chunk).encode() + b"\n\n")
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+
+def create_app(profiles: dict = None, seed: int = None) -> web.Application:
+    upstream = MockUpstream(profiles, seed)
+    app = web.Application()
+    app['mock'] = upstream
+    app.router.add_post('/chat/completions', upstream.chat_completions)
+    app.router.add_post('/v1/chat/completions', upstream.chat_completions)
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline OpenAI-compatible streaming upstream")
+    parser.add_argument('--port', type=int, default=5005)
+    parser.add_argument('--profiles', help="YAML/JSON file of per-model latency profiles")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed (repeatable runs)")
+    args = parser.parse_args()
+
+    web.run_app(create_app(load_profiles(args.profiles), args.seed), host='127.0.0.1', port=args.port,
+                access_log=None)
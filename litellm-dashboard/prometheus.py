@@ -0,0 +1,90 @@
+"""
+Prometheus text exposition (format 0.0.4) of the metrics store's histograms.
+
+Timings are kept in ms and exposed in seconds, the Prometheus base unit.
+Rendering reads the state the store has already folded from its log and
+never syncs, so a scrape costs O(models x buckets) however much traffic
+arrived; the proxy's MetricsRecorder keeps that state current.
+"""
+from metrics_store import MetricsStore
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PREFIX = 'llm_proxy'
+
+# Histogram metric -> (exposed name, help text)
+HISTOGRAMS = {
+    'ttft': ('ttft_seconds', 'Time to first token (full response time for non-streaming requests).'),
+    'mean_itl': ('request_mean_inter_token_latency_seconds',
+                 'Mean gap between streamed tokens of each request (one observation per request, not per gap).'),
+    'total_time': ('request_duration_seconds', 'Total time from request start to the last byte.')
+}
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def render(store: MetricsStore, admission: dict = None) -> str:
+    """
+    Render every histogram and the upstream status counter as Prometheus text.
+
+    Args:
+        store: Metrics store (histograms cover every worker sharing its log)
+        admission: AdmissionController.stats() of this process, if any
+    """
+    snapshot = store.histogram_snapshot(sync=False)
+    lines = []
+
+    for name, (exposed, help_text) in HISTOGRAMS.items():
+        metric = f"{PREFIX}_{exposed}"
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} histogram")
+
+        for model, histogram in sorted(snapshot["histograms"][name].items()):
+            label = f'model="{escape_label(model)}"'
+            cumulative = 0
+            for bound, count in zip(histogram["bounds"], histogram["counts"]):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{label},le="{format_number(bound / 1000)}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{label},le="+Inf"}} {histogram["count"]}')
+            lines.append(f'{metric}_sum{{{label}}} {histogram["sum"] / 1000!r}')
+            lines.append(f'{metric}_count{{{label}}} {histogram["count"]}')
+
+    metric = f"{PREFIX}_upstream_responses_total"
+    lines.append(f"# HELP {metric} Upstream responses by HTTP status.")
+    lines.append(f"# TYPE {metric} counter")
+    for model, statuses in sorted(snapshot["statuses"].items()):
+        for status, count in sorted(statuses.items()):
+            lines.append(f'{metric}{{model="{escape_label(model)}",status="{status}"}} {count}')
+
+    if admission:
+        lines.extend(render_admission(admission))
+
+    return "\n".join(lines) + "\n"
+
+
+def render_admission(admission: dict) -> list:
+    """Queue depth, in-flight gauges and admission counters per capped deployment."""
+    lines = []
+    for exposed, key, kind, help_text in (
+        ('admission_in_flight', 'in_flight', 'gauge', 'Admitted requests currently in flight.'),
+        ('admission_queue_depth', 'queued', 'gauge', 'Requests waiting for a concurrency slot.'),
+        ('admission_admitted_total', 'admitted', 'counter', 'Requests admitted by the concurrency limiter.')
+    ):
+        metric = f"{PREFIX}_{exposed}"
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for deployment, stats in sorted(admission.items()):
+            lines.append(f'{metric}{{deployment="{escape_label(deployment)}"}} {stats[key]}')
+
+    metric = f"{PREFIX}_admission_rejected_total"
+    lines.append(f"# HELP {metric} Requests rejected by the concurrency limiter, by reason.")
+    lines.append(f"# TYPE {metric} counter")
+    for deployment, stats in sorted(admission.items()):
+        for reason, count in sorted(stats["rejected"].items()):
+            lines.append(f'{metric}{{deployment="{escape_label(deployment)}",reason="{reason}"}} {count}')
+    return lines
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+# Request fields that don't change the completion
+IGNORED_FIELDS = ('stream_options', 'user', 'metadata')
+
+# Rough per-entry / per-line bookkeeping overhead counted against the memory cap
+ENTRY_OVERHEAD = 200
+LINE_OVERHEAD = 40
+
+
+def is_cacheable(body: dict) -> bool:
+    """Only deterministic single-choice requests (temperature 0) are cached."""
+    return body.get('temperature') == 0 and body.get('n', 1) == 1
+
+
+def cache_key(body: dict, authorization: str = '') -> str:
+    """
+    Hash of the caller's credentials and the normalized request body (sorted
+    keys, ignored fields dropped).
+
+    Entries are scoped to the Authorization header, so a completion is only
+    served to callers presenting the same key the upstream accepted for it.
+    """
+    normalized = {key: value for key, value in body.items() if key not in IGNORED_FIELDS}
+    normalized['stream'] = bool(normalized.get('stream', False))
+    normalized['_authorization'] = hashlib.sha256(authorization.encode('utf-8')).hexdigest()
+    encoded = json.dumps(normalized, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class CachedResponse:
+    """A stored upstream answer: raw SSE lines for streams, the body otherwise."""
+
+    __slots__ = ('lines', 'content', 'status', 'content_type', 'latency_ms', 'expires', 'size')
+
+    def __init__(self, lines: Optional[List[bytes]], content: Optional[bytes], status: int,
+                 content_type: str, latency_ms: float, expires: float):
+        self.lines = lines
+        self.content = content
+        self.status = status
+        self.content_type = content_type
+        self.latency_ms = latency_ms
+        self.expires = expires
+        if lines is not None:
+            self.size = ENTRY_OVERHEAD + sum(len(line) + LINE_OVERHEAD for line in lines)
+        else:
+            self.size = ENTRY_OVERHEAD + len(content or b'')
+
+
+class ResponseCache:
+    """
+    Exact-match LRU response cache with TTL expiry and a memory cap.
+
+    Thread-safe; counts hits, misses and the upstream latency saved by hits.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float = 300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved_latency_ms = 0.0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires < time.time():
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.saved_latency_ms += entry.latency_ms
+            return entry
+
+    def put_stream(self, key: str, lines: List[bytes], latency_ms: float):
+        """Store the SSE lines of a completed stream."""
+        self._put(key, CachedResponse(lines, None, 200, 'text/event-stream',
+                                      latency_ms, time.time() + self.ttl))
+
+    def put_response(self, key: str, content: bytes, status: int, content_type: str, latency_ms: float):
+        """Store a non-streaming response body."""
+        self._put(key, CachedResponse(None, content, status, content_type,
+                                      latency_ms, time.time() + self.ttl))
+
+    def _put(self, key: str, entry: CachedResponse):
+        if entry.size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = entry
+            self.bytes += entry.size
+
+            # Evict least recently used entries until under the cap
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key: str):
+        self.bytes -= self.entries.pop(key).size
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "saved_latency_ms": self.saved_latency_ms
+            }
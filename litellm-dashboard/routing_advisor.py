@@ -0,0 +1,212 @@
+"""
+Latency-aware routing advice from live proxy metrics.
+
+Scores every deployment in litellm_config.yaml from recent metrics (a
+time-decayed EWMA of TTFT, recent p95 TTFT and error rate) and turns the
+scores into recommended weights and fallback orderings, either as JSON
+(metrics_server.py's /routing/advice), as a config patch holding only the
+routing settings (?format=yaml), or as a full generated config (CLI only,
+since it contains the config's keys and credentials).
+
+Run with: python routing_advisor.py [output.yaml]
+to write a config from the shared metrics log.
+"""
+import copy
+import os
+import sys
+import time
+from typing import Dict, Optional
+
+import yaml
+
+from metrics_store import DDSketch, MetricsStore
+from upstream import deployment_name, find_model_entry, load_litellm_config
+
+# Recent metrics considered, and how fast old buckets stop counting
+WINDOW_SECONDS = 600
+HALF_LIFE_SECONDS = 60
+# Deployments with fewer recent samples are left unscored
+MIN_SAMPLES = 5
+# Score = (EWMA TTFT + TAIL_WEIGHT * p95 TTFT) * (1 + ERROR_PENALTY * error rate)
+TAIL_WEIGHT = 0.5
+ERROR_PENALTY = 10
+# Latency assumed for a deployment whose requests all failed before a first
+# token, when no deployment of its model_name has TTFT samples either (ms)
+UNMEASURED_TTFT_MS = 1000
+
+
+class RoutingAdvisor:
+    """Score deployments from a MetricsStore and recommend weights and fallback orders."""
+
+    def __init__(self,
+                 store: MetricsStore,
+                 config: dict = None,
+                 window: float = WINDOW_SECONDS,
+                 half_life: float = HALF_LIFE_SECONDS,
+                 min_samples: int = MIN_SAMPLES):
+        self.store = store
+        self.config = load_litellm_config() if config is None else config
+        self.window = window
+        self.half_life = half_life
+        self.min_samples = min_samples
+
+    def _entry_for(self, name: str) -> Optional[dict]:
+        return find_model_entry(self.config, name)
+
+    def scores(self, now: float = None) -> Dict[str, dict]:
+        """
+        Score every deployment with recent traffic (lower score is better).
+
+        Observed request models are mapped to their model_list entry, so
+        "anthropic/claude-3-opus-20240229" counts towards "anthropic/*".
+        Deployments whose requests all failed before a first token are scored
+        as the slowest deployment of their model_name, penalized by error rate.
+        Weights are normalized within each model_name, since LiteLLM only
+        balances between deployments of the same model_name.
+        """
+        now = time.time() if now is None else now
+        buckets = self.store.recent_buckets('10s', now - self.window)
+
+        totals = {}
+        for model, rows in buckets.items():
+            entry = self._entry_for(model)
+            name = deployment_name(entry) if entry else model
+            total = totals.setdefault(name, {
+                "model_name": entry.get('model_name', name) if entry else model,
+                "weighted_ttft": 0.0, "ttft_weight": 0.0, "decayed_count": 0.0,
+                "decayed_errors": 0.0, "samples": 0, "tail": DDSketch()
+            })
+
+            for start, count, errors, ttft, _ in rows:
+                # Time-decayed weights give an EWMA over irregular arrivals
+                decay = 0.5 ** (max(now - start, 0) / self.half_life)
+                if ttft.count:
+                    weight = decay * ttft.count
+                    total["weighted_ttft"] += weight * ttft.sum / ttft.count
+                    total["ttft_weight"] += weight
+                    total["tail"].merge(ttft)
+                total["decayed_count"] += decay * count
+                total["decayed_errors"] += decay * errors
+                total["samples"] += count
+
+        scores = {}
+        for name, total in totals.items():
+            if total["samples"] < self.min_samples:
+                continue
+
+            measured = bool(total["ttft_weight"])
+            scores[name] = {
+                "model_name": total["model_name"],
+                "ewma_ttft": total["weighted_ttft"] / total["ttft_weight"] if measured else None,
+                "p95_ttft": total["tail"].quantile(0.95) if measured else None,
+                "error_rate": total["decayed_errors"] / total["decayed_count"] if total["decayed_count"] else 0,
+                "samples": total["samples"]
+            }
+
+        groups = {}
+        for name, s in scores.items():
+            groups.setdefault(s["model_name"], []).append(s)
+
+        for group in groups.values():
+            latencies = [s["ewma_ttft"] + TAIL_WEIGHT * s["p95_ttft"] for s in group if s["ewma_ttft"] is not None]
+            slowest = max(latencies) if latencies else UNMEASURED_TTFT_MS * (1 + TAIL_WEIGHT)
+            for s in group:
+                latency = slowest if s["ewma_ttft"] is None else s["ewma_ttft"] + TAIL_WEIGHT * s["p95_ttft"]
+                s["score"] = latency * (1 + ERROR_PENALTY * s["error_rate"])
+
+            # Weights proportional to 1/score, summing to ~100 per model_name
+            inverse = [1 / max(s["score"], 1e-9) for s in group]
+            for s, inv in zip(group, inverse):
+                s["weight"] = max(1, round(100 * inv / sum(inverse)))
+
+        return scores
+
+    def _score_of(self, name: str, scores: Dict[str, dict]) -> float:
+        entry = self._entry_for(name)
+        key = deployment_name(entry) if entry else name
+        return scores[key]["score"] if key in scores else float('inf')
+
+    def fallbacks(self, scores: Dict[str, dict]) -> list:
+        """
+        Reorder each litellm_settings.fallbacks chain by score.
+
+        Targets without recent data keep their relative order after the scored ones.
+        """
+        chains = (self.config.get('litellm_settings') or {}).get('fallbacks') or []
+        reordered = []
+        for chain in chains:
+            reordered.append({
+                model: sorted(targets, key=lambda target: self._score_of(target, scores))
+                for model, targets in chain.items()
+            })
+        return reordered
+
+    def advice(self, now: float = None) -> dict:
+        """Return deployment scores, recommended weights and fallback orderings."""
+        now = time.time() if now is None else now
+        scores = self.scores(now)
+        return {
+            "generated_at": now,
+            "window_seconds": self.window,
+            "deployments": scores,
+            "fallbacks": self.fallbacks(scores)
+        }
+
+    def generate_patch(self, now: float = None) -> dict:
+        """
+        Return only the recommended routing settings, with no secrets.
+
+        Each model_list entry carries its model_name, model_info.id (when set,
+        to tell deployments apart) and litellm_params.weight.
+        """
+        advice = self.advice(now)
+        model_list = []
+
+        for entry in self.config.get('model_list') or []:
+            name = deployment_name(entry)
+            if name not in advice["deployments"]:
+                continue
+            patched = {"model_name": entry.get('model_name')}
+            model_id = (entry.get('model_info') or {}).get('id')
+            if model_id:
+                patched["model_info"] = {"id": model_id}
+            patched["litellm_params"] = {"weight": advice["deployments"][name]["weight"]}
+            model_list.append(patched)
+
+        patch = {"model_list": model_list}
+        if advice["fallbacks"]:
+            patch["litellm_settings"] = {"fallbacks": advice["fallbacks"]}
+        return patch
+
+    def generate_config(self, now: float = None) -> dict:
+        """
+        Return a copy of the litellm config with recommended weights and fallbacks applied.
+
+        The copy includes master_key, database_url and every api_key, so it is
+        only written by the CLI, never served.
+        """
+        advice = self.advice(now)
+        config = copy.deepcopy(self.config)
+
+        for entry in config.get('model_list') or []:
+            name = deployment_name(entry)
+            if name in advice["deployments"]:
+                entry.setdefault('litellm_params', {})['weight'] = advice["deployments"][name]["weight"]
+
+        if advice["fallbacks"]:
+            config.setdefault('litellm_settings', {})['fallbacks'] = advice["fallbacks"]
+
+        return config
+
+
+if __name__ == '__main__':
+    log_path = os.environ.get('METRICS_LOG_PATH', 'metrics_log.bin')
+    advisor = RoutingAdvisor(MetricsStore(log_path=log_path))
+    generated = yaml.safe_dump(advisor.generate_config(), sort_keys=False)
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'w', encoding='utf-8') as f:
+            f.write(generated)
+        print(f"Wrote routing config to {sys.argv[1]}")
+    else:
+        print(generated)
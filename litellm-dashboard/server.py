@@ -1,20 +1,45 @@
 from flask import Flask, request, jsonify
-import requests
+import os
 import time
 import json
 from datetime import datetime
 from flask_cors import CORS
+from upstream import UpstreamPool, UPSTREAM_URL
+from sse import TokenTimer, FIRST_TOKEN, DONE
+from hedging import Hedger
 
 app = Flask(__name__)
 CORS(app)
 
+# Keep-alive connections to the upstream, shared by all request threads
+upstream_pool = UpstreamPool(pool_size=int(os.environ.get('UPSTREAM_POOL_SIZE', 100)))
+
+# Optional hedging of streams whose first token is late (HEDGE_REQUESTS=1 to enable)
+hedger = Hedger(
+    upstream_pool,
+    percentile=float(os.environ.get('HEDGE_PERCENTILE', 0.95))
+) if os.environ.get('HEDGE_REQUESTS') == '1' else None
+
+@app.route('/pool-stats', methods=['GET'])
+def pool_stats():
+    """Return upstream connection reuse counters"""
+    return jsonify(upstream_pool.stats())
+
+@app.route('/hedge-stats', methods=['GET'])
+def hedge_stats():
+    """Return how often hedged requests fired and won"""
+    if hedger is None:
+        return jsonify({"enabled": False})
+    return jsonify(hedger.stats())
+
 @app.route('/proxy-chat', methods=['POST'])
 def proxy_chat():
     """
     Proxy the chat completion request to LiteLLM and measure latency metrics
     """
     data = request.json
-    url = "http://3.110.176.254:4000/chat/completions"
+    url = UPSTREAM_URL
+    model = data.get('model', 'unknown')
     headers = {
         "Content-Type": "application/json",
         "Authorization": request.headers.get('Authorization', '')
@@ -25,7 +50,7 @@ def proxy_chat():
         start_time = time.time()
         start_ms = int(start_time * 1000)
         
-        response = requests.post(url, headers=headers, json=data)
+        response = upstream_pool.post(url, model, headers=headers, json=data)
         
         end_time = time.time()
         end_ms = int(end_time * 1000)
@@ -48,9 +73,7 @@ def proxy_chat():
     def generate():
         start_time = time.time()
         start_ms = int(start_time * 1000)
-        first_token_received = False
-        first_token_ms = None
-        last_token_ms = None
+        timer = TokenTimer()
         
         # Initialize with start time
         yield json.dumps({
@@ -60,64 +83,45 @@ def proxy_chat():
             }
         }) + '\n\n'
         
-        response = requests.post(url, headers=headers, json=data, stream=True)
+        if hedger is not None:
+            response = hedger.stream(url, model, headers, data)
+        else:
+            response = upstream_pool.post(url, model, headers=headers, json=data, stream=True)
         
-        for line in response.iter_lines():
-            if line:
-                current_time = time.time()
-                current_ms = int(current_time * 1000)
-                decoded_line = line.decode('utf-8')
-                
-                # Forward the original data
-                yield decoded_line + '\n\n'
-                
-                if decoded_line.startswith("data: ") and decoded_line != "data: [DONE]":
-                    try:
-                        json_str = decoded_line[6:]  # Remove "data: " prefix
-                        token_data = json.loads(json_str)
-                        
-                        # Check if this contains actual content
-                        if "choices" in token_data and token_data["choices"] and "delta" in token_data["choices"][0]:
-                            delta = token_data["choices"][0]["delta"]
-                            
-                            if "content" in delta and delta["content"]:
-                                if not first_token_received:
-                                    first_token_received = True
-                                    first_token_ms = current_ms
-                                    ttft_ms = first_token_ms - start_ms
-                                    
-                                    # Send first token metric
-                                    yield json.dumps({
-                                        'event': 'metrics',
-                                        'data': {
-                                            'first_token_time': first_token_ms,
-                                            'ttft': ttft_ms
-                                        }
-                                    }) + '\n\n'
-                                
-                                last_token_ms = current_ms
-                                
-                    except json.JSONDecodeError:
-                        pass
+        try:
+            for line in response.iter_lines():
+                if line:
+                    current_ms = int(time.time() * 1000)
+                    
+                    # Forward the original bytes unchanged
+                    yield line + b'\n\n'
                     
-                elif decoded_line == "data: [DONE]":
-                    end_ms = current_ms
-                    total_time_ms = end_ms - start_ms
+                    event = timer.feed(line, current_ms)
                     
-                    # Calculate metrics
-                    generation_time_ms = 0
-                    if first_token_ms and last_token_ms:
-                        generation_time_ms = last_token_ms - first_token_ms
+                    if event == FIRST_TOKEN:
+                        # Send first token metric
+                        yield json.dumps({
+                            'event': 'metrics',
+                            'data': {
+                                'first_token_time': timer.first_token_ms,
+                                'ttft': timer.first_token_ms - start_ms
+                            }
+                        }) + '\n\n'
                     
-                    # Send final metrics
-                    yield json.dumps({
-                        'event': 'metrics',
-                        'data': {
-                            'end_time': end_ms,
-                            'total_time': total_time_ms,
-                            'generation_time': generation_time_ms
-                        }
-                    }) + '\n\n'
+                    elif event == DONE:
+                        # Send final metrics
+                        yield json.dumps({
+                            'event': 'metrics',
+                            'data': {
+                                'end_time': current_ms,
+                                'total_time': current_ms - start_ms,
+                                'generation_time': timer.generation_time_ms or 0,
+                                **timer.itl_stats()
+                            }
+                        }) + '\n\n'
+        finally:
+            # Return the connection to the pool, also when the client disconnects
+            response.close()
     
     return app.response_class(generate(), mimetype='text/event-stream')
 
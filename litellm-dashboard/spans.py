@@ -0,0 +1,72 @@
+"""
+Monotonic per-stage timing spans for the proxy forwarding path.
+
+A StageTimer attributes the time since the previous mark to a named stage
+(perf_counter_ns, so spans are immune to wall-clock jumps). SpanStats
+aggregates finished requests per model, so a TTFT regression can be split into
+the proxy's own work and time spent waiting on the provider.
+"""
+import threading
+from time import perf_counter_ns
+from typing import Dict
+
+from metrics_store import DDSketch
+
+# Stages that are the proxy's own work; every other stage is upstream/provider time
+OVERHEAD_STAGES = ('parse', 'cache', 'admission', 'response_start', 'sse_processing', 'client_write', 'respond')
+
+
+class StageTimer:
+    """Per-request stage spans in nanoseconds."""
+
+    __slots__ = ('start_ns', 'last_ns', 'spans')
+
+    def __init__(self, start_ns: int = None):
+        self.start_ns = self.last_ns = perf_counter_ns() if start_ns is None else start_ns
+        self.spans: Dict[str, int] = {}
+
+    def mark(self, stage: str):
+        """Add the time since the previous mark to a stage."""
+        now = perf_counter_ns()
+        self.spans[stage] = self.spans.get(stage, 0) + now - self.last_ns
+        self.last_ns = now
+
+    def ms(self) -> Dict[str, float]:
+        """Return stage durations in ms, plus overhead, upstream and total."""
+        result = {stage: ns / 1e6 for stage, ns in self.spans.items()}
+        overhead = sum(ns for stage, ns in self.spans.items() if stage in OVERHEAD_STAGES)
+        result["overhead"] = overhead / 1e6
+        result["upstream"] = (sum(self.spans.values()) - overhead) / 1e6
+        result["total"] = (self.last_ns - self.start_ns) / 1e6
+        return result
+
+    def server_timing(self) -> str:
+        """Format the spans as a Server-Timing header value (durations in ms)."""
+        return ", ".join(f"{stage};dur={duration:.3f}" for stage, duration in self.ms().items())
+
+
+class SpanStats:
+    """Thread-safe per-model sketches of every stage's duration (ms)."""
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.by_model: Dict[str, Dict[str, DDSketch]] = {}
+        self.lock = threading.Lock()
+
+    def record(self, model: str, durations: Dict[str, float]):
+        """Add one request's stage durations in ms (StageTimer.ms())."""
+        with self.lock:
+            sketches = self.by_model.setdefault(model, {})
+            for stage, duration in durations.items():
+                sketch = sketches.get(stage)
+                if sketch is None:
+                    sketch = sketches[stage] = DDSketch(self.relative_accuracy)
+                sketch.add(duration)
+
+    def stats(self) -> Dict[str, Dict[str, dict]]:
+        """Return {model: {stage: summary}} with mean/median/p95/p99 in ms."""
+        with self.lock:
+            return {
+                model: {stage: sketch.summary() for stage, sketch in sketches.items()}
+                for model, sketches in self.by_model.items()
+            }
@@ -0,0 +1,134 @@
+import json
+import math
+from time import perf_counter
+from array import array
+from bisect import bisect_right
+
+DATA_PREFIX = b"data: "
+DONE_LINE = b"data: [DONE]"
+CONTENT_STRING = b'"content":"'
+CONTENT_STRING_SPACED = b'"content": "'
+QUOTE = ord('"')
+
+# Gaps between tokens longer than this count as stalls
+STALL_THRESHOLD_MS = 1000
+
+# TokenTimer.feed events
+FIRST_TOKEN = 1
+DONE = 2
+
+
+def inter_token_stats(times, stall_threshold: float) -> dict:
+    """
+    Summarise the gaps between successive token arrival times.
+
+    Args:
+        times: Token arrival times in increasing order (any unit)
+        stall_threshold: Gaps longer than this count as stalls (same unit)
+
+    Returns:
+        Dictionary with mean_itl, p99_itl, max_itl (same unit as times) and
+        stalls; all zero with fewer than two tokens
+    """
+    if len(times) < 2:
+        return {"mean_itl": 0.0, "p99_itl": 0.0, "max_itl": 0.0, "stalls": 0}
+
+    gaps = sorted(later - earlier for earlier, later in zip(times, times[1:]))
+    return {
+        "mean_itl": sum(gaps) / len(gaps),
+        "p99_itl": gaps[max(math.ceil(0.99 * len(gaps)) - 1, 0)],
+        "max_itl": gaps[-1],
+        "stalls": len(gaps) - bisect_right(gaps, stall_threshold)
+    }
+
+
+def has_content(line: bytes) -> bool:
+    """Return True if an SSE line carries a non-empty choices[0].delta.content (full parse)."""
+    if not line.startswith(DATA_PREFIX) or line == DONE_LINE:
+        return False
+    try:
+        token_data = json.loads(line[6:])
+    except ValueError:
+        return False
+    choices = token_data.get("choices") if isinstance(token_data, dict) else None
+    if not choices or not isinstance(choices[0], dict):
+        return False
+    return bool((choices[0].get("delta") or {}).get("content"))
+
+
+def scan_content(line: bytes) -> bool:
+    """
+    Cheap byte-level check for a non-empty "content" string in an SSE line.
+
+    Only looks for `"content":` followed by a non-empty string literal, so it
+    can't tell which choice the content belongs to; good enough for timing
+    tokens once the stream is known to carry content.
+    """
+    index = line.find(CONTENT_STRING)
+    if index >= 0:
+        index += len(CONTENT_STRING)
+    else:
+        index = line.find(CONTENT_STRING_SPACED)
+        if index < 0:
+            return False
+        index += len(CONTENT_STRING_SPACED)
+    # An empty string closes immediately
+    return index < len(line) and line[index] != QUOTE
+
+
+class TokenTimer:
+    """
+    Track first/last content-token times over raw SSE lines.
+
+    Lines are fully JSON-parsed only until the first content token; after that
+    a byte scan (scan_content) is enough to move the last-token time, so the
+    per-chunk cost stays close to plain forwarding. Content arrival times are
+    also kept (perf_counter ms in a float array) for inter-token latency.
+    """
+
+    __slots__ = ('first_token_ms', 'last_token_ms', 'done_ms', 'token_times')
+
+    def __init__(self):
+        self.first_token_ms = None
+        self.last_token_ms = None
+        self.done_ms = None
+        self.token_times = array('d')
+
+    def feed(self, line: bytes, now_ms: int) -> int:
+        """
+        Account for one SSE line received at now_ms.
+
+        Returns:
+            FIRST_TOKEN for the first content token, DONE for "data: [DONE]",
+            otherwise 0
+        """
+        if self.first_token_ms is not None:
+            if scan_content(line):
+                self.last_token_ms = now_ms
+                self.token_times.append(perf_counter() * 1000)
+                return 0
+            if line == DONE_LINE:
+                self.done_ms = now_ms
+                return DONE
+            return 0
+
+        if has_content(line):
+            self.first_token_ms = self.last_token_ms = now_ms
+            self.token_times.append(perf_counter() * 1000)
+            return FIRST_TOKEN
+
+        if line == DONE_LINE:
+            self.done_ms = now_ms
+            return DONE
+        return 0
+
+    @property
+    def generation_time_ms(self):
+        """Time between the first and last content tokens, or None without content."""
+        if self.first_token_ms is None:
+            return None
+        return self.last_token_ms - self.first_token_ms
+
+    def itl_stats(self, stall_threshold_ms: float = STALL_THRESHOLD_MS) -> dict:
+        """Inter-token latency summary in ms (see inter_token_stats)."""
+        return inter_token_stats(self.token_times, stall_threshold_ms)
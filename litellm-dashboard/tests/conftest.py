@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The proxy modules live flat in litellm-dashboard/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
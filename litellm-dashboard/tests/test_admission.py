@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, ModelLimiter, Rejected
+
+
+def test_full_queue_is_rejected_with_429():
+    limiter = ModelLimiter(1, max_queue=0)
+    limiter.acquire()
+
+    with pytest.raises(Rejected) as rejected:
+        limiter.acquire()
+
+    assert rejected.value.status == 429
+    assert rejected.value.reason == "queue_full"
+    assert rejected.value.retry_after >= 1
+    assert limiter.stats()["rejected"]["queue_full"] == 1
+
+
+def test_queue_timeout_is_rejected_with_503():
+    limiter = ModelLimiter(1, max_queue=1, queue_timeout=0.05)
+    limiter.acquire()
+
+    start = time.monotonic()
+    with pytest.raises(Rejected) as rejected:
+        limiter.acquire()
+
+    assert time.monotonic() - start >= 0.05
+    assert rejected.value.status == 503
+    assert rejected.value.reason == "queue_timeout"
+    assert limiter.stats()["queued"] == 0
+
+
+def test_queued_request_is_admitted_when_a_slot_is_released():
+    limiter = ModelLimiter(1, max_queue=1, queue_timeout=5)
+    slot = limiter.acquire()
+    admitted = []
+
+    waiter = threading.Thread(target=lambda: admitted.append(limiter.acquire()))
+    waiter.start()
+    deadline = time.time() + 5
+    while limiter.stats()["queued"] == 0 and time.time() < deadline:
+        time.sleep(0.01)
+
+    slot.release()
+    waiter.join(5)
+
+    assert len(admitted) == 1
+    assert limiter.stats()["in_flight"] == 1
+
+
+def test_slot_is_released_exactly_once():
+    limiter = ModelLimiter(2)
+    slot = limiter.acquire()
+    other = limiter.acquire()
+
+    slot.release()
+    slot.release()
+
+    assert limiter.stats()["in_flight"] == 1
+    other.release()
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_controller_limits_only_capped_deployments():
+    config = {"model_list": [
+        {"model_name": "capped", "litellm_params": {"max_parallel_requests": 1},
+         "model_info": {"max_queue": 0}},
+        {"model_name": "open", "litellm_params": {}}
+    ]}
+    admission = AdmissionController(config)
+
+    slot = admission.admit("capped")
+    with pytest.raises(Rejected):
+        admission.admit("capped")
+    for _ in range(5):
+        admission.admit("open")
+
+    slot.release()
+    admission.admit("capped").release()
+    assert admission.stats()["capped"]["admitted"] == 2
+    assert "open" not in admission.stats()
+
+
+def test_unknown_models_are_not_cached():
+    config = {"model_list": [
+        {"model_name": "capped", "litellm_params": {"max_parallel_requests": 1}}
+    ]}
+    admission = AdmissionController(config)
+
+    for i in range(100):
+        admission.admit(f"made-up-{i}").release()
+    admission.admit("capped").release()
+
+    assert list(admission.models) == ["capped"]
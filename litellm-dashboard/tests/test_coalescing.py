@@ -0,0 +1,68 @@
+import threading
+import time
+
+from coalescing import SingleFlight
+
+
+def test_late_joiner_gets_every_line():
+    single_flight = SingleFlight()
+    first_published = threading.Event()
+    release = threading.Event()
+
+    def fetch(flight):
+        flight.set_status(200)
+        flight.publish(b"one")
+        first_published.set()
+        release.wait(5)
+        flight.publish(b"two")
+        flight.publish(b"three")
+
+    first, started = single_flight.join("key", fetch)
+    assert started
+    first_published.wait(5)
+
+    late, started = single_flight.join("key", fetch)
+    assert not started
+    assert late is first
+
+    results = {}
+    readers = [
+        threading.Thread(target=lambda name=name, flight=flight: results.setdefault(name, list(flight.iter_lines())))
+        for name, flight in (("first", first), ("late", late))
+    ]
+    for reader in readers:
+        reader.start()
+    release.set()
+    for reader in readers:
+        reader.join(5)
+
+    assert results == {"first": [b"one", b"two", b"three"], "late": [b"one", b"two", b"three"]}
+    assert single_flight.stats()["upstream_calls"] == 1
+    assert single_flight.stats()["coalesced_requests"] == 1
+
+
+def test_key_is_released_when_the_fetch_finishes():
+    single_flight = SingleFlight()
+    flight, _ = single_flight.join("key", lambda flight: flight.finish(response=(b"{}", 200, [])))
+    assert flight.wait(5) == (b"{}", 200, [])
+
+    deadline = time.time() + 5
+    while single_flight.stats()["in_flight"] and time.time() < deadline:
+        time.sleep(0.01)
+
+    _, started = single_flight.join("key", lambda flight: None)
+    assert started
+
+
+def test_failed_fetch_ends_readers_with_the_error():
+    single_flight = SingleFlight()
+
+    def fetch(flight):
+        flight.publish(b"partial")
+        raise ConnectionError("upstream went away")
+
+    flight, _ = single_flight.join("key", fetch)
+
+    assert list(flight.iter_lines(timeout=5)) == [b"partial"]
+    assert isinstance(flight.error, ConnectionError)
+    assert flight.wait(5) is None
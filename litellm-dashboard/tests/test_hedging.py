@@ -0,0 +1,153 @@
+import json
+import threading
+import time
+
+import pytest
+
+from hedging import Hedger
+
+CONFIG = {
+    "model_list": [{"model_name": "primary"}, {"model_name": "fallback"}],
+    "litellm_settings": {"fallbacks": [{"primary": ["fallback"]}]}
+}
+
+
+def chunk(content: str) -> bytes:
+    return b"data: " + json.dumps({"choices": [{"delta": {"content": content}}]}).encode()
+
+
+ROLE = b"data: " + json.dumps({"choices": [{"delta": {"role": "assistant", "content": ""}}]}).encode()
+DONE = b"data: [DONE]"
+
+
+class StubResponse:
+    """Streams scripted (delay seconds, line) pairs; close() stops the stream."""
+
+    def __init__(self, status_code: int, script):
+        self.status_code = status_code
+        self.script = script
+        self.closed = threading.Event()
+
+    def iter_lines(self):
+        for delay, line in self.script:
+            if self.closed.wait(delay):
+                return
+            yield line
+
+    def close(self):
+        self.closed.set()
+
+
+class StubPool:
+    """Stands in for UpstreamPool: one scripted response (or exception) per model."""
+
+    def __init__(self, responses: dict):
+        self.config = CONFIG
+        self.responses = responses
+        self.posted = []
+
+    def post(self, url, model, headers=None, json=None, stream=False):
+        self.posted.append(model)
+        response = self.responses[model]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def hedger_for(responses: dict, delay_ms: float = 50) -> tuple:
+    pool = StubPool(responses)
+    return Hedger(pool, default_delay_ms=delay_ms), pool
+
+
+def test_hedge_fires_after_delay_and_wins():
+    slow = StubResponse(200, [(0, ROLE), (2, chunk("slow")), (0, DONE)])
+    fast = StubResponse(200, [(0, ROLE), (0, chunk("fast")), (0, DONE)])
+    hedger, pool = hedger_for({"primary": slow, "fallback": fast})
+
+    start = time.perf_counter()
+    stream = hedger.stream("http://upstream", "primary", {}, {"model": "primary"})
+    lines = list(stream.iter_lines())
+
+    assert time.perf_counter() - start < 1
+    assert lines == [ROLE, chunk("fast"), DONE]
+    assert pool.posted == ["primary", "fallback"]
+    assert stream.status_code == 200
+    assert stream.answered_model == "fallback"
+    assert slow.closed.is_set()
+    assert hedger.stats()["models"]["primary"]["hedges_won"] == 1
+    # The cut-off primary still counts, as a lower bound on its TTFT
+    assert hedger.sketches["primary"].count == 1
+    assert hedger.sketches["primary"].quantile(0.5) >= 40
+
+
+def test_no_hedge_when_primary_is_fast():
+    fast = StubResponse(200, [(0, chunk("primary")), (0, DONE)])
+    hedger, pool = hedger_for({"primary": fast, "fallback": StubResponse(200, [])}, delay_ms=1000)
+
+    lines = list(hedger.stream("http://upstream", "primary", {}, {}).iter_lines())
+
+    assert lines == [chunk("primary"), DONE]
+    assert pool.posted == ["primary"]
+    assert hedger.stats()["hedges_fired"] == 0
+
+
+def test_primary_failure_before_delay_hedges_immediately():
+    failed = StubResponse(500, [(0, b'{"error": "boom"}')])
+    fallback = StubResponse(200, [(0, chunk("fallback")), (0, DONE)])
+    hedger, pool = hedger_for({"primary": failed, "fallback": fallback}, delay_ms=5000)
+
+    start = time.perf_counter()
+    stream = hedger.stream("http://upstream", "primary", {}, {})
+    lines = list(stream.iter_lines())
+
+    assert time.perf_counter() - start < 1
+    assert lines == [chunk("fallback"), DONE]
+    assert stream.status_code == 200
+
+
+def test_primary_client_error_is_returned_without_hedging():
+    rejected = StubResponse(400, [(0, b'{"error": "bad request"}')])
+    fallback = StubResponse(200, [(0, chunk("fallback")), (0, DONE)])
+    hedger, pool = hedger_for({"primary": rejected, "fallback": fallback}, delay_ms=5000)
+
+    stream = hedger.stream("http://upstream", "primary", {}, {})
+    lines = list(stream.iter_lines())
+
+    assert lines == [b'{"error": "bad request"}']
+    assert pool.posted == ["primary"]
+    assert stream.status_code == 400
+    assert stream.answered_model == "primary"
+
+
+def test_both_failing_surfaces_the_primary_response():
+    primary = StubResponse(500, [(0, b'{"error": "primary"}')])
+    fallback = StubResponse(503, [(0, b'{"error": "fallback"}')])
+    hedger, _ = hedger_for({"primary": primary, "fallback": fallback})
+
+    stream = hedger.stream("http://upstream", "primary", {}, {})
+    lines = list(stream.iter_lines())
+
+    assert lines == [b'{"error": "primary"}']
+    assert stream.status_code == 500
+
+
+def test_both_raising_raises_the_primary_error():
+    hedger, _ = hedger_for({"primary": ConnectionError("primary"), "fallback": ConnectionError("fallback")})
+
+    stream = hedger.stream("http://upstream", "primary", {}, {})
+    with pytest.raises(ConnectionError, match="primary"):
+        list(stream.iter_lines())
+
+
+def test_client_disconnect_closes_both_attempts():
+    slow = StubResponse(200, [(2, chunk("slow")), (0, DONE)])
+    fallback = StubResponse(200, [(0, chunk("first")), (2, chunk("second")), (0, DONE)])
+    hedger, _ = hedger_for({"primary": slow, "fallback": fallback})
+
+    lines = hedger.stream("http://upstream", "primary", {}, {}).iter_lines()
+    assert next(lines) == chunk("first")
+    # What the WSGI server does when the client goes away mid-stream
+    lines.close()
+
+    assert slow.closed.is_set()
+    assert fallback.closed.is_set()
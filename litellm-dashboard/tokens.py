@@ -0,0 +1,90 @@
+import logging
+from functools import lru_cache
+
+# Encodings for model families tiktoken doesn't know by name
+O200K_PREFIXES = ('gpt-4o', 'gpt-4.1', 'gpt-4.5', 'o1', 'o3', 'o4', 'chatgpt-4o')
+DEFAULT_ENCODING = 'cl100k_base'
+
+# Rough characters-per-token ratio used when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+
+def model_family(model: str) -> str:
+    """Strip the LiteLLM provider prefix ("openai/gpt-4o" -> "gpt-4o")."""
+    return model.rsplit('/', 1)[-1]
+
+
+@lru_cache(maxsize=256)
+def encoding_name(model: str) -> str:
+    """
+    Return the tiktoken encoding name for a model.
+
+    Non-OpenAI models (Anthropic, Gemini) use cl100k_base as an approximation.
+    """
+    name = model_family(model)
+    try:
+        from tiktoken.model import encoding_name_for_model
+        return encoding_name_for_model(name)
+    except (ImportError, KeyError):
+        pass
+
+    if name.startswith(O200K_PREFIXES):
+        return 'o200k_base'
+    return DEFAULT_ENCODING
+
+
+@lru_cache(maxsize=None)
+def load_encoding(name: str):
+    """
+    Return a tiktoken encoding by name, loaded once and cached.
+
+    Returns None if tiktoken is not installed or the encoding can't be loaded
+    (e.g. its BPE file can't be downloaded offline). Failures are cached too,
+    so they are not retried on every call.
+    """
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(name)
+    except ImportError:
+        return None
+    except Exception as e:
+        logging.warning(f"Could not load tiktoken encoding {name}, estimating tokens instead: {e}")
+        return None
+
+
+def get_encoding(model: str):
+    """Return the tiktoken encoding for a model, or None if it is unavailable."""
+    return load_encoding(encoding_name(model))
+
+
+def count_tokens(text: str, model: str) -> int:
+    """
+    Count tokens in text with the model's tokenizer.
+
+    Falls back to a character-based estimate when the tokenizer is unavailable.
+    """
+    if not text:
+        return 0
+
+    encoding = get_encoding(model)
+    if encoding is None:
+        return max(1, round(len(text) / CHARS_PER_TOKEN))
+
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def completion_tokens(usage, text: str, model: str) -> tuple:
+    """
+    Return (token count, source) for a completion.
+
+    Prefers the upstream's usage.completion_tokens (what the provider bills),
+    then the model's tokenizer, then the character estimate. Source is
+    "usage", "tokenizer" or "estimate".
+    """
+    reported = getattr(usage, 'completion_tokens', None) if usage is not None else None
+    if reported is not None:
+        return reported, "usage"
+
+    if get_encoding(model) is None:
+        return count_tokens(text, model), "estimate"
+    return count_tokens(text, model), "tokenizer"
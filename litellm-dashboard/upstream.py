@@ -0,0 +1,133 @@
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from fnmatch import fnmatch
+
+import requests
+import yaml
+from requests.adapters import HTTPAdapter
+
+UPSTREAM_URL = os.environ.get('LITELLM_UPSTREAM_URL', "http://3.110.176.254:4000/chat/completions")
+CONFIG_PATH = os.environ.get(
+    'LITELLM_CONFIG_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'litellm_config.yaml')
+)
+
+# Used when neither the model entry nor general_settings set a timeout
+DEFAULT_TIMEOUT = 30
+DEFAULT_CONNECT_TIMEOUT = 3.05
+
+
+def load_litellm_config(path: str = CONFIG_PATH) -> dict:
+    """Load litellm_config.yaml, returning an empty config if it is missing."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        return {}
+
+
+def deployment_name(entry: dict) -> str:
+    """Name a model_list entry by its model_info.id, falling back to its model_name."""
+    return (entry.get('model_info') or {}).get('id') or entry.get('model_name', 'unknown')
+
+
+def find_model_entry(config: dict, model: str):
+    """
+    Find the model_list entry serving a model name.
+
+    Matches model_name exactly, then model_info.id, then wildcard entries
+    such as "anthropic/*".
+    """
+    entries = config.get('model_list') or []
+
+    for entry in entries:
+        if entry.get('model_name') == model or (entry.get('model_info') or {}).get('id') == model:
+            return entry
+
+    for entry in entries:
+        pattern = entry.get('model_name', '')
+        if '*' in pattern and fnmatch(model, pattern):
+            return entry
+
+    return None
+
+
+def model_timeout(config: dict, model: str, stream: bool) -> float:
+    """Return the read timeout in seconds for a model from the litellm config."""
+    params = (find_model_entry(config, model) or {}).get('litellm_params') or {}
+    general = (config.get('general_settings') or {}).get('timeout', DEFAULT_TIMEOUT)
+    read = params.get('timeout', general)
+    if stream:
+        read = params.get('stream_timeout', read)
+    return read
+
+
+class UpstreamPool:
+    """
+    Shared, thread-safe pool of keep-alive connections to the LiteLLM upstream.
+
+    Read timeouts come from the model's timeout/stream_timeout in
+    litellm_config.yaml (falling back to general_settings.timeout).
+    """
+
+    def __init__(self,
+                 pool_size: int = 100,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 block: bool = False,
+                 config: dict = None):
+        """
+        Args:
+            pool_size: Connections kept alive per upstream host
+            connect_timeout: Seconds allowed to establish a connection
+            block: Wait for a free connection instead of opening an extra one
+            config: Parsed litellm config (default: load CONFIG_PATH)
+        """
+        self.config = load_litellm_config() if config is None else config
+        self.connect_timeout = connect_timeout
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=block)
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self.session.headers['Connection'] = 'keep-alive'
+        # The session is shared by every caller, so it must not carry cookies between them
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self._timeouts = {}
+        self._lock = threading.Lock()
+
+    def timeout(self, model: str, stream: bool) -> tuple:
+        """Return the (connect, read) timeout for a model."""
+        key = (model, stream)
+        if key not in self._timeouts:
+            read = model_timeout(self.config, model, stream)
+            with self._lock:
+                self._timeouts[key] = (self.connect_timeout, read)
+
+        return self._timeouts[key]
+
+    def post(self, url: str, model: str, stream: bool = False, **kwargs) -> requests.Response:
+        """POST through the pool with the model's timeouts."""
+        kwargs.setdefault('timeout', self.timeout(model, stream))
+        return self.session.post(url, stream=stream, **kwargs)
+
+    def stats(self) -> dict:
+        """
+        Return connection reuse counters across all upstream hosts.
+
+        A hit is a request sent on an already-open connection; a miss had to
+        open a new one.
+        """
+        requests_sent = connections = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                requests_sent += pool.num_requests
+                connections += pool.num_connections
+
+        return {
+            "requests": requests_sent,
+            "hits": max(requests_sent - connections, 0),
+            "misses": connections,
+            "hit_rate": (requests_sent - connections) / requests_sent if requests_sent else None
+        }